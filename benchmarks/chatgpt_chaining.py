@@ -0,0 +1,56 @@
+"""
+Bytes sent per step by ChatGPTAPI, with and without server-side response chaining.
+
+Plays N_STEPS steps with the recorded SMB screenshot history against a stand-in for the
+OpenAI client, so no network access nor API key is needed, and reports the size of the input
+sent with each request and in total.
+
+Run from the repository root: python -m benchmarks.chatgpt_chaining
+"""
+import contextlib
+import io
+import itertools
+from types import SimpleNamespace
+
+from chatgpt import ChatGPTAPI, ChatGPTModels
+from mesen_python import PromptImage
+
+RECORDED_FRAMES_PATH = "data/smb/recent_frames.png"
+N_STEPS = 50
+REPORTED_STEPS = (1, 2, 10, 25, 50)
+
+
+class FakeResponses:
+    """Answers every request like the Responses API, without generating anything"""
+    def __init__(self):
+        self.ids = itertools.count()
+
+
+    def create(self, model: str, input: list, previous_response_id: str=None, stream: bool=False):
+        return SimpleNamespace(id=f"resp_{next(self.ids)}", output_text="right,b", usage=None)
+
+
+def run(chain_responses: bool) -> list:
+    """Returns the size of the input sent at each step"""
+    llm = ChatGPTAPI(ChatGPTModels.NANO_5, api_key="unused", chain_responses=chain_responses)
+    llm.client = SimpleNamespace(responses=FakeResponses())
+    image = PromptImage.from_file(RECORDED_FRAMES_PATH)
+    llm.start_new_chat()
+    sizes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(N_STEPS):
+            llm.add_text_to_prompt("Progress: 1-1 (10.0 %)")
+            llm.send_image_prompt(image)
+            sizes.append(llm.last_request_size)
+    return sizes
+
+
+def main():
+    for chain_responses in (False, True):
+        sizes = run(chain_responses)
+        steps = ", ".join(f"step {step}: {sizes[step - 1]} B" for step in REPORTED_STEPS)
+        print(f"{'chained' if chain_responses else 'full history':>12}: {steps}, total: {sum(sizes)} B")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
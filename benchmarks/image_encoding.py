@@ -0,0 +1,65 @@
+"""
+Benchmark of the encodings of the image given to the LLM.
+
+Encodes recorded SMB and TLOZ screenshot histories with every ImageEncoder option and
+reports the encode time and the size of the image. Every encoding is checked to be lossless.
+
+Run from the repository root: python -m benchmarks.image_encoding
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from mesen_python.games import (
+    ImageEncoder, IMAGE_FORMAT_PNG, IMAGE_FORMAT_NES_PNG, IMAGE_FORMAT_WEBP, DEFAULT_PNG_COMPRESS_LEVEL
+)
+
+RECORDED_FRAMES_PATHS = {
+    "SMB": "data/smb/recent_frames.png",
+    "TLOZ": "data/tloz/recent_frames.png",
+}
+N_ENCODES = 50
+ENCODERS = (
+    ImageEncoder(IMAGE_FORMAT_PNG, 1),
+    ImageEncoder(IMAGE_FORMAT_PNG, DEFAULT_PNG_COMPRESS_LEVEL),
+    ImageEncoder(IMAGE_FORMAT_PNG, 9),
+    ImageEncoder(IMAGE_FORMAT_NES_PNG, 1),
+    ImageEncoder(IMAGE_FORMAT_NES_PNG, DEFAULT_PNG_COMPRESS_LEVEL),
+    ImageEncoder(IMAGE_FORMAT_NES_PNG, 9),
+    ImageEncoder(IMAGE_FORMAT_WEBP),
+)
+
+
+def encode_rgba_png(pixels: np.ndarray) -> bytes:
+    """Previous encoding: 32-bit RGBA PNG at the default compression"""
+    output = io.BytesIO()
+    Image.fromarray(pixels).convert("RGBA").save(output, format="PNG")
+    return output.getvalue()
+
+
+def measure(encode, pixels: np.ndarray):
+    """Returns the average encode time in milliseconds and the encoded bytes"""
+    start = time.perf_counter()
+    for _ in range(N_ENCODES):
+        data = encode(pixels)
+    return (time.perf_counter() - start) / N_ENCODES * 1000, data
+
+
+def main():
+    for game, path in RECORDED_FRAMES_PATHS.items():
+        pixels = np.asarray(Image.open(path).convert("RGB"))
+        print(f"{game} ({pixels.shape[1]}x{pixels.shape[0]}):")
+
+        milliseconds, data = measure(encode_rgba_png, pixels)
+        print(f"{'rgba png (previous)':>20}: {milliseconds:6.2f} ms {len(data):8d} bytes")
+        for encoder in ENCODERS:
+            milliseconds, image = measure(encoder.encode, pixels)
+            decoded = np.asarray(Image.open(io.BytesIO(image.data)).convert("RGB"))
+            assert np.array_equal(decoded, pixels), f"{encoder.get_name()} is lossy"
+            print(f"{encoder.get_name():>20}: {milliseconds:6.2f} ms {len(image.data):8d} bytes")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
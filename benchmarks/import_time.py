@@ -0,0 +1,53 @@
+"""
+Import time of main.py, measured with python -X importtime.
+
+The backends are only imported when selected (llm_backends), so importing main must neither
+load Playwright nor the Gemini and OpenAI SDKs. Reports the cumulative import time of main and
+of its slowest imports, and exits with an error when a backend SDK is imported or when the
+import time is over IMPORT_TIME_BUDGET_MS.
+
+Run from the repository root: python -m benchmarks.import_time [module]
+"""
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_MS = 500  # Mostly numpy and PIL, for mesen_python
+N_RUNS = 5  # The fastest run is kept, the first ones might read the modules from the disk
+N_SLOWEST_IMPORTS = 8
+BACKEND_MODULES = ("playwright", "google.genai", "openai")
+
+
+def measure(module: str) -> dict:
+    """Cumulative import time in microseconds of module and of each module it imports"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # The indentation of the name is its depth in the imports
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    runs = [measure(module) for _ in range(N_RUNS)]
+    times = min(runs, key=lambda times: times[module])
+    total_ms = times[module] / 1000
+
+    print(f"import {module}: {total_ms:.1f} ms (budget: {IMPORT_TIME_BUDGET_MS} ms)")
+    slowest = sorted(((time, name) for name, time in times.items() if name != module and "." not in name), reverse=True)
+    for time, name in slowest[:N_SLOWEST_IMPORTS]:
+        print(f"{name:>30}: {time / 1000:.1f} ms")
+
+    imported_backends = [name for name in BACKEND_MODULES if name in times]
+    if imported_backends:
+        print(f"Backend modules imported by {module}: {', '.join(imported_backends)}")
+    if imported_backends or total_ms > IMPORT_TIME_BUDGET_MS:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Offline load test of the main.py loop with MockMesen and a fake LLM server.
+
+Plays N_WINDOWS windows with main.play, the LLM being a ChatGPTAPI or GeminiAPI pointed at a
+FakeOpenAIServer or FakeGeminiServer with the latency profile given, and reports the time to
+action and the windows lost to timeouts. The "instant" profile measures the time spent outside
+of the model. No emulator, network access nor API key is needed.
+
+Run from the repository root: python -m benchmarks.llm_loop_load [openai|gemini] [instant|realistic|worst]
+"""
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import main
+from chatgpt import ChatGPTAPI, ChatGPTModels
+from fake_llm_servers import FakeOpenAIServer, FakeGeminiServer, constant_latency, lognormal_latency, with_outliers
+from gemini import GeminiAPI, GeminiModels
+from mesen_python import SMB
+from mesen_python.mesen import Mesen
+from mesen_python.mock_mesen import MockMesen
+from mesen_python.transports import TCPTransport
+
+N_WINDOWS = 30
+LATENCY_PROFILES = {
+    "instant": constant_latency(0),
+    "realistic": lognormal_latency(1.5, 0.4),
+    # Slow model with 10% of answers taking longer than the input timeout
+    "worst": with_outliers(lognormal_latency(3.0, 0.6), 0.1, 20.0),
+}
+INPUT_TIMEOUT = 15
+ANSWER_FORMAT = "The path is clear, running right.\n{inputs}\nJumping over the next Goomba."
+
+
+def create_llm(backend_name: str, base_url: str):
+    if backend_name == "gemini":
+        return GeminiAPI(GeminiModels.FLASH_LITE_2_5, api_key="unused", base_url=base_url)
+    return ChatGPTAPI(ChatGPTModels.NANO_5, api_key="unused", base_url=base_url)
+
+
+def run(backend_name: str, profile: str) -> dict:
+    data_path = tempfile.mkdtemp()
+    mesen = Mesen(transport=TCPTransport(port=0))
+    game = main.create_game(mesen=mesen, saved_playthrough_path=data_path)
+    game.set_mesen_timeout(INPUT_TIMEOUT)
+    os.makedirs(game.get_playthrough_folder_path())
+    server_class = FakeGeminiServer if backend_name == "gemini" else FakeOpenAIServer
+    server = server_class(game.get_valid_inputs(), latency=LATENCY_PROFILES[profile], answer_format=ANSWER_FORMAT, seed=0).start()
+    mock = MockMesen(port=mesen.server.getsockname()[1], n_windows=N_WINDOWS)
+    mock.start()
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        main.play(game, create_llm(backend_name, server.get_base_url()))
+    elapsed = time.perf_counter() - start
+    mock.thread.join()
+    server.stop()
+
+    log = output.getvalue()
+    times_to_action = [float(time) for time in re.findall(r"Time to action: ([0-9.]+)s", log)]
+    stats = server.get_stats()
+    return {
+        "windows/s": len(times_to_action) / elapsed,
+        "time to action p50": np.percentile(times_to_action, 50),
+        "time to action p95": np.percentile(times_to_action, 95),
+        # Streamed answers are used before their sampled latency has elapsed
+        "model latency mean": stats["mean_latency"],
+        "timed out windows": log.count("Input took longer than"),
+        "invalid answers": log.count("Invalid inputs"),
+        "cancelled streams": stats["cancelled"],
+    }
+
+
+def main_benchmark():
+    backend_name = sys.argv[1] if len(sys.argv) > 1 else "openai"
+    profiles = sys.argv[2:] or list(LATENCY_PROFILES)
+    for profile in profiles:
+        results = run(backend_name, profile)
+        print(f"{backend_name} {profile:>9}: " + ", ".join(f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+                                                       for name, value in results.items()))
+
+
+if __name__ == "__main__":
+    main_benchmark()
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Micro-benchmark of the Python side of the Mesen socket protocol.
+
+Replays the messages main.lua sends for each window (progress line, then a size
+line and a PNG for each screenshot) and measures the number of recv syscalls and
+the time Python spends per window, with the legacy one-byte reader and with the
+buffered reader of Mesen.
+
+Run from the repository root: python -m benchmarks.mesen_receive
+"""
+import io
+import socket
+import threading
+import time
+
+from PIL import Image
+
+from mesen_python.mesen import Mesen
+
+RECORDED_FRAMES_PATH = "data/smb/recent_frames.png"
+FRAME_WIDTH = 256
+N_SCREENSHOTS = 3
+N_WINDOWS = 2000
+
+
+class CountingSocket:
+    """Wraps a socket to count the recv and recv_into calls made on it"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.recv_calls = 0
+
+
+    def recv(self, num_bytes: int) -> bytes:
+        self.recv_calls += 1
+        return self.sock.recv(num_bytes)
+
+
+    def recv_into(self, buffer) -> int:
+        self.recv_calls += 1
+        return self.sock.recv_into(buffer)
+
+
+    def send(self, data: bytes) -> int:
+        return self.sock.send(data)
+
+
+def legacy_receive_line(mesen: Mesen) -> str:
+    message = b""
+    while not message.endswith(b"\n"):
+        chunk = mesen.client.recv(1)
+        if not chunk:
+            break
+        message += chunk
+    return message.decode().strip()
+
+
+def legacy_receive_bytes(mesen: Mesen, num_bytes: int) -> bytes:
+    message = b""
+    while len(message) < num_bytes:
+        chunk = mesen.client.recv(num_bytes - len(message))
+        if not chunk:
+            break
+        message += chunk
+    return message
+
+
+def get_recorded_pngs() -> list:
+    """Splits the recorded SMB screenshot history into one PNG per frame"""
+    history = Image.open(RECORDED_FRAMES_PATH)
+    pngs = []
+    for i in range(N_SCREENSHOTS):
+        x = i * (FRAME_WIDTH + 1)
+        frame = history.crop((x, 0, x + FRAME_WIDTH, history.height))
+        output = io.BytesIO()
+        frame.save(output, format="PNG")
+        pngs.append(output.getvalue())
+    return pngs
+
+
+def get_window_message(pngs: list) -> bytes:
+    """Bytes sent by main.lua for one window"""
+    message = b"1-1 (12.3 %)\n"
+    for png in pngs:
+        message += str(len(png)).encode() + b"\n" + png
+    return message
+
+
+def run(mesen: Mesen, message: bytes, receive_line, receive_bytes) -> tuple:
+    """Returns the number of recv calls and the microseconds spent per window"""
+    def send_windows(port: int):
+        client = socket.create_connection(("localhost", port))
+        for _ in range(N_WINDOWS):
+            client.sendall(message)
+        client.close()
+
+    port = mesen.server.getsockname()[1]
+    # A daemon so a failing receiver doesn't keep the benchmark waiting for the sender
+    sender = threading.Thread(target=send_windows, args=(port,), daemon=True)
+    sender.start()
+    mesen.connect()
+    mesen.client = CountingSocket(mesen.client)
+
+    start = time.perf_counter()
+    for _ in range(N_WINDOWS):
+        receive_line()
+        for _ in range(N_SCREENSHOTS):
+            receive_bytes(int(receive_line()))
+    elapsed = time.perf_counter() - start
+
+    sender.join()
+    mesen.client.sock.close()
+    return mesen.client.recv_calls / N_WINDOWS, elapsed / N_WINDOWS * 1e6
+
+
+def main():
+    message = get_window_message(get_recorded_pngs())
+    print(f"{N_WINDOWS} windows of {len(message)} bytes ({N_SCREENSHOTS} screenshots)")
+
+    mesen = Mesen(port=0)
+    results = {
+        "legacy": run(mesen, message,
+                      lambda: legacy_receive_line(mesen),
+                      lambda n: legacy_receive_bytes(mesen, n)),
+        "buffered": run(mesen, message, mesen.receive_line, mesen.receive_bytes),
+    }
+    for name, (syscalls, microseconds) in results.items():
+        print(f"{name:>10}: {syscalls:8.1f} recv calls/window | {microseconds:8.1f} us/window")
+
+
+if __name__ == "__main__":
+    main()
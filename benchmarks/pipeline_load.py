@@ -0,0 +1,82 @@
+"""
+Load test of the Python pipeline against MockMesen, without an emulator or an LLM.
+
+Plays windows as fast as possible through Game.get_progress, Game.get_recent_frames
+and Game.apply_inputs and reports the number of windows per second. With 3 screenshots per
+window, the PNG configurations are bound by the decoding of the frames (a few hundred windows/s)
+and the raw ones reach a couple thousand windows/s.
+
+Run from the repository root: python -m benchmarks.pipeline_load [frames_path]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from mesen_python import SMB
+from mesen_python.mesen import Mesen, PROTOCOL_TEXT, LATEST_PROTOCOL, FRAME_FORMAT_PNG, FRAME_FORMAT_RAW
+from mesen_python.mock_mesen import MockMesen
+from mesen_python.transports import TCPTransport, UnixTransport, SharedMemoryTransport
+
+N_WINDOWS = 2000
+INPUT_LENGTH = 30
+N_SCREENSHOTS = 3
+FREQ_SCREENSHOTS = 30  # One screenshot per window, so consecutive windows share frames
+
+
+def create_transport(transport_name: str, data_path: str):
+    if transport_name == "unix":
+        return UnixTransport(os.path.join(data_path, "llm4mesen.sock"))
+    if transport_name == "shm":
+        return SharedMemoryTransport(TCPTransport(port=0))
+    return TCPTransport(port=0)
+
+
+def run(protocol: int, frame_format: int, incremental_frames: bool, transport_name: str="tcp", frames_path: str=None) -> float:
+    """Returns the number of windows per second"""
+    data_path = tempfile.mkdtemp()
+    transport = create_transport(transport_name, data_path)
+    mesen = Mesen(transport=transport)
+    game = SMB(input_length=INPUT_LENGTH, n_screenshots=N_SCREENSHOTS, freq_screenshots=FREQ_SCREENSHOTS,
+               saved_playthrough_path=data_path, protocol=protocol, mesen=mesen,
+               frame_format=frame_format, incremental_frames=incremental_frames)
+    if isinstance(transport, UnixTransport):
+        mock = MockMesen(unix_socket_path=transport.path, frames_path=frames_path, n_windows=N_WINDOWS)
+    else:
+        mock = MockMesen(port=mesen.server.getsockname()[1], frames_path=frames_path, n_windows=N_WINDOWS)
+    mock.start()
+
+    game.play()
+    start = time.perf_counter()
+    n_windows = 0
+    while True:
+        progress = game.get_progress()
+        if progress == "GAME OVER":
+            break
+        game.get_recent_frames()
+        game.apply_inputs("right,b")
+        n_windows += 1
+    elapsed = time.perf_counter() - start
+    mock.thread.join()
+    mesen.close_shared_frames()
+    return n_windows / elapsed
+
+
+def main():
+    frames_path = sys.argv[1] if len(sys.argv) > 1 else None
+    configurations = (
+        ("text protocol, PNG", PROTOCOL_TEXT, FRAME_FORMAT_PNG, False, "tcp"),
+        ("binary protocol, PNG", LATEST_PROTOCOL, FRAME_FORMAT_PNG, False, "tcp"),
+        ("binary protocol, PNG, incremental", LATEST_PROTOCOL, FRAME_FORMAT_PNG, True, "tcp"),
+        ("binary protocol, raw", LATEST_PROTOCOL, FRAME_FORMAT_RAW, False, "tcp"),
+        ("binary protocol, raw, incremental", LATEST_PROTOCOL, FRAME_FORMAT_RAW, True, "tcp"),
+        ("binary protocol, raw, Unix socket", LATEST_PROTOCOL, FRAME_FORMAT_RAW, False, "unix"),
+        ("binary protocol, raw, shared memory", LATEST_PROTOCOL, FRAME_FORMAT_RAW, False, "shm"),
+    )
+    for name, protocol, frame_format, incremental_frames, transport_name in configurations:
+        windows_per_second = run(protocol, frame_format, incremental_frames, transport_name, frames_path)
+        print(f"{name:>35}: {windows_per_second:8.1f} windows/s ({1e6 / windows_per_second:.0f} us/window)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
-from .chatgpt_api import ChatGPTAPI
+import importlib
+
 from .chatgpt_models import ChatGPTModels
 
+# The backend is imported when first used, since it loads the OpenAI SDK
+_LAZY_ATTRIBUTES = {
+    "ChatGPTAPI": ".chatgpt_api",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
+# The backend isn't in __all__ so that "from chatgpt import *" doesn't import it
 __all__ = [
-    "ChatGPTAPI",
     "ChatGPTModels",
 ]
\ No newline at end of file
@@ -1,33 +1,64 @@
-from openai import OpenAI, RateLimitError, APIError
+from openai import OpenAI, RateLimitError, APIError, BadRequestError, NotFoundError
+import json
 import os
 import time
-from PIL import Image
-import base64
-from io import BytesIO
 
+from llm_cache import LLMCache, CacheModes, hash_exchange
+from llm_rate_limiter import RateLimiter, estimate_tokens
+from mesen_python.input_parser import InputParser
+from mesen_python.prompt_image import PromptImage
 from .chatgpt_models import ChatGPTModel
 
+RESPONSE_SCHEMA_NAME = "game_inputs"  # Name of the JSON schema of the structured answers
+
 
 class ChatGPTAPI:
-    def __init__(self, model: ChatGPTModel, api_key: str = None):
+    def __init__(self, model: ChatGPTModel, api_key: str = None, cache: LLMCache = None, chain_responses: bool = True,
+                 rate_limiter: RateLimiter = None, base_url: str = None):
+        """
+        cache: LLM response cache. No API key is needed to only replay cached responses.
+        rate_limiter: waits before sending the prompts so the model's quotas aren't exceeded
+        base_url: URL of another server implementing the API, like a FakeOpenAIServer
+        chain_responses: only sends the new messages with the id of the previous response, whose
+                         conversation is kept by OpenAI, instead of the whole conversation
+        """
         if not api_key:
             api_key = os.environ.get("OPENAI_API_KEY")
-            if not api_key:
+            if not api_key and not (cache and cache.mode == CacheModes.REPLAY_ONLY):
                 raise ValueError("OpenAI API key environment variable is not set!")
 
-        self.client = OpenAI(api_key=api_key)
+        self.client = OpenAI(api_key=api_key, base_url=base_url) if api_key else None
         self.model = model
+        self.cache = cache
+        self.rate_limiter = rate_limiter
 
         self.messages = None
+        # Identifies the conversation in the cache
+        self.conversation_hash = ""
+
+        self.chain_responses = chain_responses
+        # Last complete response stored by OpenAI and the number of messages its conversation contains
+        self.previous_response_id = None
+        self.n_chained_messages = 0
+        # Id of the response being added to the conversation, if it can be chained
+        self.pending_response_id = None
+        # Size in bytes of the input sent with the last request
+        self.last_request_size = 0
+        # Seconds spent waiting for the rate limiter and for the first streamed chunk by the last prompt
+        self.last_step_timings = {}
 
         self.prompt_text = None
         self.prompt_image = None
+        self.prompt_image_hash = None
 
     def start_new_temporary_chat(self):
         self.start_new_chat()
 
     def start_new_chat(self):
         self.messages = []
+        self.conversation_hash = ""
+        self.previous_response_id = None
+        self.n_chained_messages = 0
 
     def add_text_to_prompt(self, text):
         if not self.prompt_text:
@@ -35,19 +66,21 @@ class ChatGPTAPI:
         else:
             self.prompt_text += text
 
-    def _convert_image_path_to_base64(self, image_path):
-        image = Image.open(image_path)
-        buffer = BytesIO()
-        image.save(buffer, format=image.format or "PNG")
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    def _convert_image_to_data_url(self, image: PromptImage):
+        # The encoded bytes are sent as is, without decoding and re-encoding them
+        return image.to_data_url()
 
-    def add_image_to_prompt(self, image_path):
-        self.image_url = image_path
-        self.prompt_image = self._convert_image_path_to_base64(image_path)
+    def add_image_to_prompt(self, image):
+        """image: PromptImage, or path of an image file"""
+        if isinstance(image, str):
+            image = PromptImage.from_file(image)
+        self.prompt_image = self._convert_image_to_data_url(image)
+        self.prompt_image_hash = image.get_hash()
 
     def _reset_prompt(self):
         self.prompt_text = None
         self.prompt_image = None
+        self.prompt_image_hash = None
 
     def send_text_prompt(self, text):
         if self.messages is None:
@@ -56,14 +89,15 @@ class ChatGPTAPI:
         self.add_text_to_prompt(text)
         return self.send_prompt()
 
-    def send_image_prompt(self, image_path):
+    def send_image_prompt(self, image, input_parser: InputParser = None):
+        """input_parser: streams the answer and returns its inputs as soon as they are complete"""
         if self.messages is None:
             return "Create a chat before sending a message!"
 
-        self.add_image_to_prompt(image_path)
-        return self.send_prompt()
+        self.add_image_to_prompt(image)
+        return self.send_prompt(input_parser)
 
-    def send_prompt(self):
+    def send_prompt(self, input_parser: InputParser = None):
         if self.messages is None:
             return "Create a chat before sending a message!"
 
@@ -78,7 +112,7 @@ class ChatGPTAPI:
         if self.prompt_image:
             content.append({
                 "type": "input_image",
-                "image_url": self.image_url
+                "image_url": self.prompt_image
             })
 
         self.messages.append({
@@ -86,35 +120,150 @@ class ChatGPTAPI:
             "content": content
         })
 
+        self.pending_response_id = None
+        try:
+            if self.cache is None:
+                assistant_text = self._generate(input_parser)
+            else:
+                key = self.cache.make_key(self.model.get_model_code(), self.conversation_hash, self.prompt_text, self.prompt_image_hash,
+                                          input_parser)
+                assistant_text = self.cache.get_or_call(key, lambda: self._generate(input_parser), self.model.get_model_code())
+                self.conversation_hash = hash_exchange(self.conversation_hash, key, assistant_text)
+        except Exception:
+            # A prompt without answer (cancelled generation) isn't kept in the conversation
+            self.messages.pop()
+            self._reset_prompt()
+            raise
+
+        self.messages.append({
+            "role": "assistant",
+            "content": assistant_text
+        })
+        if self.pending_response_id is not None:
+            self.previous_response_id = self.pending_response_id
+            self.n_chained_messages = len(self.messages)
+
+        self._reset_prompt()
+        return assistant_text
+
+    def _get_request_input(self):
+        """Messages to send and the arguments chaining them to the previous response, if any"""
+        if not self.chain_responses or self.previous_response_id is None:
+            return self.messages, {}
+        return self.messages[self.n_chained_messages:], {"previous_response_id": self.previous_response_id}
+
+    def _estimate_tokens(self):
+        """Tokens of the whole conversation, which are counted even when only the last messages are sent"""
+        text = ""
+        n_images = 0
+        for message in self.messages:
+            if isinstance(message["content"], str):
+                text += message["content"]
+                continue
+            for item in message["content"]:
+                if item["type"] == "input_image":
+                    n_images += 1
+                else:
+                    text += item["text"]
+        return estimate_tokens(text, n_images)
+
+    def _record_usage(self, charged_tokens: int, used_tokens: int):
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_usage(self.model, charged_tokens, used_tokens)
+
+    def get_last_step_timings(self) -> dict:
+        return self.last_step_timings
+
+    def _stream(self, request_input, chaining, input_parser: InputParser):
+        """Streams the answer until input_parser recognizes an action line, then stops the generation"""
+        input_parser.reset()
+        start = time.perf_counter()
+        options = {}
+        if input_parser.response_schema is not None:
+            # The answer can only be a JSON object following the schema, so its inputs are always valid
+            options["text"] = {"format": {
+                "type": "json_schema",
+                "name": RESPONSE_SCHEMA_NAME,
+                "schema": input_parser.response_schema,
+                "strict": True
+            }}
+        stream = self.client.responses.create(
+            model=self.model.get_model_code(),
+            input=request_input,
+            stream=True,
+            **chaining,
+            **options
+        )
+        response_id = None
+        try:
+            for event in stream:
+                if event.type == "response.created":
+                    response_id = event.response.id
+                if event.type != "response.output_text.delta":
+                    continue
+                self.last_step_timings.setdefault("first_chunk", time.perf_counter() - start)
+                inputs = input_parser.feed(event.delta)
+                if inputs is not None:
+                    # A cancelled response isn't stored by OpenAI, so it can't be chained to. The next request
+                    # is chained to the last complete response and sends the following messages itself.
+                    return inputs
+        finally:
+            # Closing the stream early cancels the rest of the generation
+            stream.close()
+        self.pending_response_id = response_id
+        return input_parser.text
+
+    def _generate(self, input_parser: InputParser = None):
+        """Sends the messages and returns the text of the answer"""
+        estimated_tokens = self._estimate_tokens()
+        self.last_step_timings = {}
+        charged_tokens = 0
         prompt_has_sent = False
         while not prompt_has_sent:
+            if self.rate_limiter is not None:
+                start = time.perf_counter()
+                charged_tokens = self.rate_limiter.acquire(self.model, estimated_tokens)
+                self.last_step_timings["rate_limit"] = self.last_step_timings.get("rate_limit", 0) + time.perf_counter() - start
+            request_input, chaining = self._get_request_input()
+            self.last_request_size = len(json.dumps(request_input))
             try:
+                if input_parser is not None:
+                    text = self._stream(request_input, chaining, input_parser)
+                    self._record_usage(charged_tokens, estimated_tokens + estimate_tokens(text))
+                    return text
                 response = self.client.responses.create(
                     model=self.model.get_model_code(),
-                    input=self.messages
+                    input=request_input,
+                    **chaining
                 )
                 prompt_has_sent = True
 
+            except (BadRequestError, NotFoundError) as e:
+                if not chaining:
+                    raise
+                # Responses might not be stored by OpenAI (zero data retention) or have expired
+                print("Response chaining unavailable, sending the whole conversation from now on:", e)
+                self.chain_responses = False
+
             except RateLimitError as e:
                 print(e)
                 retry_delay = 30
                 waiting_time = retry_delay + 3
                 print(f"Rate limit reached. Waiting {waiting_time}s.")
-                time.sleep(waiting_time)
+                if self.rate_limiter is not None:
+                    # Every run sharing the rate limits waits, the next acquire() included
+                    self.rate_limiter.pause(self.model, waiting_time)
+                else:
+                    time.sleep(waiting_time)
 
             except APIError as e:
                 print("OpenAI API error:", e)
                 time.sleep(5)
 
-        assistant_text = response.output_text
-
-        self.messages.append({
-            "role": "assistant",
-            "content": assistant_text
-        })
-
-        self._reset_prompt()
-        return assistant_text
+        if response.usage is not None:
+            self._record_usage(charged_tokens, response.usage.total_tokens)
+        self.pending_response_id = response.id
+        return response.output_text
 
     def get_model(self):
         return self.model
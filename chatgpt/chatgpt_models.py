@@ -1,12 +1,23 @@
 class ChatGPTModel:
     """Wrapper for the available ChatGPT models"""
-    def __init__(self, model_code: str, mode: str=None):
+    def __init__(self, model_code: str, mode: str=None, requests_per_minute: int=None, tokens_per_minute: int=None):
+        """requests_per_minute, tokens_per_minute: quotas of the model used by the RateLimiter, None if unknown"""
         self.model_code = model_code
         self.mode = mode
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
 
 
     def get_model_code(self) -> str:
         return self.model_code
+
+
+    def get_requests_per_minute(self) -> int:
+        return self.requests_per_minute
+
+
+    def get_tokens_per_minute(self) -> int:
+        return self.tokens_per_minute
     
 
     def _drop_release_date(self) -> str:
@@ -33,13 +44,15 @@ class ChatGPTModel:
         
 # Models are in the docs:
 # https://platform.openai.com/docs/models
+# Quotas of usage tier 1, to change for a higher tier:
+# https://platform.openai.com/docs/guides/rate-limits
 
 class ChatGPTModels:
     """Contains all usable ChatGPT models as attributes"""
     GPT_5_2 = ChatGPTModel("gpt-5.2-2025-12-11")
-    MINI_5 = ChatGPTModel("gpt-5-mini-2025-08-07")
-    NANO_5 = ChatGPTModel("gpt-5-nano-2025-08-07")
-    GPT_5 = ChatGPTModel("gpt-5-2025-08-07")
-    GPT_4_1 = ChatGPTModel("gpt-4.1-2025-04-14")
+    MINI_5 = ChatGPTModel("gpt-5-mini-2025-08-07", requests_per_minute=500, tokens_per_minute=500_000)
+    NANO_5 = ChatGPTModel("gpt-5-nano-2025-08-07", requests_per_minute=500, tokens_per_minute=200_000)
+    GPT_5 = ChatGPTModel("gpt-5-2025-08-07", requests_per_minute=500, tokens_per_minute=500_000)
+    GPT_4_1 = ChatGPTModel("gpt-4.1-2025-04-14", requests_per_minute=500, tokens_per_minute=30_000)
     GPT_5_2_PRO = ChatGPTModel("gpt-5.2-pro-2025-12-11")
    
\ No newline at end of file
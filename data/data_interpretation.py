@@ -58,6 +58,39 @@ def get_smb_best_playthrough_progress(model_file_name: str) -> Tuple[str, str]:
     return f"{best_world_level} ({best_level_progress:.1f} %)", best_parameters
 
 
+def get_invalid_rates(playthrough_folder: str=playthrough_path) -> dict:
+    """
+    Fraction of the LLM answers whose inputs were invalid, for each model, with and without
+    structured inputs (json=1 in the file names). Skipped and unchanged windows aren't answers.
+    """
+    counts = {}
+    for data_file in os.listdir(playthrough_folder):
+        params = dict(param.split("=", 1) for param in data_file[:-len(".csv")].split("__"))
+        key = (params["model"], params.get("json") == "1")
+        n_invalid, n_answers = counts.get(key, (0, 0))
+        with open(f"{playthrough_folder}/{data_file}", "r") as f:
+            for playthrough in f:
+                for step in playthrough.strip().split(","):
+                    inputs = step.split("|")[0]
+                    if "|" not in step or inputs == "Skipped" or ":" in inputs:
+                        continue
+                    n_invalid += inputs == "Invalid"
+                    n_answers += 1
+        counts[key] = (n_invalid, n_answers)
+
+    return {key: n_invalid / n_answers for key, (n_invalid, n_answers) in counts.items() if n_answers}
+
+
+def print_invalid_rates(playthrough_folder: str=playthrough_path):
+    """Prints the invalid rate of each model without and with structured inputs"""
+    invalid_rates = get_invalid_rates(playthrough_folder)
+    for model in sorted(set(model for model, _ in invalid_rates)):
+        before = invalid_rates.get((model, False))
+        after = invalid_rates.get((model, True))
+        print(f"{model}: text {'-' if before is None else f'{before:.1%}'}, "
+              f"structured {'-' if after is None else f'{after:.1%}'}")
+
+
 def convert_units_to_progress(units: int) -> str:
     """Converts SMB horizontal units to world-level and percentage progress"""
     level1_and_level2_units = 3161 
@@ -0,0 +1,14 @@
+from .fake_server import FakeLLMServer, constant_latency, uniform_latency, lognormal_latency, with_outliers
+from .openai_server import FakeOpenAIServer
+from .gemini_server import FakeGeminiServer
+
+
+__all__ = [
+    "FakeLLMServer",
+    "FakeOpenAIServer",
+    "FakeGeminiServer",
+    "constant_latency",
+    "uniform_latency",
+    "lognormal_latency",
+    "with_outliers",
+]
\ No newline at end of file
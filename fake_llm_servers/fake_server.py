@@ -0,0 +1,206 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+ANSWER_FORMAT = "{inputs}"  # Answer of the fake models, "{inputs}" being replaced by the sampled inputs
+MAX_INPUTS = 3  # Maximum number of inputs of a random answer
+N_STREAM_CHUNKS = 5  # Number of chunks a streamed answer is split in
+RETRY_DELAY = 1.0  # Seconds the clients are told to wait after a rate limit error
+
+
+def count_text(data) -> int:
+    """Rough number of tokens of the texts of a request"""
+    if isinstance(data, str):
+        return len(data) // 4
+    if isinstance(data, dict):
+        return sum(count_text(value) for key, value in data.items() if key in ("text", "content", "parts"))
+    if isinstance(data, list):
+        return sum(count_text(value) for value in data)
+    return 0
+
+
+def constant_latency(seconds: float) -> Callable[[random.Random], float]:
+    return lambda rng: seconds
+
+
+def uniform_latency(low: float, high: float) -> Callable[[random.Random], float]:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(median: float, sigma: float=0.5) -> Callable[[random.Random], float]:
+    """Right-skewed latency, like the answers of the real APIs"""
+    return lambda rng: median * rng.lognormvariate(0, sigma)
+
+
+def with_outliers(latency: Callable[[random.Random], float], probability: float, seconds: float) -> Callable[[random.Random], float]:
+    """Replaces a fraction of the latencies by a slow outlier, for worst-case timings"""
+    return lambda rng: seconds if rng.random() < probability else latency(rng)
+
+
+class FakeLLMServer:
+    """
+    Local HTTP server answering like an LLM API with valid game inputs, so the backends can be
+    benchmarked and tested without API keys. The latency of the answers is sampled from a
+    configurable distribution and rate limit errors can be injected.
+
+    script: answers given in order (cycled), instead of random inputs
+    answer_format: text of the answers, "{inputs}" being replaced by the inputs. Requests with a JSON schema
+                   (structured output) are answered with {"inputs": [...]}, or a one-step {"plan": [...]} for plan schemas.
+    rate_limit_probability: probability of answering a request with a rate limit error
+    """
+    def __init__(self,
+                 valid_inputs: List[str],
+                 host: str="127.0.0.1",
+                 port: int=0,
+                 latency: Callable[[random.Random], float]=constant_latency(0),
+                 script: List[str]=None,
+                 answer_format: str=ANSWER_FORMAT,
+                 max_inputs: int=MAX_INPUTS,
+                 n_stream_chunks: int=N_STREAM_CHUNKS,
+                 rate_limit_probability: float=0.0,
+                 retry_delay: float=RETRY_DELAY,
+                 seed: int=None,
+                 ):
+        self.valid_inputs = list(valid_inputs)
+        self.latency = latency
+        self.script = script
+        self.answer_format = answer_format
+        self.max_inputs = max_inputs
+        self.n_stream_chunks = n_stream_chunks
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_delay = retry_delay
+        self.rng = random.Random(seed)
+        # The handlers run in their own threads
+        self.lock = threading.Lock()
+
+        self.n_answers = 0
+        self.n_rate_limited = 0
+        self.n_cancelled = 0
+        self.latencies = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keeps the connections alive between requests
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                try:
+                    server.handle_request(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading a streamed answer
+                    with server.lock:
+                        server.n_cancelled += 1
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+
+    def get_base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    def handle_request(self, handler: BaseHTTPRequestHandler, body: dict):
+        """Answers a request, implemented by the server of each API"""
+        pass
+
+
+    def next_answer(self, response_schema: dict=None) -> str:
+        """response_schema: answers with a JSON object following Game.get_input_schema() or Game.get_plan_schema()"""
+        with self.lock:
+            if self.script:
+                inputs = self.script[self.n_answers % len(self.script)]
+            else:
+                n_inputs = self.rng.randint(1, min(self.max_inputs, len(self.valid_inputs)))
+                chosen = set(self.rng.sample(self.valid_inputs, n_inputs))
+                inputs = ",".join(input for input in self.valid_inputs if input in chosen)
+            self.n_answers += 1
+        if response_schema is not None:
+            answer = {"inputs": inputs.split(",") if inputs else []}
+            plan_schema = response_schema.get("properties", {}).get("plan")
+            if plan_schema is not None:
+                answer["windows"] = self.rng.randint(1, plan_schema["items"]["properties"]["windows"]["maximum"])
+                answer = {"plan": [answer]}
+            return json.dumps(answer)
+        return self.answer_format.format(inputs=inputs)
+
+
+    def sample_latency(self) -> float:
+        with self.lock:
+            latency = max(0.0, self.latency(self.rng))
+            self.latencies.append(latency)
+        return latency
+
+
+    def should_rate_limit(self) -> bool:
+        with self.lock:
+            rate_limited = self.rng.random() < self.rate_limit_probability
+            if rate_limited:
+                self.n_rate_limited += 1
+        return rate_limited
+
+
+    def split_answer(self, answer: str) -> List[str]:
+        chunk_size = max(1, -(-len(answer) // self.n_stream_chunks))
+        return [answer[i:i + chunk_size] for i in range(0, len(answer), chunk_size)] or [""]
+
+
+    def send_json(self, handler: BaseHTTPRequestHandler, status: int, data: dict, headers: dict=None):
+        payload = json.dumps(data).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+
+    def send_events(self, handler: BaseHTTPRequestHandler, events: list, latency: float):
+        """
+        Streams server-sent events, the latency being spread between them.
+        events: (event name or None, data) tuples
+        """
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for name, data in events:
+            time.sleep(latency / len(events))
+            event = (f"event: {name}\n" if name else "") + f"data: {json.dumps(data)}\n\n"
+            payload = event.encode()
+            handler.wfile.write(f"{len(payload):X}\r\n".encode() + payload + b"\r\n")
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            mean_latency = sum(self.latencies) / len(self.latencies) if self.latencies else 0
+            return {
+                "answers": self.n_answers,
+                "rate_limited": self.n_rate_limited,
+                "cancelled": self.n_cancelled,
+                "mean_latency": mean_latency,
+            }
\ No newline at end of file
@@ -0,0 +1,57 @@
+import re
+import time
+from http.server import BaseHTTPRequestHandler
+
+from .fake_server import FakeLLMServer, count_text
+
+GENERATE_PATH_PATTERN = re.compile(r"^/[^/]+/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)")
+
+
+class FakeGeminiServer(FakeLLMServer):
+    """
+    Stand-in for the Gemini API (generateContent and streamGenerateContent).
+    GeminiAPI uses it with base_url=server.get_base_url().
+    """
+    def handle_request(self, handler: BaseHTTPRequestHandler, body: dict):
+        match = GENERATE_PATH_PATTERN.match(handler.path)
+        if match is None:
+            self.send_error(handler, 404, f"Unknown path {handler.path}", "NOT_FOUND")
+            return
+        if self.should_rate_limit():
+            # Same details as the real API, read by gemini_api.get_retry_delay
+            retry_info = {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.retry_delay}s"}
+            self.send_error(handler, 429, "You exceeded your current quota.", "RESOURCE_EXHAUSTED", [retry_info])
+            return
+
+        answer = self.next_answer((body.get("generationConfig") or {}).get("responseJsonSchema"))
+        latency = self.sample_latency()
+        prompt_tokens = count_text(body.get("contents"))
+        if match.group("method") == "generateContent":
+            time.sleep(latency)
+            self.send_json(handler, 200, self.make_chunk(answer, prompt_tokens, True))
+            return
+
+        chunks = self.split_answer(answer)
+        events = [(None, self.make_chunk(chunk, prompt_tokens, i == len(chunks) - 1)) for i, chunk in enumerate(chunks)]
+        self.send_events(handler, events, latency)
+
+
+    def make_chunk(self, text: str, prompt_tokens: int, last: bool) -> dict:
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if last:
+            candidate["finishReason"] = "STOP"
+        output_tokens = len(text) // 4 + 1
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+            "modelVersion": "fake",
+        }
+
+
+    def send_error(self, handler: BaseHTTPRequestHandler, status: int, message: str, error_status: str, details: list=None):
+        error = {"error": {"code": status, "message": message, "status": error_status, "details": details or []}}
+        self.send_json(handler, status, error)
\ No newline at end of file
@@ -0,0 +1,99 @@
+import itertools
+import time
+from http.server import BaseHTTPRequestHandler
+
+from .fake_server import FakeLLMServer, count_text
+
+
+class FakeOpenAIServer(FakeLLMServer):
+    """
+    Stand-in for the OpenAI Responses API (POST /v1/responses), streamed or not.
+    ChatGPTAPI uses it with base_url=server.get_base_url().
+    The responses are stored, so they can be chained with previous_response_id.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.response_ids = itertools.count()
+        self.stored_response_ids = set()
+
+
+    def get_base_url(self) -> str:
+        return super().get_base_url() + "/v1"
+
+
+    def handle_request(self, handler: BaseHTTPRequestHandler, body: dict):
+        if handler.path.rstrip("/") != "/v1/responses":
+            self.send_error(handler, 404, f"Unknown path {handler.path}", "invalid_request_error", None)
+            return
+        previous_response_id = body.get("previous_response_id")
+        if previous_response_id is not None and previous_response_id not in self.stored_response_ids:
+            self.send_error(handler, 400, f"Previous response with id '{previous_response_id}' not found.",
+                            "invalid_request_error", "previous_response_not_found")
+            return
+        if self.should_rate_limit():
+            self.send_error(handler, 429, f"Rate limit reached. Please try again in {self.retry_delay}s.",
+                            "requests", "rate_limit_exceeded", {"retry-after": str(self.retry_delay)})
+            return
+
+        answer = self.next_answer((body.get("text") or {}).get("format", {}).get("schema"))
+        latency = self.sample_latency()
+        response_id = f"resp_{next(self.response_ids)}"
+        usage = {
+            "input_tokens": count_text(body.get("input")),
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(answer) // 4 + 1,
+            "output_tokens_details": {"reasoning_tokens": 0},
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+
+        if not body.get("stream"):
+            time.sleep(latency)
+            self.send_json(handler, 200, self.make_response(response_id, body, answer, "completed", usage))
+            self.stored_response_ids.add(response_id)
+            return
+
+        item_id = f"msg_{response_id}"
+        events = [("response.created", {
+            "type": "response.created",
+            "response": self.make_response(response_id, body, "", "in_progress", None),
+        })]
+        for chunk in self.split_answer(answer):
+            events.append(("response.output_text.delta", {
+                "type": "response.output_text.delta", "item_id": item_id, "output_index": 0,
+                "content_index": 0, "delta": chunk, "logprobs": [],
+            }))
+        events.append(("response.completed", {
+            "type": "response.completed",
+            "response": self.make_response(response_id, body, answer, "completed", usage),
+        }))
+        for sequence_number, (_, data) in enumerate(events):
+            data["sequence_number"] = sequence_number
+        self.send_events(handler, events, latency)
+        self.stored_response_ids.add(response_id)
+
+
+    def make_response(self, response_id: str, body: dict, answer: str, status: str, usage: dict) -> dict:
+        output = []
+        if answer:
+            output.append({
+                "type": "message", "id": f"msg_{response_id}", "status": status, "role": "assistant",
+                "content": [{"type": "output_text", "text": answer, "annotations": []}],
+            })
+        return {
+            "id": response_id,
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": status,
+            "model": body.get("model"),
+            "output": output,
+            "previous_response_id": body.get("previous_response_id"),
+            "parallel_tool_calls": True,
+            "tool_choice": "auto",
+            "tools": [],
+            "usage": usage,
+        }
+
+
+    def send_error(self, handler: BaseHTTPRequestHandler, status: int, message: str, error_type: str, code: str, headers: dict=None):
+        error = {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+        self.send_json(handler, status, error, headers)
\ No newline at end of file
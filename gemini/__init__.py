@@ -1,12 +1,23 @@
-from .gemini_browser import GeminiBrowser, GeminiModelModes
+import importlib
 
-from .gemini_api import GeminiAPI
-from .gemini_models import GeminiModels
+from .gemini_models import GeminiModels, GeminiModelModes
 
+# The backends are imported when first used, since they load Playwright or the Gemini SDK
+_LAZY_ATTRIBUTES = {
+    "GeminiBrowser": ".gemini_browser",
+    "GeminiBrowserPool": ".gemini_browser",
+    "GeminiAPI": ".gemini_api",
+}
 
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# The backends aren't in __all__ so that "from gemini import *" doesn't import them
 __all__ = [
-    "GeminiBrowser",
     "GeminiModelModes",
-    "GeminiAPI",
     "GeminiModels"
 ]
\ No newline at end of file
@@ -1,25 +1,57 @@
 import google.genai as genai 
+from google.genai import types
 from google.genai.errors import ClientError
 import os 
 import time
+from typing import Tuple
 
-from PIL import Image
-
+from llm_cache import LLMCache, CacheModes, hash_exchange
+from llm_rate_limiter import RateLimiter, estimate_tokens
+from mesen_python.input_parser import InputParser
+from mesen_python.prompt_image import PromptImage
 from .gemini_models import GeminiModel
 
+MAX_FULL_TURNS = 8  # Number of last turns whose images are kept in the history
+MAX_HISTORY_BYTES = 2 * 1024 * 1024  # The oldest turns are removed from the history above this size
+REMOVED_IMAGE_TEXT = "(Screenshot removed from the history)"
+
 class GeminiAPI:
-    def __init__(self, model: GeminiModel, api_key: str=None):
+    def __init__(self, model: GeminiModel, api_key: str=None, cache: LLMCache=None,
+                 max_full_turns: int=MAX_FULL_TURNS, max_history_bytes: int=MAX_HISTORY_BYTES,
+                 rate_limiter: RateLimiter=None, base_url: str=None):
+        """
+        cache: LLM response cache. No API key is needed to only replay cached responses.
+        rate_limiter: waits before sending the prompts so the model's quotas aren't exceeded
+        base_url: URL of another server implementing the API, like a FakeGeminiServer
+        max_full_turns: the images of older turns are replaced by a short text, their progress and
+                        answer are kept. None keeps every image.
+        max_history_bytes: the oldest turns are removed when the history is larger. None disables the limit.
+        The first turn, which gives the context, is always kept in full.
+        """
         if not api_key:
             api_key = os.environ.get('GEMINI_API_KEY')
-            if not api_key:
+            if not api_key and not (cache and cache.mode == CacheModes.REPLAY_ONLY):
                 raise ValueError("Gemini API key environnement variable is not set!")
-        self.client = genai.Client(api_key=api_key)
+        http_options = types.HttpOptions(base_url=base_url) if base_url else None
+        self.client = genai.Client(api_key=api_key, http_options=http_options) if api_key else None
         self.model = model
+        self.cache = cache
+        self.rate_limiter = rate_limiter
 
+        # Contents of the conversation, sent with every prompt. None until a chat is started.
         self.chat = None
+        self.max_full_turns = max_full_turns
+        self.max_history_bytes = max_history_bytes
+        # Number of contents of the chat whose images were already removed
+        self.n_summarized_contents = 0
+        # Identifies the conversation in the cache
+        self.conversation_hash = ""
+        # Seconds spent waiting for the rate limiter and for the first streamed chunk by the last prompt
+        self.last_step_timings = {}
 
         self.prompt_text = None 
         self.prompt_image = None
+        self.prompt_image_hash = None
 
 
     def start_new_temporary_chat(self):
@@ -28,7 +60,9 @@ class GeminiAPI:
 
 
     def start_new_chat(self):
-        self.chat = self.client.chats.create(model=self.model.get_model_code())
+        self.chat = []
+        self.n_summarized_contents = 0
+        self.conversation_hash = ""
 
     
     def add_text_to_prompt(self, text: str):
@@ -38,12 +72,17 @@ class GeminiAPI:
             self.prompt_text += text
 
 
-    def _convert_image_path_to_image(self, image_path: str):
-        return Image.open(image_path)
+    def _convert_image_to_part(self, image: PromptImage) -> types.Part:
+        # The encoded bytes are sent as is, without decoding and re-encoding them
+        return types.Part.from_bytes(data=image.data, mime_type=image.mime_type)
 
 
-    def add_image_to_prompt(self, image_path: str):
-        self.prompt_image = self._convert_image_path_to_image(image_path)
+    def add_image_to_prompt(self, image):
+        """image: PromptImage, or path of an image file"""
+        if isinstance(image, str):
+            image = PromptImage.from_file(image)
+        self.prompt_image = self._convert_image_to_part(image)
+        self.prompt_image_hash = image.get_hash()
 
 
     def _extract_text_from_answer(self, answer) -> str:
@@ -53,50 +92,161 @@ class GeminiAPI:
     def _reset_prompt(self):
         self.prompt_text = None 
         self.prompt_image = None
+        self.prompt_image_hash = None
 
 
     def send_text_prompt(self, text: str) -> str:
-        if not self.chat:
+        if self.chat is None:
             return "Create a chat before sending a message!"
         
         self.add_text_to_prompt(text)
         return self.send_prompt()
     
 
-    def send_image_prompt(self, image_path: str) -> str:
-        if not self.chat:
+    def send_image_prompt(self, image, input_parser: InputParser=None) -> str:
+        """input_parser: streams the answer and returns its inputs as soon as they are complete"""
+        if self.chat is None:
             return "Create a chat before sending a message!"
 
-        self.add_image_to_prompt(image_path)
-        return self.send_prompt()
+        self.add_image_to_prompt(image)
+        return self.send_prompt(input_parser)
     
 
-    def send_prompt(self) -> str:
-        if not self.chat:
-            return "Create a chat before sending a message!"
-        
-        prompt = []
-        if self.prompt_text:
-            prompt.append(self.prompt_text)
-        if self.prompt_image:
-            prompt.append(self.prompt_image)
-
-        if len(prompt) == 0:
-            return "Prompt is empty!"    
-        
+    def _stream(self, prompt: types.Content, input_parser: InputParser) -> Tuple[str, types.Content]:
+        """Streams the answer until input_parser recognizes an action line, then stops the generation"""
+        input_parser.reset()
+        start = time.perf_counter()
+        config = None
+        if input_parser.response_schema is not None:
+            # The answer can only be a JSON object following the schema, so its inputs are always valid
+            config = types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_json_schema=input_parser.response_schema
+            )
+        stream = self.client.models.generate_content_stream(
+            model=self.model.get_model_code(),
+            contents=self.chat + [prompt],
+            config=config
+        )
+        try:
+            for chunk in stream:
+                self.last_step_timings.setdefault("first_chunk", time.perf_counter() - start)
+                inputs = input_parser.feed(self._extract_text_from_answer(chunk) or "")
+                if inputs is not None:
+                    # Only the inputs are kept in the conversation
+                    return inputs, types.Content(role="model", parts=[types.Part.from_text(text=inputs)])
+        finally:
+            # Closing the stream early cancels the rest of the generation
+            stream.close()
+        text = input_parser.text
+        return text, types.Content(role="model", parts=[types.Part.from_text(text=text)])
+
+
+    def _generate(self, prompt: types.Content, input_parser: InputParser=None) -> Tuple[str, types.Content]:
+        """Sends the conversation followed by the prompt and returns the text and content of the answer"""
+        estimated_tokens = sum(estimate_content_tokens(content) for content in self.chat + [prompt])
+        self.last_step_timings = {}
+        charged_tokens = 0
         prompt_has_sent = False
         while not prompt_has_sent:
+            if self.rate_limiter is not None:
+                start = time.perf_counter()
+                charged_tokens = self.rate_limiter.acquire(self.model, estimated_tokens)
+                self.last_step_timings["rate_limit"] = self.last_step_timings.get("rate_limit", 0) + time.perf_counter() - start
             try: 
-                answer = self.chat.send_message(prompt)
+                if input_parser is not None:
+                    text, answer = self._stream(prompt, input_parser)
+                    self._record_usage(charged_tokens, estimated_tokens + estimate_tokens(text))
+                    return text, answer
+                answer = self.client.models.generate_content(
+                    model=self.model.get_model_code(),
+                    contents=self.chat + [prompt]
+                )
                 prompt_has_sent = True
             except ClientError as e:
                 retry_delay = get_retry_delay(e)
                 waiting_time = retry_delay + 3  # Adding a 3 second margin
                 print(f'Limit reached. Retry delay={retry_delay}s. Waiting', waiting_time, "seconds.")
-                time.sleep(waiting_time)
+                if self.rate_limiter is not None:
+                    # Every run sharing the rate limits waits, the next acquire() included
+                    self.rate_limiter.pause(self.model, waiting_time)
+                else:
+                    time.sleep(waiting_time)
+
+        if answer.usage_metadata and answer.usage_metadata.total_token_count:
+            self._record_usage(charged_tokens, answer.usage_metadata.total_token_count)
+        text = self._extract_text_from_answer(answer) or ""
+        if answer.candidates and answer.candidates[0].content:
+            # The full content keeps the thought signatures of thinking models
+            return text, answer.candidates[0].content
+        return text, types.Content(role="model", parts=[types.Part.from_text(text=text)])
+
+
+    def _record_usage(self, charged_tokens: int, used_tokens: int):
+        if self.rate_limiter is not None:
+            self.rate_limiter.record_usage(self.model, charged_tokens, used_tokens)
+
 
+    def get_last_step_timings(self) -> dict:
+        return self.last_step_timings
+
+
+    def send_prompt(self, input_parser: InputParser=None) -> str:
+        if self.chat is None:
+            return "Create a chat before sending a message!"
+        
+        parts = []
+        if self.prompt_text:
+            parts.append(types.Part.from_text(text=self.prompt_text))
+        if self.prompt_image:
+            parts.append(self.prompt_image)
+
+        if len(parts) == 0:
+            return "Prompt is empty!"    
+        prompt = types.Content(role="user", parts=parts)
+
+        try:
+            if self.cache is None:
+                text, answer = self._generate(prompt, input_parser)
+            else:
+                key = self.cache.make_key(self.model.get_model_code(), self.conversation_hash, self.prompt_text, self.prompt_image_hash,
+                                          input_parser)
+                generated = []
+                def generate() -> str:
+                    text, answer = self._generate(prompt, input_parser)
+                    generated.append(answer)
+                    return text
+                text = self.cache.get_or_call(key, generate, self.model.get_model_code())
+                # A cached answer is added to the conversation as plain text
+                answer = generated[0] if generated else types.Content(role="model", parts=[types.Part.from_text(text=text)])
+                self.conversation_hash = hash_exchange(self.conversation_hash, key, text)
+        except Exception:
+            # A prompt without answer (cancelled generation) isn't kept in the conversation
+            self._reset_prompt()
+            raise
+
+        self.chat += [prompt, answer]
+        self._apply_history_policy()
         self._reset_prompt()
-        return self._extract_text_from_answer(answer)
+        return text
+
+
+    def _apply_history_policy(self):
+        """Bounds the history so the size of the requests stays the same over long playthroughs"""
+        # A turn is a prompt and its answer. The first one gives the context of the game.
+        if self.max_full_turns is not None:
+            first_full_content = max(2, len(self.chat) - 2 * self.max_full_turns)
+            for i in range(max(2, self.n_summarized_contents), first_full_content):
+                self.chat[i] = remove_images(self.chat[i])
+            self.n_summarized_contents = max(self.n_summarized_contents, first_full_content)
+
+        if self.max_history_bytes is not None:
+            history_bytes = sum(get_content_size(content) for content in self.chat)
+            # The context and the last turn are never removed
+            while history_bytes > self.max_history_bytes and len(self.chat) > 4:
+                history_bytes -= get_content_size(self.chat[2]) + get_content_size(self.chat[3])
+                del self.chat[2:4]
+                self.n_summarized_contents = max(2, self.n_summarized_contents - 2)
     
 
     def get_model(self) -> GeminiModel:
@@ -116,6 +266,32 @@ class GeminiAPI:
         self.start_new_chat()
 
 
+def get_content_size(content: types.Content) -> int:
+    """Bytes of the texts and images of a content"""
+    size = 0
+    for part in content.parts or []:
+        if part.inline_data is not None:
+            size += len(part.inline_data.data)
+        elif part.text:
+            size += len(part.text.encode())
+    return size
+
+
+def estimate_content_tokens(content: types.Content) -> int:
+    text = "".join(part.text for part in content.parts or [] if part.text)
+    n_images = sum(part.inline_data is not None for part in content.parts or [])
+    return estimate_tokens(text, n_images)
+
+
+def remove_images(content: types.Content) -> types.Content:
+    """Copy of a content whose images are replaced by a short text"""
+    if not any(part.inline_data is not None for part in content.parts or []):
+        return content
+    parts = [types.Part.from_text(text=REMOVED_IMAGE_TEXT) if part.inline_data is not None else part
+             for part in content.parts]
+    return types.Content(role=content.role, parts=parts)
+
+
 def get_retry_delay(resource_exhausted_client_error: ClientError):
     retry_seconds = None
     try:
@@ -1,8 +1,10 @@
+import threading
 import time
+from contextlib import contextmanager
 
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
-from .gemini_models import GeminiModels, GeminiModel
+from .gemini_models import ModelMode, GeminiModelModes
 
 from pathlib import Path
 import json
@@ -16,29 +18,14 @@ with open(CONFIG_PATH, "r", encoding="utf-8") as f:
 USER_DATA_DIR = config["user_data_dir"]
 GOOGLE_CHROME_PATH = config["chrome_path"]
 
-class ModelMode:
-    def __init__(self, gemini_model: GeminiModel, button_data_test_id: str):
-        self.gemini_model = gemini_model
-        self.button_data_test_id = button_data_test_id
-
-
-    def get_button_selector(self) -> str:
-        return f"button[data-test-id='{self.button_data_test_id}']"
-    
-
-    def get_file_name(self) -> str:
-        return self.gemini_model.get_file_name()
-    
-
-    def get_pretty_name(self) -> str:
-        return self.gemini_model.get_pretty_name()
-    
-
-class GeminiModelModes:
-    FAST = ModelMode(GeminiModels.FLASH_3, "bard-mode-option-fast")
-    THINKING = ModelMode(GeminiModels.FLASH_3_THINKING, "bard-mode-option-thinking")
-    PRO = ModelMode(GeminiModels.PRO_3, "bard-mode-option-pro")
-    
+CHAT_HISTORY_SELECTOR = 'infinite-scroller[data-test-id="chat-history-container"]'
+# The send button is disabled while the prompt is empty or an image is uploading
+SEND_BUTTON_READY_SELECTOR = "button.send-button:not([aria-disabled='true']):not([disabled])"
+# Preview of an image added to the prompt
+ATTACHMENT_CHIP_SELECTOR = "uploader-file-preview"
+SEND_TIMEOUT = 2000  # Milliseconds for a sent prompt to appear in the chat before sending it again
+UPLOAD_TIMEOUT = 30000  # Milliseconds for an image to be uploaded
+DEBUGGING_PORT = 9222  # Chrome DevTools Protocol port, through which the tabs of a GeminiBrowserPool are opened
 
 class GeminiBrowser:
 
@@ -47,15 +34,16 @@ class GeminiBrowser:
         TEMPORARY_CHAT = 1
         FILLED_NEW_CHAT = 2
     
-    def __init__(self, mode: ModelMode):
-        self.p = sync_playwright().start()
-        self.browser = self.p.chromium.launch_persistent_context(
-            USER_DATA_DIR,
-            channel="chrome",
-            executable_path=GOOGLE_CHROME_PATH, 
-            headless=False,
-        )
-        self.page = self.browser.new_page()
+    def __init__(self, mode: ModelMode, page=None):
+        """page: tab leased by a GeminiBrowserPool. Without it, Chrome is launched on USER_DATA_DIR."""
+        if page is None:
+            self.p = sync_playwright().start()
+            self.browser = launch_chrome(self.p)
+            page = self.browser.new_page()
+        else:
+            self.p = None
+            self.browser = None
+        self.page = page
         self.page.goto("https://gemini.google.com/app")
         self.chat_mode = self._ChatModes.EMPTY_NEW_CHAT
         self.nb_prompts = 0
@@ -67,6 +55,9 @@ class GeminiBrowser:
             self.switch_model_mode(mode)
 
         self.current_image = None
+        # Seconds spent in each part of the last steps, to measure the overhead of the browser
+        self.step_timings = []
+        self.current_timings = {}
 
     
     def start_new_temporary_chat(self):
@@ -87,20 +78,18 @@ class GeminiBrowser:
 
     def _get_latest_answer(self):
         # Container for all prompt+answer pairs
-        container = self.page.locator('infinite-scroller[data-test-id="chat-history-container"]')
+        container = self.page.locator(CHAT_HISTORY_SELECTOR)
         # Most recent message, last in the history
         last_message = container.locator(":scope > *").nth(-1)  # Selects the last child of an element
         # Message contents are in <p> elements
         last_message_content_first_p = last_message.locator("p[data-path-to-node='0']")
-        last_message_content = last_message_content_first_p.locator("..")
 
-        # This div appears when the answer has finished generating. We wait for it to be
-        # in the DOM before returning the answer.
+        # This div appears when the answer has finished generating. Playwright waits for it
+        # to be visible from the DOM changes instead of polling it. No timeout, like the answers.
         complete_div = last_message.locator('div[data-test-lottie-animation-status="completed"]')
-        visible = complete_div.is_visible()
-        while not visible:
-            time.sleep(0.1)
-            visible = complete_div.is_visible()
+        start = time.perf_counter()
+        complete_div.wait_for(state="visible", timeout=0)
+        self.current_timings["generation"] = time.perf_counter() - start
 
         # Since Gemini is supposed to answer with a simple text of structure
         # "input1,input2,..." we only need the first <p>
@@ -109,7 +98,19 @@ class GeminiBrowser:
         return latest_answer
        
 
-    def add_image_to_prompt(self, image_file_path: str):
+    def _convert_image_to_file_payload(self, image):
+        # In-memory images are uploaded from their bytes, without going through the disk
+        if isinstance(image, str):
+            return image
+        return {
+            "name": f"recent_frames.{image.get_file_extension()}",
+            "mimeType": image.mime_type,
+            "buffer": image.data,
+        }
+
+
+    def add_image_to_prompt(self, image):
+        """image: PromptImage, or path of an image file"""
         # Click "Add files" (+) button
         self.page.click("button.upload-card-button.open")
 
@@ -119,9 +120,39 @@ class GeminiBrowser:
 
         # Set the value of the file chooser to our image
         file_chooser = fc_info.value
-        file_chooser.set_files(image_file_path) 
-
-        self.current_image = image_file_path
+        file_chooser.set_files(self._convert_image_to_file_payload(image)) 
+
+        self.current_image = image
+
+
+    def _wait_for_upload(self):
+        """Waits for the attachment chip of the image, then for the send button to be enabled once it's uploaded"""
+        start = time.perf_counter()
+        try:
+            self.page.locator(ATTACHMENT_CHIP_SELECTOR).last.wait_for(state="visible", timeout=UPLOAD_TIMEOUT)
+            self.page.locator(SEND_BUTTON_READY_SELECTOR).wait_for(state="visible", timeout=UPLOAD_TIMEOUT)
+        except PlaywrightTimeoutError:
+            # To catch UI updates. Sending the prompt is retried if the image is missing.
+            print("Image upload not detected, the selectors might need to be updated.")
+        self.current_timings["upload"] = self.current_timings.get("upload", 0) + time.perf_counter() - start
+
+
+    def _wait_for_new_message(self) -> bool:
+        """Waits for the sent prompt to be added to the chat, returns False if it wasn't within SEND_TIMEOUT"""
+        try:
+            # The condition is checked on each DOM mutation (MutationObserver)
+            self.page.wait_for_function(
+                """([selector, n]) => {
+                    let container = document.querySelector(selector);
+                    return container !== null && container.children.length >= n;
+                }""",
+                arg=[CHAT_HISTORY_SELECTOR, self.nb_prompts + 1],
+                polling="mutation",
+                timeout=SEND_TIMEOUT,
+            )
+            return True
+        except PlaywrightTimeoutError:
+            return False
 
 
     def remove_oldest_image():
@@ -157,42 +188,57 @@ class GeminiBrowser:
 
     def send_prompt(self) -> str:
         """Sends the current prompt and returns the model's answer"""
+        step_start = time.perf_counter()
+        self.page.locator(SEND_BUTTON_READY_SELECTOR).wait_for(state="visible", timeout=UPLOAD_TIMEOUT)
         self.page.click("button.send-button")
-        time.sleep(0.5)
-
-        # Container for all prompt+answer pairs
-        container = self.page.locator('infinite-scroller[data-test-id="chat-history-container"]')
-        # Select all direct children of the container
-        messages = container.locator(":scope > *")
-        # Get the number of messages
-        num_prompts = messages.count()
 
-        retry_timeout = 2
-
-        while num_prompts != self.nb_prompts + 1:
-            print(f'Prompt sending failed. Trying again in {retry_timeout}s ...')
-            time.sleep(retry_timeout)
+        while not self._wait_for_new_message():
+            print('Prompt sending failed. Trying again...')
             if self.current_image:
                 self.add_image_to_prompt(self.current_image)
+                self._wait_for_upload()
             self.page.click("button.send-button")
-            time.sleep(0.5)
-            num_prompts = container.locator(":scope > *").count()
 
-        # time.sleep(self.MINIMUM_ANSWER_TIME) # Wait for the answer to be generated
+        self.current_timings["send"] = time.perf_counter() - step_start
         self.nb_prompts += 1
         self.current_image = None
-        return self._get_latest_answer()
+        answer = self._get_latest_answer()
+        self._end_step_timings(step_start)
+        return answer
+
+
+    def _end_step_timings(self, step_start: float):
+        self.current_timings["total"] = time.perf_counter() - self.current_timings.pop("start", step_start)
+        self.current_timings["overhead"] = self.current_timings["total"] - self.current_timings["generation"]
+        self.step_timings.append(self.current_timings)
+        self.current_timings = {}
+
+
+    def get_last_step_timings(self) -> dict:
+        if not self.step_timings:
+            return {}
+        return {name: seconds for name, seconds in self.step_timings[-1].items() if name in ("upload", "send", "generation")}
+
+
+    def get_stats(self) -> dict:
+        """Mean seconds per step of each part, overhead being the time not spent generating the answer"""
+        if not self.step_timings:
+            return {}
+        return {name: sum(timings.get(name, 0) for timings in self.step_timings) / len(self.step_timings)
+                for name in ("upload", "send", "generation", "overhead", "total")}
 
     
-    def send_image_prompt(self, image_path: str) -> str:
-        self.add_image_to_prompt(image_path)
-        self.page.wait_for_timeout(1000) # Wait for image to be added to the prompt
+    def send_image_prompt(self, image, input_parser=None) -> str:
+        """input_parser: ignored, the whole answer is always waited for"""
+        self.current_timings = {"start": time.perf_counter()}
+        self.add_image_to_prompt(image)
+        self._wait_for_upload()
         return self.send_prompt()
 
     
     def send_text_prompt(self, text: str) -> str:
+        # send_prompt waits for the send button, which is enabled once the text is in the prompt
         self.add_text_to_prompt(text)
-        time.sleep(1) # Wait for text to be added to the prompt
         return self.send_prompt()
 
 
@@ -234,7 +280,67 @@ class GeminiBrowser:
         self.model_mode = model_mode
 
         return self.model_mode
-    
+
+
+    def close(self):
+        """Closes Chrome, if this browser launched it. The tabs of a GeminiBrowserPool are closed by the pool."""
+        if self.browser is not None:
+            self.browser.close()
+            self.p.stop()
+
+
+class GeminiBrowserPool:
+    """
+    Tabs of a single Chrome instance on USER_DATA_DIR, leased to the games played at the same time
+    (sessions of a MesenServer), each tab having its own chat, model mode and prompt counter.
+
+    The sync API of Playwright can only be used from the thread that started it, so each tab is
+    opened by the thread leasing it, through its own connection to Chrome on debugging_port.
+    """
+    def __init__(self, max_sessions: int, debugging_port: int=DEBUGGING_PORT):
+        self.p = sync_playwright().start()
+        self.browser = launch_chrome(self.p, [f"--remote-debugging-port={debugging_port}"])
+        self.debugging_port = debugging_port
+        self.max_sessions = max_sessions
+        # Bounds the number of tabs waiting for Gemini at the same time
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+
+
+    @contextmanager
+    def lease(self, mode: ModelMode):
+        """
+        Opens a tab and yields its GeminiBrowser, which must only be used by the calling thread.
+        Waits while max_sessions tabs are leased. The tab is closed afterwards.
+        """
+        with self.sessions:
+            p = sync_playwright().start()
+            try:
+                browser = p.chromium.connect_over_cdp(f"http://127.0.0.1:{self.debugging_port}")
+                # The persistent context of the pool, shared by all its tabs
+                page = browser.contexts[0].new_page()
+                try:
+                    yield GeminiBrowser(mode, page=page)
+                finally:
+                    page.close()
+            finally:
+                # Disconnects from Chrome without closing it
+                p.stop()
+
+
+    def close(self):
+        self.browser.close()
+        self.p.stop()
+
+
+def launch_chrome(p, args: list=None):
+    return p.chromium.launch_persistent_context(
+        USER_DATA_DIR,
+        channel="chrome",
+        executable_path=GOOGLE_CHROME_PATH, 
+        headless=False,
+        args=args or [],
+    )
+
 
 def test_model_modes(model: GeminiBrowser):
     for mode_name, model_mode in vars(GeminiModelModes).items():
@@ -1,12 +1,23 @@
 class GeminiModel:
     """Wrapper for the available Gemini models"""
-    def __init__(self, model_code: str, mode: str=None):
+    def __init__(self, model_code: str, mode: str=None, requests_per_minute: int=None, tokens_per_minute: int=None):
+        """requests_per_minute, tokens_per_minute: quotas of the model used by the RateLimiter, None if unknown"""
         self.model_code = model_code
         self.mode = mode
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
 
 
     def get_model_code(self) -> str:
         return self.model_code
+
+
+    def get_requests_per_minute(self) -> int:
+        return self.requests_per_minute
+
+
+    def get_tokens_per_minute(self) -> int:
+        return self.tokens_per_minute
     
 
     def get_model_name(self) -> str:
@@ -40,15 +51,41 @@ class GeminiModel:
         
 # Models are in the docs:
 # https://ai.google.dev/gemini-api/docs/models
+# Quotas of the free tier, to change for a paid tier:
+# https://ai.google.dev/gemini-api/docs/rate-limits
 
 class GeminiModels:
     """Contains all usable Gemini models as attributes"""
     PRO_3 = GeminiModel("gemini-3-pro-preview")
-    PRO_2_5 = GeminiModel("gemini-2.5-pro")
+    PRO_2_5 = GeminiModel("gemini-2.5-pro", requests_per_minute=2, tokens_per_minute=125_000)
     FLASH_3_THINKING = GeminiModel("gemini-3-flash-preview", "thinking")
     FLASH_3 = GeminiModel("gemini-3-flash-preview")
-    FLASH_2_5 = GeminiModel("gemini-2.5-flash")
-    FLASH_2_0 = GeminiModel("gemini-2.0-flash")
-    FLASH_LITE_2_5 = GeminiModel("gemini-2.5-flash-lite")
-    FLASH_LITE_2_0 = GeminiModel("gemini-2.0-flash-lite")
-    GEMMA_3_27b = GeminiModel("gemma-3-27b-it")
\ No newline at end of file
+    FLASH_2_5 = GeminiModel("gemini-2.5-flash", requests_per_minute=10, tokens_per_minute=250_000)
+    FLASH_2_0 = GeminiModel("gemini-2.0-flash", requests_per_minute=15, tokens_per_minute=1_000_000)
+    FLASH_LITE_2_5 = GeminiModel("gemini-2.5-flash-lite", requests_per_minute=15, tokens_per_minute=250_000)
+    FLASH_LITE_2_0 = GeminiModel("gemini-2.0-flash-lite", requests_per_minute=30, tokens_per_minute=1_000_000)
+    GEMMA_3_27b = GeminiModel("gemma-3-27b-it", requests_per_minute=30, tokens_per_minute=15_000)
+
+
+class ModelMode:
+    def __init__(self, gemini_model: GeminiModel, button_data_test_id: str):
+        self.gemini_model = gemini_model
+        self.button_data_test_id = button_data_test_id
+
+
+    def get_button_selector(self) -> str:
+        return f"button[data-test-id='{self.button_data_test_id}']"
+    
+
+    def get_file_name(self) -> str:
+        return self.gemini_model.get_file_name()
+    
+
+    def get_pretty_name(self) -> str:
+        return self.gemini_model.get_pretty_name()
+    
+
+class GeminiModelModes:
+    FAST = ModelMode(GeminiModels.FLASH_3, "bard-mode-option-fast")
+    THINKING = ModelMode(GeminiModels.FLASH_3_THINKING, "bard-mode-option-thinking")
+    PRO = ModelMode(GeminiModels.PRO_3, "bard-mode-option-pro")
\ No newline at end of file
@@ -0,0 +1,14 @@
+from .registry import (
+    BACKENDS, BACKEND_MODELS, register_backend, get_backend_names, get_backend_class, create_backend, get_backend_model
+)
+
+
+__all__ = [
+    "BACKENDS",
+    "BACKEND_MODELS",
+    "register_backend",
+    "get_backend_names",
+    "get_backend_class",
+    "create_backend",
+    "get_backend_model",
+]
\ No newline at end of file
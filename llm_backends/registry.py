@@ -0,0 +1,52 @@
+import importlib
+from typing import Tuple
+
+# Name of each backend -> module and class, imported only when the backend is selected
+BACKENDS = {
+    "gemini_browser": ("gemini.gemini_browser", "GeminiBrowser"),
+    "gemini_browser_pool": ("gemini.gemini_browser", "GeminiBrowserPool"),
+    "gemini_api": ("gemini.gemini_api", "GeminiAPI"),
+    "chatgpt_api": ("chatgpt.chatgpt_api", "ChatGPTAPI"),
+    "hedged": ("llm_hedging.hedged_llm", "HedgedLLM"),
+}
+# Name of each backend -> module and class listing its models, to select them by name (see sweeps/)
+BACKEND_MODELS = {
+    "gemini_browser": ("gemini.gemini_models", "GeminiModelModes"),
+    "gemini_api": ("gemini.gemini_models", "GeminiModels"),
+    "chatgpt_api": ("chatgpt.chatgpt_models", "ChatGPTModels"),
+}
+
+
+def register_backend(name: str, module_name: str, class_name: str, models: Tuple[str, str]=None):
+    """models: module and class listing the models of the backend, if they can be selected by name"""
+    BACKENDS[name] = (module_name, class_name)
+    if models is not None:
+        BACKEND_MODELS[name] = models
+
+
+def get_backend_names() -> Tuple[str, ...]:
+    return tuple(BACKENDS)
+
+
+def get_backend_class(name: str):
+    """Imports the module of the backend and returns its class"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name!r}. Available backends: {', '.join(BACKENDS)}")
+    module_name, class_name = BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_backend(name: str, *args, **kwargs):
+    """Creates the backend with the arguments of its class, like create_backend("gemini_api", GeminiModels.FLASH_2_5)"""
+    return get_backend_class(name)(*args, **kwargs)
+
+
+def get_backend_model(name: str, model_name: str):
+    """Model of a backend from its name in the backend's model list, like get_backend_model("gemini_api", "FLASH_2_5")"""
+    if name not in BACKEND_MODELS:
+        raise ValueError(f"The models of the LLM backend {name!r} can't be selected by name")
+    module_name, class_name = BACKEND_MODELS[name]
+    models = getattr(importlib.import_module(module_name), class_name)
+    if not hasattr(models, model_name):
+        raise ValueError(f"Unknown model {model_name!r} for the LLM backend {name!r}")
+    return getattr(models, model_name)
\ No newline at end of file
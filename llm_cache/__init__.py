@@ -0,0 +1,9 @@
+from .llm_cache import LLMCache, CacheModes, CacheMissError, hash_exchange
+
+
+__all__ = [
+    "LLMCache",
+    "CacheModes",
+    "CacheMissError",
+    "hash_exchange",
+]
\ No newline at end of file
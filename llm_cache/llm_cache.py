@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+CACHE_DIR = "data/llm_cache"
+MAX_CACHE_SIZE = 256 * 1024 * 1024  # Bytes of responses kept on disk before evicting the least recently used
+FULL_ANSWER_MODE = "full"  # Answer mode of the responses that aren't streamed to a parser
+
+
+class CacheModes:
+    """How an LLMCache is used by the backends"""
+    READ_THROUGH = "read-through"  # Returns cached responses and calls the model on misses
+    RECORD_ONLY = "record-only"  # Always calls the model and stores its responses
+    REPLAY_ONLY = "replay-only"  # Never calls the model, a miss raises a CacheMissError
+
+
+class CacheMissError(Exception):
+    """Raised in replay-only mode when a prompt isn't in the cache"""
+
+
+def hash_exchange(conversation_hash: str, key: str, response: str) -> str:
+    """Hash of a conversation after a prompt (identified by its cache key) and its response"""
+    return hashlib.sha256(f"{conversation_hash}\0{key}\0{response}".encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache of LLM responses shared by the backends, with LRU eviction.
+
+    Entries are keyed by the model code, the hash of the conversation before the prompt, the prompt
+    text and the hash of the prompt image, so a response is only reused in the exact same context.
+    """
+    def __init__(self, mode: str=CacheModes.READ_THROUGH, cache_dir: str=CACHE_DIR, max_size: int=MAX_CACHE_SIZE):
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Sessions of a MesenServer share the cache from different threads
+        self.lock = threading.Lock()
+        # Key -> size of its file, from the least to the most recently used
+        self.entries = OrderedDict()
+        self.size = 0
+        self._load_entries()
+        # max_size might be smaller than in a previous run
+        self._evict()
+
+
+    def _load_entries(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        # The modification time of a file is updated when it's used
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.size += size
+
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+
+    def make_key(self, model_code: str, conversation_hash: str, prompt_text: str, image_hash: str, input_parser=None) -> str:
+        """
+        input_parser: InputParser or PlanParser the answer is streamed to, None for full answers. Its answer mode
+                      (cut at the action line or at the end of the plan) and JSON schema are part of the key,
+                      so a replayed response has the same shape as the one the backend would return.
+        """
+        answer_mode = FULL_ANSWER_MODE if input_parser is None else input_parser.answer_mode
+        response_schema = None if input_parser is None else input_parser.response_schema
+        schema = json.dumps(response_schema, sort_keys=True) if response_schema is not None else ""
+        fields = (model_code, conversation_hash, prompt_text or "", image_hash or "", answer_mode, schema)
+        return hashlib.sha256("\0".join(fields).encode()).hexdigest()
+
+
+    def get(self, key: str) -> Optional[str]:
+        # Keys missing from the index are still looked up on disk, since other processes
+        # sharing the cache directory (parallel sweep workers) add entries after it's loaded
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            response = json.loads(data)["response"]
+            os.utime(path)
+        except FileNotFoundError:
+            # Never cached, or removed by another process
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+            return None
+        except (OSError, ValueError, KeyError):
+            # Corrupted
+            self._remove(key)
+            return None
+        with self.lock:
+            added = key not in self.entries
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+        if added:
+            self._evict()
+        return response
+
+
+    def put(self, key: str, response: str, model_code: str=None):
+        data = json.dumps({"model": model_code, "response": response}).encode("utf-8")
+        path = self._get_path(key)
+        # Written to a temporary file first so a crash never leaves a partial entry
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+        self._evict()
+
+
+    def _remove(self, key: str):
+        with self.lock:
+            self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self._get_path(key))
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.size <= self.max_size or len(self.entries) <= 1:
+                    return
+                key = next(iter(self.entries))
+            self._remove(key)
+
+
+    def get_or_call(self, key: str, call: Callable[[], str], model_code: str=None) -> str:
+        """Returns the cached response of key or the one of call, depending on the mode"""
+        if self.mode != CacheModes.RECORD_ONLY:
+            response = self.get(key)
+            if response is not None:
+                with self.lock:
+                    self.hits += 1
+                return response
+        with self.lock:
+            self.misses += 1
+        if self.mode == CacheModes.REPLAY_ONLY:
+            raise CacheMissError(f"No cached response for key {key}.")
+
+        response = call()
+        self.put(key, response, model_code)
+        return response
+
+
+    def get_stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "size": self.size}
\ No newline at end of file
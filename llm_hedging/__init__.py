@@ -0,0 +1,7 @@
+from .hedged_llm import HedgedLLM, HedgeCancelledError
+
+
+__all__ = [
+    "HedgedLLM",
+    "HedgeCancelledError",
+]
\ No newline at end of file
@@ -0,0 +1,282 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+import copy
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from mesen_python.input_parser import InputParser
+
+HEDGE_PERCENTILE = 95  # A second request is sent when the primary takes longer than this percentile of its recent latencies
+MIN_LATENCY_SAMPLES = 10  # Number of primary latencies needed before using the percentile
+INITIAL_HEDGE_DELAY = 5.0  # Hedge delay in seconds until there are enough latency samples
+LATENCY_WINDOW = 100  # Number of recent latencies kept
+
+
+class HedgeCancelledError(Exception):
+    """Stops the answer of a backend when the other one answered first"""
+    pass
+
+
+class _HedgedInputParser:
+    """
+    Copy of the input parser (InputParser or PlanParser) for one backend, which stops its stream
+    once the request was cancelled
+    """
+    def __init__(self, input_parser: InputParser, cancelled: threading.Event):
+        self.input_parser = copy.copy(input_parser)
+        self.cancelled = cancelled
+
+
+    def __getattr__(self, name: str):
+        return getattr(self.input_parser, name)
+
+
+    def feed(self, chunk: str) -> Optional[str]:
+        if self.cancelled.is_set():
+            raise HedgeCancelledError()
+        return self.input_parser.feed(chunk)
+
+
+class _Attempt:
+    """Prompt sent to one backend"""
+    def __init__(self, backend, future: Future, cancelled: threading.Event, input_parser: InputParser,
+                 clock: Callable[[], float], start: float):
+        self.backend = backend
+        self.future = future
+        self.cancelled = cancelled
+        self.input_parser = input_parser
+        self.clock = clock
+        self.start = start
+        # Time the request finished, None while it runs
+        self.end = None
+        future.add_done_callback(self._set_end)
+
+
+    def _set_end(self, future: Future):
+        self.end = self.clock()
+
+
+    def get_elapsed(self) -> float:
+        """Seconds the request took, or has been running for"""
+        return (self.end if self.end is not None else self.clock()) - self.start
+
+
+class HedgedLLM:
+    """
+    Sends the prompts to a primary backend and, when it doesn't answer within a percentile of its
+    recent latencies, sends the same prompt to a secondary backend (another model or client).
+    The first valid answer is returned and the other request is cancelled.
+    Has the same interface as GeminiAPI and ChatGPTAPI.
+
+    Each backend keeps its own conversation with the exchanges it answered. The text prompts
+    (initial context) are sent to both backends. The backends are called from worker threads,
+    so only the API backends are supported, not GeminiBrowser.
+    A request can only be cancelled while streaming (input_parser given), otherwise the backend
+    finishes it in the background before getting a new prompt.
+
+    clock: returns the time in seconds used to measure the latencies, replaced in the tests
+    """
+    def __init__(self, primary, secondary, hedge_percentile: float=HEDGE_PERCENTILE,
+                 min_latency_samples: int=MIN_LATENCY_SAMPLES, initial_hedge_delay: float=INITIAL_HEDGE_DELAY,
+                 clock: Callable[[], float]=time.perf_counter):
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge_percentile = hedge_percentile
+        self.min_latency_samples = min_latency_samples
+        self.initial_hedge_delay = initial_hedge_delay
+        self.clock = clock
+
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedged-llm")
+        # Last request of each backend, which might still run after being cancelled
+        self.last_futures = {}
+
+        self.primary_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.n_requests = 0
+        self.n_hedged = 0
+        self.n_secondary_wins = 0
+
+        self.prompt_text = None
+        self.prompt_image = None
+
+
+    def start_new_temporary_chat(self):
+        self._wait_for_backends()
+        self.primary.start_new_temporary_chat()
+        self.secondary.start_new_temporary_chat()
+
+
+    def start_new_chat(self):
+        self._wait_for_backends()
+        self.primary.start_new_chat()
+        self.secondary.start_new_chat()
+
+
+    def add_text_to_prompt(self, text: str):
+        if not self.prompt_text:
+            self.prompt_text = text
+        else:
+            self.prompt_text += text
+
+
+    def add_image_to_prompt(self, image):
+        """image: PromptImage, or path of an image file"""
+        self.prompt_image = image
+
+
+    def _reset_prompt(self):
+        self.prompt_text = None
+        self.prompt_image = None
+
+
+    def send_text_prompt(self, text: str) -> str:
+        """Sends the prompt to both backends so they share the context, and returns the primary's answer"""
+        self.add_text_to_prompt(text)
+        prompt_text = self.prompt_text
+        self._reset_prompt()
+        self._wait_for_backends()
+        secondary = self._submit(self.secondary, prompt_text, None, None)
+        answer = self.primary.send_text_prompt(prompt_text)
+        secondary.future.result()
+        return answer
+
+
+    def send_image_prompt(self, image, input_parser: InputParser=None) -> str:
+        """input_parser: streams the answers, validates them and allows cancelling the slower one"""
+        self.add_image_to_prompt(image)
+        return self.send_prompt(input_parser)
+
+
+    def send_prompt(self, input_parser: InputParser=None) -> str:
+        prompt_text, prompt_image = self.prompt_text, self.prompt_image
+        self._reset_prompt()
+        if not prompt_text and not prompt_image:
+            return "Prompt is empty!"
+
+        start = self.clock()
+        self._wait_for_backend(self.primary)
+        attempts = [self._submit(self.primary, prompt_text, prompt_image, input_parser)]
+        wait([attempts[0].future], timeout=self.get_hedge_delay())
+        # A secondary still busy with a request it couldn't cancel isn't used
+        if not attempts[0].future.done() and self._is_idle(self.secondary):
+            attempts.append(self._submit(self.secondary, prompt_text, prompt_image, input_parser))
+            self.n_hedged += 1
+
+        winner, answer = self._wait_for_winner(attempts)
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancelled.set()
+        # A primary cancelled after losing is recorded with the time it had run for, a lower bound of its latency.
+        # Only keeping the latencies of the primary's wins would shrink the hedge delay and raise the hedge rate.
+        self.primary_latencies.append(attempts[0].get_elapsed())
+
+        self.n_requests += 1
+        self.latencies.append(self.clock() - start)
+        if winner.backend is self.secondary:
+            self.n_secondary_wins += 1
+        return answer
+
+
+    def _submit(self, backend, prompt_text: str, prompt_image, input_parser: InputParser) -> _Attempt:
+        cancelled = threading.Event()
+        backend_parser = _HedgedInputParser(input_parser, cancelled) if input_parser is not None else None
+        start = self.clock()
+
+        def send() -> str:
+            if prompt_text:
+                backend.add_text_to_prompt(prompt_text)
+            if prompt_image is None:
+                return backend.send_prompt()
+            return backend.send_image_prompt(prompt_image, input_parser=backend_parser)
+
+        future = self.executor.submit(send)
+        self.last_futures[id(backend)] = future
+        return _Attempt(backend, future, cancelled, backend_parser, self.clock, start)
+
+
+    def _wait_for_winner(self, attempts: list):
+        """Returns the attempt with the first valid answer, or else the first answer, and its answer"""
+        pending = {attempt.future: attempt for attempt in attempts}
+        first_answer = None
+        first_error = None
+        while pending:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+
+                if attempt.input_parser is None or self._is_valid(answer, attempt.input_parser):
+                    return attempt, answer
+                if first_answer is None:
+                    first_answer = (attempt, answer)
+
+        if first_answer is not None:
+            return first_answer
+        raise first_error
+
+
+    def _is_valid(self, answer: str, input_parser: InputParser) -> bool:
+        return any(input_parser.parse_line(line) is not None for line in answer.split("\n"))
+
+
+    def _is_idle(self, backend) -> bool:
+        future = self.last_futures.get(id(backend))
+        return future is None or future.done()
+
+
+    def _wait_for_backend(self, backend):
+        """Waits for the backend to finish its last request, which might not have been cancellable"""
+        future = self.last_futures.get(id(backend))
+        if future is not None:
+            wait([future])
+
+
+    def _wait_for_backends(self):
+        self._wait_for_backend(self.primary)
+        self._wait_for_backend(self.secondary)
+
+
+    def get_hedge_delay(self) -> float:
+        """Seconds the primary has to answer before the prompt is also sent to the secondary"""
+        if len(self.primary_latencies) < self.min_latency_samples:
+            return self.initial_hedge_delay
+        return float(np.percentile(self.primary_latencies, self.hedge_percentile))
+
+
+    def get_stats(self) -> dict:
+        """Hedge rate and percentiles of the recent latencies, in seconds"""
+        stats = {
+            "requests": self.n_requests,
+            "hedge_rate": self.n_hedged / self.n_requests if self.n_requests else 0,
+            "secondary_wins": self.n_secondary_wins,
+            "hedge_delay": self.get_hedge_delay(),
+        }
+        if self.latencies:
+            for percentile in (50, 95, 99):
+                stats[f"p{percentile}"] = float(np.percentile(self.latencies, percentile))
+        return stats
+
+
+    def get_model(self):
+        return self.primary.get_model()
+
+
+    def get_model_file_name(self) -> str:
+        return f"{self.primary.get_model_file_name()}_hedged_{self.secondary.get_model_file_name()}"
+
+
+    def get_model_name(self) -> str:
+        return f"{self.primary.get_model_name()} (hedged with {self.secondary.get_model_name()})"
+
+
+    def switch_model(self, model):
+        self._wait_for_backends()
+        self.primary.switch_model(model)
+        self.secondary.start_new_chat()
\ No newline at end of file
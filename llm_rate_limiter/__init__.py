@@ -0,0 +1,7 @@
+from .rate_limiter import RateLimiter, estimate_tokens
+
+
+__all__ = [
+    "RateLimiter",
+    "estimate_tokens",
+]
\ No newline at end of file
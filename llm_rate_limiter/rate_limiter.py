@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RATE_LIMIT_DIR = "data/rate_limits"
+QUOTA_MARGIN = 0.9  # Fraction of the quotas used, to stay just under them
+CHARS_PER_TOKEN = 4  # Rough number of characters of text per token
+IMAGE_TOKENS = 258  # Tokens of an image up to 384x384 for Gemini, larger ones are tiled
+
+
+def estimate_tokens(text: str="", n_images: int=0) -> int:
+    """Rough number of tokens of a prompt or an answer, counted before knowing the real usage"""
+    return len(text) // CHARS_PER_TOKEN + n_images * IMAGE_TOKENS
+
+
+class _FileLock:
+    """Exclusive lock on a file, shared by the threads and processes using the same rate limits"""
+    def __init__(self, path: str):
+        self.path = path
+
+
+    def __enter__(self):
+        self.file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            # LK_LOCK raises after trying for 10 seconds
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        return self
+
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+class RateLimiter:
+    """
+    Token buckets of the requests and tokens per minute of each model, kept in files so that every
+    run using the same API keys shares them (threads of a MesenServer or separate processes).
+
+    The backends wait in acquire() until the request fits in the quotas of their model instead
+    of waiting after being refused. Models without known quotas are only paused after a rate limit error.
+    """
+    def __init__(self, rate_limit_dir: str=RATE_LIMIT_DIR, quota_margin: float=QUOTA_MARGIN):
+        self.rate_limit_dir = rate_limit_dir
+        self.quota_margin = quota_margin
+        os.makedirs(self.rate_limit_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.waiting_time = 0.0
+
+
+    def _get_path(self, model_code: str) -> str:
+        return os.path.join(self.rate_limit_dir, model_code.replace("/", "_") + ".json")
+
+
+    def _get_limits(self, model) -> tuple:
+        requests_per_minute = model.get_requests_per_minute()
+        tokens_per_minute = model.get_tokens_per_minute()
+        return (requests_per_minute * self.quota_margin if requests_per_minute else None,
+                tokens_per_minute * self.quota_margin if tokens_per_minute else None)
+
+
+    def _update(self, model, change_state) -> float:
+        """Refills the buckets of the model and applies change_state, which returns the time to wait"""
+        requests_limit, tokens_limit = self._get_limits(model)
+        path = self._get_path(model.get_model_code())
+        with self.lock, _FileLock(path + ".lock"):
+            now = time.time()
+            try:
+                with open(path, "r") as f:
+                    state = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                state = {"requests": requests_limit, "tokens": tokens_limit, "time": now, "paused_until": 0}
+
+            elapsed = max(0.0, now - state["time"])
+            if requests_limit:
+                state["requests"] = min(requests_limit, (state["requests"] or 0) + elapsed * requests_limit / 60)
+            if tokens_limit:
+                state["tokens"] = min(tokens_limit, (state["tokens"] or 0) + elapsed * tokens_limit / 60)
+            state["time"] = now
+
+            delay = change_state(state, now, requests_limit, tokens_limit)
+            with open(path, "w") as f:
+                json.dump(state, f)
+        return delay
+
+
+    def acquire(self, model, tokens: int=0) -> int:
+        """
+        Waits until a request of about this number of tokens fits in the quotas of the model, and counts it.
+        Returns the number of tokens charged, to pass to record_usage()
+        """
+        requests_limit, tokens_limit = self._get_limits(model)
+        # A request larger than the whole bucket only waits for it to be full
+        tokens = min(tokens, tokens_limit) if tokens_limit else 0
+
+        def take(state, now, requests_limit, tokens_limit) -> float:
+            delay = max(0.0, state["paused_until"] - now)
+            if requests_limit and state["requests"] < 1:
+                delay = max(delay, (1 - state["requests"]) * 60 / requests_limit)
+            if tokens_limit and state["tokens"] < tokens:
+                delay = max(delay, (tokens - state["tokens"]) * 60 / tokens_limit)
+            if delay == 0:
+                if requests_limit:
+                    state["requests"] -= 1
+                if tokens_limit:
+                    state["tokens"] -= tokens
+            return delay
+
+        while True:
+            delay = self._update(model, take)
+            if delay == 0:
+                return tokens
+            self.waiting_time += delay
+            time.sleep(delay)
+
+
+    def record_usage(self, model, charged_tokens: int, used_tokens: int):
+        """Corrects the tokens charged by acquire() once the real usage of the request is known"""
+        if not self._get_limits(model)[1]:
+            return
+
+        def correct(state, now, requests_limit, tokens_limit) -> float:
+            # The bucket can become negative, delaying the next requests
+            state["tokens"] -= used_tokens - charged_tokens
+            return 0
+
+        self._update(model, correct)
+
+
+    def pause(self, model, seconds: float):
+        """Makes every run wait after a rate limit error, instead of each one getting its own"""
+        def set_pause(state, now, requests_limit, tokens_limit) -> float:
+            state["paused_until"] = max(state["paused_until"], now + seconds)
+            return 0
+
+        self._update(model, set_pause)
+
+
+    def get_stats(self) -> dict:
+        return {"waiting_time": round(self.waiting_time, 2)}
\ No newline at end of file
@@ -1,35 +1,110 @@
+import functools
+import random
 import time
 from collections import deque
+from typing import List
 
 from gemini import *
 from chatgpt import *
 from mesen_python import *
+from llm_backends import *
+from llm_cache import *
+from llm_rate_limiter import *
 
 
 INPUT_LENGTH = 30  # Number of frames the inputs will be applied for
 N_SCREENSHOTS = 3  # Number of screenshots to provide to the LLM (all in one file)
 FREQ_SCREENSHOTS = 1 if N_SCREENSHOTS > 1 else 1 # Frequency of screenshots (in frames)
-
-game = SMB(
-    input_length=INPUT_LENGTH,
-    n_screenshots=N_SCREENSHOTS,
-    freq_screenshots=FREQ_SCREENSHOTS
-)
-valid_inputs = set(game.get_valid_inputs())
+SAVE_SCREENSHOTS = False  # Writes the image given to the LLM to data/<game>/recent_frames.png, for debugging
+CROP_SCREENSHOTS = False  # Only shows the game's region of interest of each frame (no HUD)
+DOWNSCALE = 1  # Integer factor the width and height of the frames are divided by
+IMAGE_FORMAT = IMAGE_FORMAT_PNG  # Encoding of the image given to the LLM: IMAGE_FORMAT_PNG, IMAGE_FORMAT_NES_PNG or IMAGE_FORMAT_WEBP
+# The API backends answer with a JSON array of the valid inputs (Game.get_input_schema) instead of free text,
+# which is always streamed. GeminiBrowser answers are still parsed as text.
+STRUCTURED_INPUTS = False
+# The LLM can answer with a plan of up to MAX_PLAN_WINDOWS windows ("right,b*4" lines), which main.lua plays
+# without waiting for Python. A plan is interrupted when the player dies, loses control or goes back. 1 disables the plans.
+MAX_PLAN_WINDOWS = 1
+
+SERVER_MODE = False  # Plays with every Mesen instance that connects instead of a single one
+MAX_SESSIONS = 8  # Maximum number of games played at the same time in server mode
+# In server mode, the sessions play with the tabs of a single Chrome instance ("gemini_browser_pool")
+# instead of create_llm(), using the modes of BROWSER_POOL_MODES in turn
+USE_BROWSER_POOL = False
+BROWSER_POOL_MODES = [GeminiModelModes.FAST, GeminiModelModes.THINKING, GeminiModelModes.PRO]
+
+
+def create_game(**kwargs):
+    return SMB(
+        input_length=INPUT_LENGTH,
+        n_screenshots=N_SCREENSHOTS,
+        freq_screenshots=FREQ_SCREENSHOTS,
+        save_screenshots=SAVE_SCREENSHOTS,
+        image_encoder=ImageEncoder(IMAGE_FORMAT),
+        crop_screenshots=CROP_SCREENSHOTS,
+        downscale=DOWNSCALE,
+        structured_inputs=STRUCTURED_INPUTS,
+        max_plan_windows=MAX_PLAN_WINDOWS,
+        **kwargs
+    )
 
 
 LLM_INPUT = True
-if LLM_INPUT:
-    # llm = ChatGPTAPI(ChatGPTModels.NANO_5)
-    # llm = GeminiAPI(GeminiModels.FLASH_LITE_2_5)
-    llm = GeminiBrowser(GeminiModelModes.FAST)
+# Caches the API backends' responses in data/llm_cache: CacheModes.READ_THROUGH, CacheModes.RECORD_ONLY
+# or CacheModes.REPLAY_ONLY (reruns without network access). None disables the cache.
+LLM_CACHE_MODE = None
+LLM_CACHE = LLMCache(LLM_CACHE_MODE) if LLM_CACHE_MODE else None
+# Keeps the API backends under the free-tier quotas of their model, shared with the other runs through data/rate_limits.
+# Off by default since paid keys have higher quotas.
+LIMIT_RATE = False
+# Created by setup_rate_limiter() when playing, not on import (the sweeps import main)
+RATE_LIMITER = None
+
+
+def setup_rate_limiter():
+    global RATE_LIMITER
+    if LIMIT_RATE and RATE_LIMITER is None:
+        RATE_LIMITER = RateLimiter()
+    return RATE_LIMITER
+
+
+def create_llm():
+    # Only the module of the selected backend is imported (see llm_backends.BACKENDS)
+    # return create_backend("chatgpt_api", ChatGPTModels.NANO_5, cache=LLM_CACHE, rate_limiter=RATE_LIMITER)
+    # return create_backend("gemini_api", GeminiModels.FLASH_LITE_2_5, cache=LLM_CACHE, rate_limiter=RATE_LIMITER)
+    # Sends slow prompts to a second backend too, and uses the first valid answer
+    # return create_backend("hedged", create_backend("gemini_api", GeminiModels.FLASH_LITE_2_5),
+    #                       create_backend("chatgpt_api", ChatGPTModels.NANO_5))
+    return create_backend("gemini_browser", GeminiModelModes.FAST)
+
 n_same_progress_equals_stuck = 3
 ADD_STUCK_PROMPT = True if LLM_INPUT else False
 ADD_PROGRESS_PROMPT = True
+STREAM_LLM_INPUTS = True  # Streams the answers of the API backends and stops them once the inputs are complete
 STOP_ON_GAME_OVER = True
 
+# When a window looks like a recent one with the same progress, the LLM isn't called and
+# UNCHANGED_WINDOW_POLICY decides the inputs instead:
+# "reuse" applies the previous inputs, "perturb" changes one of them, "escalate" still calls
+# the LLM but tells it that the screen hasn't changed
+SKIP_UNCHANGED_WINDOWS = False
+UNCHANGED_WINDOW_POLICY = "reuse"
+MAX_FRAME_HASH_DISTANCE = 2  # Maximum number of different bits between the frame hashes of similar windows (a moving 16x16 sprite flips about 4)
+MAX_SKIPPED_LLM_CALLS = 2  # The LLM is called again after this many consecutive skipped calls
 
-def get_initial_context_prompt():
+
+def get_plan_prompt(game) -> str:
+    if game.max_plan_windows <= 1:
+        return ""
+    return (
+        "When the next moves are obvious, you can answer with a plan instead of a single combination of inputs: "
+        "one combination per line, each followed by * and the number of times it is applied in a row, like right,b*4, "
+        f"for at most {game.max_plan_windows} times in total. The plan is stopped as soon as you die, lose control "
+        "or go back, and you will then receive a new image.\n"
+    )
+
+
+def get_initial_context_prompt(game):
     return (
         f"You are a video game player. You are currently playing the game {game.get_full_name()} "
         f"for the {game.get_console()}. The goal of the game is: {game.get_game_objective()}\n"
@@ -40,9 +115,11 @@ def get_initial_context_prompt():
         "after which you will receive a new image to repeat the process."
         "The inputs you answer must respect the format and they must contribute to reaching the game's goal. Only one of each input must be in the answer. "
         f"If you see that the inputs have no effects on the game, try different ones, don't try the same inputs more than {n_same_progress_equals_stuck} times if you don't see any changes.\n"
+        f"{get_plan_prompt(game)}"
 
         f"To decide which inputs to choose, you will be given images of the last {game.get_screenshot_history_length()} "
         "frames that the game has rendered, where the leftmost frame is the oldest and the rightmost frame is the most recent. "
+        f"{game.get_screenshots_description()}"
         "With these images, you will also receive your current game progress.\n"
 
         'Answer "Understood." if you understood these instructions.'
@@ -66,20 +143,50 @@ def get_user_input() -> str:
     return ','.join(inputs_split)
 
 
-def get_llm_input(progress: str, frames_image: str) -> str:
+def get_llm_input(llm, valid_inputs: set, progress: str, frames_image: PromptImage, response_schema: dict=None) -> str:
+    """response_schema: JSON schema the API backends' answers are constrained to"""
     if ADD_PROGRESS_PROMPT:
         llm.add_text_to_prompt("Progress: " + progress)
         
-    answer = llm.send_image_prompt(frames_image) 
+    # When streaming, the API backends return as soon as the answer contains a line of valid inputs
+    input_parser = InputParser(valid_inputs, response_schema) if STREAM_LLM_INPUTS or response_schema else None
+    answer = llm.send_image_prompt(frames_image, input_parser=input_parser) 
+    if response_schema is not None:
+        # Streamed answers are already parsed, unfinished ones and GeminiBrowser's are parsed here
+        inputs = input_parser.parse_line(answer)
+        return answer if inputs is None else inputs
     # Allowing the LLM to add spaces after the commas 
     no_space_answer = answer.replace(" ", "").strip()
-    if inputs_are_valid(no_space_answer):
+    if inputs_are_valid(no_space_answer, valid_inputs):
         return no_space_answer
     
     return answer
 
 
-def inputs_are_valid(inputs: str) -> bool:
+def get_llm_plan(llm, valid_inputs: set, progress: str, frames_image: PromptImage, max_windows: int,
+                 response_schema: dict=None) -> List[str]:
+    """
+    Inputs of each window of the plan answered by the LLM, or its answer as the only window if it isn't a plan
+    response_schema: JSON schema of the structured plans the API backends' answers are constrained to
+    """
+    if ADD_PROGRESS_PROMPT:
+        llm.add_text_to_prompt("Progress: " + progress)
+
+    # When streaming, the API backends return as soon as the plan is complete
+    plan_parser = PlanParser(valid_inputs, max_windows, response_schema)
+    answer = llm.send_image_prompt(frames_image, input_parser=plan_parser if STREAM_LLM_INPUTS or response_schema else None)
+    windows = plan_parser.parse_plan(answer)
+    return windows if windows is not None else [answer]
+
+
+def perturb_inputs(inputs: str, valid_inputs: set) -> str:
+    """Adds or removes one random input"""
+    inputs_set = set(inputs.split(",")) if inputs else set()
+    inputs_set ^= {random.choice(sorted(valid_inputs))}
+    return ",".join(input for input in sorted(valid_inputs) if input in inputs_set)
+
+
+def inputs_are_valid(inputs: str, valid_inputs: set) -> bool:
     if inputs == "":
         return True
     
@@ -87,12 +194,17 @@ def inputs_are_valid(inputs: str) -> bool:
     return inputs_set.issubset(valid_inputs)  
 
 
-def main():
-    """Main execution loop"""
+def play(game, llm):
+    """Main execution loop of a game. llm is None when the inputs are entered by the user"""
+    valid_inputs = set(game.get_valid_inputs())
+    response_schema = None
+    if game.structured_inputs:
+        response_schema = game.get_plan_schema(game.max_plan_windows) if game.max_plan_windows > 1 else game.get_input_schema()
+
     if LLM_INPUT:
         print("Playing LLM:", llm.get_model_name())
 
-        initial_context_prompt = get_initial_context_prompt()
+        initial_context_prompt = get_initial_context_prompt(game)
 
         print("-" * 30 + "\n" + initial_context_prompt + "\n" + "-" * 30)
 
@@ -109,13 +221,32 @@ def main():
         playthrough.append(inputs.replace(",", ";") + '|' + progress)
 
     progress_queue = deque(maxlen=n_same_progress_equals_stuck)
+    recent_windows = RecentWindows()
+    n_skipped_llm_calls = 0
+    # Inputs of the windows main.lua plays from the last plan
+    planned_windows = deque()
+    plan_stats = {"llm_calls": 0, "planned_windows": 0, "interrupted_plans": 0}
 
     print('\nStarting playing sequence\n' + "-" * 30)
 
     while True:
+        # A step goes from the end of a window to the end of the next one
+        game.timings.start_step()
         input_timeout = game.get_input_timeout()
 
         progress = game.get_progress()    
+        planned_progress = game.get_planned_window_progress(progress)
+        if planned_progress is not None:
+            # Played by main.lua without waiting for Python
+            inputs = planned_windows.popleft() if planned_windows else ""
+            print("Progress:", planned_progress, "(planned window)")
+            add_to_playthrough("Plan:" + ("None" if inputs == "" else inputs), planned_progress)
+            plan_stats["planned_windows"] += 1
+            continue
+        if planned_windows:
+            print(f"Plan interrupted, {len(planned_windows)} planned windows weren't played")
+            planned_windows.clear()
+            plan_stats["interrupted_plans"] += 1
         print("Progress:", progress)
 
         progress_queue.append(progress)
@@ -129,11 +260,26 @@ def main():
             if LLM_INPUT:
                 playthrough_file = game.save_playthrough(playthrough, llm.get_model_file_name())
                 print(f"Saved playthrough to {playthrough_file}\n" + "-" * 15)
+                game.timings.end_step()
+                print("Step timings:\n" + game.timings.get_summary())
+                print(f"Saved step timings to {game.save_timings(llm.get_model_file_name())}.json/.csv")
+                if LLM_CACHE:
+                    print("LLM cache:", LLM_CACHE.get_stats())
+                if RATE_LIMITER:
+                    print("Rate limiter:", RATE_LIMITER.get_stats())
+                # Browser timings or hedged requests
+                if hasattr(llm, "get_stats"):
+                    print("LLM stats:", llm.get_stats())
+                if game.max_plan_windows > 1:
+                    print("Plans:", plan_stats)
                 if STOP_ON_GAME_OVER:
                     break
                 llm.start_new_temporary_chat()
-                llm.send_text_prompt(get_initial_context_prompt())
+                llm.send_text_prompt(get_initial_context_prompt(game))
             playthrough = []
+            recent_windows.clear()
+            # Like DEAD, GAME OVER is an event without frames
+            continue
 
         elif progress == "DEAD":
             # Tell the model that it has died
@@ -149,16 +295,58 @@ def main():
             add_to_playthrough("Skipped", progress)
             continue
 
+        similar_window = None
+        if LLM_INPUT and SKIP_UNCHANGED_WINDOWS and n_skipped_llm_calls < MAX_SKIPPED_LLM_CALLS:
+            similar_window = recent_windows.find(progress, game.get_frame_hash(), MAX_FRAME_HASH_DISTANCE)
+
+        if similar_window is not None and UNCHANGED_WINDOW_POLICY != "escalate":
+            if UNCHANGED_WINDOW_POLICY == "perturb":
+                inputs = perturb_inputs(similar_window.inputs, valid_inputs)
+            else:
+                inputs = similar_window.inputs
+            n_skipped_llm_calls += 1
+            input_time = 0
+            print(f"Window unchanged, applying inputs without calling the LLM ({UNCHANGED_WINDOW_POLICY}):", inputs)
+            game.apply_inputs(inputs)
+            # The step is marked so the playthrough tells it apart from LLM answers
+            add_to_playthrough(f"{UNCHANGED_WINDOW_POLICY.capitalize()}:" + ("None" if inputs == "" else inputs), progress)
+            print("-" * 15)
+            continue
+
+        n_skipped_llm_calls = 0
+        if similar_window is not None:
+            print("Window unchanged. Adding help to prompt.")
+            llm.add_text_to_prompt("The screen hasn't changed since one of your previous answers, try different inputs.\n")
+
+        if LLM_INPUT:
+            # The image is only encoded for the windows given to the LLM. It's done here rather than
+            # by the backend so the image_encode stage is timed in this thread.
+            recent_frames.encode()
         time_before_input = time.time()
-        inputs = get_llm_input(progress, recent_frames) if LLM_INPUT else get_user_input()
+        # Inputs of each window when the LLM can answer with a plan
+        windows = None
+        with game.timings.stage("llm" if LLM_INPUT else "user_input"):
+            if not LLM_INPUT:
+                inputs = get_user_input()
+            elif game.max_plan_windows > 1:
+                windows = get_llm_plan(llm, valid_inputs, progress, recent_frames, game.max_plan_windows, response_schema)
+                inputs = windows[0]
+                plan_stats["llm_calls"] += 1
+            else:
+                inputs = get_llm_input(llm, valid_inputs, progress, recent_frames, response_schema)
         input_time = time.time() - time_before_input
+        if LLM_INPUT and hasattr(llm, "get_last_step_timings"):
+            # Breakdown of the llm stage by the backend, not included in the step total
+            for name, seconds in llm.get_last_step_timings().items():
+                game.timings.add(f"llm.{name}", int(seconds * 1e6))
+        print(f"Time to action: {input_time:.2f}s")
 
         if input_time > input_timeout:
             print(f"Input took longer than {input_timeout}s. Moving to next window...")
             input_time -= input_timeout
             add_to_playthrough("Skipped", progress)
             
-        elif not inputs_are_valid(inputs):
+        elif not inputs_are_valid(inputs, valid_inputs):
             print(f"Invalid inputs: {inputs}. Moving to next window...")
             game.apply_inputs(None)
             add_to_playthrough("Invalid", progress)
@@ -167,13 +355,52 @@ def main():
 
         else:
             print('Applying inputs:', inputs)
-            game.apply_inputs(inputs)
+            if windows is not None and len(windows) > 1:
+                print(f"Planning {len(windows) - 1} more windows:", windows[1:])
+                game.apply_plan(windows)
+                planned_windows.extend(windows[1:])
+            else:
+                game.apply_inputs(inputs)
             playthrough_input = "None" if inputs == "" else inputs
             add_to_playthrough(playthrough_input, progress)
+            if LLM_INPUT:
+                recent_windows.add(progress, game.get_frame_hash(), inputs)
 
         print("-" * 15)
 
 
+def play_session(mesen, session_id: str, browser_pool=None):
+    """
+    Plays the game of a Mesen instance connected to the server with its own LLM.
+    browser_pool: GeminiBrowserPool leasing a tab to the session instead of using create_llm()
+    """
+    game = create_game(mesen=mesen, session_id=session_id)
+    if browser_pool is None:
+        play(game, create_llm())
+        return
+
+    mode = BROWSER_POOL_MODES[int(session_id) % len(BROWSER_POOL_MODES)]
+    with browser_pool.lease(mode) as llm:
+        play(game, llm)
+
+
+def main():
+    """Main execution loop"""
+    setup_rate_limiter()
+    if SERVER_MODE:
+        browser_pool = create_backend("gemini_browser_pool", MAX_SESSIONS) if USE_BROWSER_POOL else None
+        try:
+            MesenServer(functools.partial(play_session, browser_pool=browser_pool), max_sessions=MAX_SESSIONS).run()
+        finally:
+            if browser_pool is not None:
+                browser_pool.close()
+        return
+
+    game = create_game()
+    llm = create_llm() if LLM_INPUT else None
+    play(game, llm)
+
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -77,6 +77,16 @@ function Game.getCurrentProgress()
 	return currentProgress
 end
 
+-- Whether Mario went back since the previous progress (optional, interrupts the plans of main.lua)
+function Game.progressRegressed(previousProgress, progress)
+	local previousLevel, previousPercentage = string.match(previousProgress, "^(%d+%-%d+) %(([%d%.]+) %%%)$")
+	local level, percentage = string.match(progress, "^(%d+%-%d+) %(([%d%.]+) %%%)$")
+	if previousLevel == nil or level == nil or previousLevel ~= level then
+		return false
+	end
+	return tonumber(percentage) < tonumber(previousPercentage)
+end
+
 function Game.playerHasControl()
 	local marioState = getMariosState()
 	local currentGamemode = getCurrentGamemode()
@@ -1,16 +1,161 @@
 ﻿local socket = require("socket.core")
-local game = require("games.smb")
 
+-- Sweeps (sweeps/sweep_runner.py) launch one Mesen per worker and give each one its game and port
+-- with environment variables, which can only be read when "Allow access to I/O and OS functions" is enabled
+function getEnvironmentVariable(name, default)
+	if os ~= nil and os.getenv ~= nil and os.getenv(name) ~= nil then
+		return os.getenv(name)
+	end
+	return default
+end
+
+local game = require("games." .. getEnvironmentVariable("LLM4MESEN_GAME", "smb"))
+
+-- Must match the transport given to Game in Python: "tcp" for TCPTransport, "unix" for UnixTransport.
+-- SharedMemoryTransport uses "tcp" unless it was given a UnixTransport. Python prints the value to use when it listens.
+local TRANSPORT = getEnvironmentVariable("LLM4MESEN_TRANSPORT", "tcp")
+if TRANSPORT ~= "tcp" and TRANSPORT ~= "unix" then
+	error("Unknown LLM4MESEN_TRANSPORT " .. TRANSPORT .. ", it must be tcp or unix")
+end
+local UNIX_SOCKET_PATH = "/tmp/llm4mesen.sock"
+local TCP_PORT = tonumber(getEnvironmentVariable("LLM4MESEN_PORT", "9999"))
 
-local client = socket.tcp()
+
+local client
+if TRANSPORT == "unix" then
+	client = require("socket.unix")()
+else
+	client = socket.tcp()
+end
 local timeout = 10
 client:settimeout(timeout)
-local connected, err = client:connect("localhost", 9999)
+local connected, err
+if TRANSPORT == "unix" then
+	connected, err = client:connect(UNIX_SOCKET_PATH)
+else
+	connected, err = client:connect("localhost", TCP_PORT)
+	client:setoption("tcp-nodelay", true)
+end
+
+-- Protocol versions, must match mesen_python/mesen.py
+local PROTOCOL_TEXT = 1
+local PROTOCOL_BINARY = 2
+local LATEST_PROTOCOL = PROTOCOL_BINARY
+local protocol = PROTOCOL_TEXT
+
+-- Frame formats, must match mesen_python/mesen.py
+local FRAME_FORMAT_PNG = 0
+local FRAME_FORMAT_RAW = 1
+local frameFormat = FRAME_FORMAT_PNG
+
+-- In incremental mode, frames Python received in the previous window are only
+-- referenced by their frame number
+local incrementalFrames = false
+local lastSentFrameNumbers = {}
+
+-- Frames can be written in a memory-mapped file shared with Python instead of the socket.
+-- Requires "Allow access to I/O and OS functions" in Mesen's script settings.
+local sharedFrames = nil
+local sharedFramesSize = 0
+local sharedFramesOffset = 0
+
+-- NES screen size, used for raw frames
+local SCREEN_WIDTH = 256
+local SCREEN_HEIGHT = 240
+local RAW_ROW_FORMAT = ">" .. string.rep("I3", SCREEN_WIDTH)
+
+-- Binary protocol message types
+local MESSAGE_WINDOW = 1
+local MESSAGE_EVENT = 2
+
+-- Plans of several windows, must match mesen_python/mesen.py. The windows of a plan are played
+-- without waiting for Python, which is only sent an event with their progress.
+local PLAN_PREFIX = "plan:"
+local PLANNED_WINDOW_PREFIX = "PLANNED "
 
 function sendLine(line)
 	client:send(line .. "\n")
 end
 
+function writeSharedFrame(frame)
+	-- Frames are written one after the other, starting over at the beginning of the file
+	-- when the end is reached
+	if sharedFramesOffset + #frame > sharedFramesSize then
+		sharedFramesOffset = 0
+	end
+	local offset = sharedFramesOffset
+	sharedFrames:seek("set", offset)
+	sharedFrames:write(frame)
+	sharedFramesOffset = offset + #frame
+	return offset
+end
+
+function sendBinaryMessage(messageType, progress, frames, frameNumbers)
+	-- Header: message type, progress length, frame count, progress, then for each frame its
+	-- frame number in incremental mode, its offset when using shared frames and its length
+	local header = {string.pack(">BHH", messageType, #progress, #frames), progress}
+	local payloads = {}
+	local sentFrameNumbers = {}
+	for i = 1, #frames do
+		local frame = frames[i]
+		if incrementalFrames then
+			local frameNumber = frameNumbers[i]
+			sentFrameNumbers[frameNumber] = true
+			if lastSentFrameNumbers[frameNumber] then
+				-- Python already has this frame
+				frame = ""
+			end
+			header[#header + 1] = string.pack(">I4", frameNumber)
+		end
+		local payload = frame
+		if sharedFrames then
+			local offset = 0
+			if #frame > 0 then
+				offset = writeSharedFrame(frame)
+			end
+			header[#header + 1] = string.pack(">I4", offset)
+			-- The frame doesn't go through the socket
+			payload = ""
+		end
+		header[#header + 1] = string.pack(">I4", #frame)
+		payloads[#payloads + 1] = payload
+	end
+	if #frames > 0 then
+		lastSentFrameNumbers = sentFrameNumbers
+	end
+	if sharedFrames then
+		sharedFrames:flush()
+	end
+	client:send(table.concat(header))
+	for i = 1, #payloads do
+		if #payloads[i] > 0 then
+			client:send(payloads[i])
+		end
+	end
+end
+
+function sendEvent(progress)
+	if protocol == PROTOCOL_TEXT then
+		sendLine(progress)
+	else
+		sendBinaryMessage(MESSAGE_EVENT, progress, {})
+	end
+end
+
+function sendWindow(progress, frames, frameNumbers)
+	if protocol == PROTOCOL_TEXT then
+		sendLine(progress)
+		for i = 1, #frames do
+			local png = frames[i]
+			local size = #png 
+			sendLine(size)
+			client:send(png)
+		end
+	else
+		sendBinaryMessage(MESSAGE_WINDOW, progress, frames, frameNumbers)
+	end
+end
+
 local frameWindowLength = 10
 local screenshotHistoryLength = 3
 local screenshotFrequence = 3
@@ -18,14 +163,54 @@ local screenshotFrequence = 3
 local dropInputOnLastFrame = true
 
 local screenshots = {}
+local screenshotFrameNumbers = {}
 local gameOver = false
 
+-- Inputs of the windows of the current plan left to play, and the progress of the last played one
+local plannedWindows = {}
+local plannedProgress = nil
+
+function applyInputs(message)
+	local t = {}
+	for token in string.gmatch(message, "[^,]+") do
+		t[token] = true
+	end
+	local inputFunc = function () emu.setInput(t, 0) end
+	if inputForNextFrame then
+		emu.removeEventCallback(inputForNextFrame, emu.eventType.inputPolled)
+	end
+	inputForNextFrame = emu.addEventCallback(inputFunc, emu.eventType.inputPolled)
+end
+
+function receivePlan(message, progress)
+	-- The inputs of each window are separated by semicolons, the first window is played now
+	plannedWindows = {}
+	local start = #PLAN_PREFIX + 1
+	while true do
+		local separator = string.find(message, ";", start, true)
+		if separator == nil then
+			table.insert(plannedWindows, string.sub(message, start))
+			break
+		end
+		table.insert(plannedWindows, string.sub(message, start, separator - 1))
+		start = separator + 1
+	end
+	plannedProgress = progress
+	applyInputs(table.remove(plannedWindows, 1))
+end
+
+function interruptPlan(reason)
+	emu.log("Plan interrupted (" .. reason .. "), " .. #plannedWindows .. " windows left")
+	plannedWindows = {}
+	plannedProgress = nil
+end
+
 function receiveFromPython()
 	local currentFrame = emu.getState()["ppu.frameCount"]
 	local frameDiff = math.fmod(currentFrame, frameWindowLength)
 
 	if isScreenshotFrame(frameDiff) then
-		saveScreenshot(emu.takeScreenshot())
+		saveScreenshot(takeFrame(), currentFrame)
 	end
 
 	local progress = game.getCurrentProgress()
@@ -50,9 +235,10 @@ function receiveFromPython()
 		if inputForNextFrame then
 			emu.removeEventCallback(inputForNextFrame, emu.eventType.inputPolled)
 		end
+		plannedWindows = {}
 		if not gameOver then
 			gameOver = true
-			sendLine(progress)
+			sendEvent(progress)
 			emu.log(progress)
 		end
 		return
@@ -65,6 +251,13 @@ function receiveFromPython()
 		emu.removeEventCallback(inputForNextFrame, emu.eventType.inputPolled)
 	end
 
+	-- The rest of a plan is given up when the situation it was made for changes
+	if #plannedWindows > 0 and progress == "DEAD" then
+		interruptPlan("dead")
+	elseif #plannedWindows > 0 and not game.playerHasControl() then
+		interruptPlan("control lost")
+	end
+
 	if dropInputOnLastFrame and frameDiff == frameWindowLength - 1 and inputForNextFrame then 
 		-- emu.log("Last frame before Python. Removing inputs. Current frame: " .. tostring(currentFrame))
 		emu.removeEventCallback(inputForNextFrame, emu.eventType.inputPolled)
@@ -73,17 +266,19 @@ function receiveFromPython()
 	if frameDiff ~= 0 or not game.playerHasControl() or #screenshots < screenshotHistoryLength then
 		return
 	end
+
+	if #plannedWindows > 0 and game.progressRegressed ~= nil and game.progressRegressed(plannedProgress, progress) then
+		interruptPlan("progress regressed")
+	elseif #plannedWindows > 0 then
+		plannedProgress = progress
+		sendEvent(PLANNED_WINDOW_PREFIX .. progress)
+		applyInputs(table.remove(plannedWindows, 1))
+		return
+	end
 	
 	emu.log(string.rep("-", 15) .."\nSending to Python")
 
-	sendLine(progress)
-
-	for i = 1, screenshotHistoryLength do
-		local png = screenshots[i]
-		local size = #png 
-		sendLine(size)
-		client:send(png)
-	end
+	sendWindow(progress, screenshots, screenshotFrameNumbers)
 
 	message, err = client:receive("*l")  
 	if message then
@@ -91,15 +286,11 @@ function receiveFromPython()
     	if message == "pause" then
     		emu.breakExecution()
     	end
-    	local t = {}
-		for token in string.gmatch(message, "[^,]+") do
-		    t[token] = true
+		if string.sub(message, 1, #PLAN_PREFIX) == PLAN_PREFIX then
+			receivePlan(message, progress)
+		else
+			applyInputs(message)
 		end
-		local inputFunc = function () emu.setInput(t, 0) end
-		if inputForNextFrame then
-			emu.removeEventCallback(inputForNextFrame, emu.eventType.inputPolled)
-		end
-		inputForNextFrame = emu.addEventCallback(inputFunc, emu.eventType.inputPolled)
     elseif err == "timeout" then
         emu.log("Message took too long ( > " .. timeout .. "s ). Advancing to the next frame...")
     elseif err == "closed" then
@@ -112,8 +303,12 @@ function receiveFromPython()
 
 end
 
+-- Returns nil and the error when Python doesn't send them within the timeout
 function setHyperparameters()
 	local message, err = client:receive("*l")
+	if message == nil then
+		return nil, err
+	end
 	timeout = tonumber(message)
 	client:settimeout(timeout)
 
@@ -125,6 +320,57 @@ function setHyperparameters()
 
 	message, err = client:receive("*l")
 	screenshotFrequence = tonumber(message)
+
+	-- Python sends the latest protocol it supports, we answer with the one we'll use
+	message, err = client:receive("*l")
+	protocol = math.min(tonumber(message) or PROTOCOL_TEXT, LATEST_PROTOCOL)
+
+	-- Raw frames can't be sent with the text protocol
+	message, err = client:receive("*l")
+	frameFormat = tonumber(message) or FRAME_FORMAT_PNG
+	if protocol == PROTOCOL_TEXT then
+		frameFormat = FRAME_FORMAT_PNG
+	end
+
+	-- Incremental frames need the binary protocol too
+	message, err = client:receive("*l")
+	incrementalFrames = tonumber(message) == 1 and protocol ~= PROTOCOL_TEXT
+
+	-- Path of the shared frames file, empty if Python doesn't use one, and its size
+	local sharedFramesPath, err = client:receive("*l")
+	message, err = client:receive("*l")
+	sharedFramesSize = tonumber(message) or 0
+	if sharedFramesPath ~= nil and sharedFramesPath ~= "" and protocol ~= PROTOCOL_TEXT and io ~= nil then
+		sharedFrames = io.open(sharedFramesPath, "r+b")
+	end
+
+	sendLine(protocol)
+	sendLine(frameFormat)
+	sendLine(incrementalFrames and 1 or 0)
+	sendLine(sharedFrames and 1 or 0)
+	return true
+end
+
+function takeRawScreenshot()
+	-- The screen buffer is a 0-indexed table of ARGB pixels, sent as RGB bytes
+	local buffer = emu.getScreenBuffer()
+	local rows = {}
+	local row = {}
+	for y = 0, SCREEN_HEIGHT - 1 do
+		local offset = y * SCREEN_WIDTH
+		for x = 1, SCREEN_WIDTH do
+			row[x] = buffer[offset + x - 1] & 0xFFFFFF
+		end
+		rows[y + 1] = string.pack(RAW_ROW_FORMAT, table.unpack(row))
+	end
+	return table.concat(rows)
+end
+
+function takeFrame()
+	if frameFormat == FRAME_FORMAT_RAW then
+		return takeRawScreenshot()
+	end
+	return emu.takeScreenshot()
 end
 
 function isScreenshotFrame(frameDiff)
@@ -144,14 +390,17 @@ function isScreenshotFrame(frameDiff)
 	return false
 end 
 
-function saveScreenshot(newSS)
+function saveScreenshot(newSS, frameNumber)
     if #screenshots < screenshotHistoryLength then
         table.insert(screenshots, newSS)
+        table.insert(screenshotFrameNumbers, frameNumber)
     else
         for i = 1, screenshotHistoryLength - 1 do
             screenshots[i] = screenshots[i + 1]
+            screenshotFrameNumbers[i] = screenshotFrameNumbers[i + 1]
         end
         screenshots[screenshotHistoryLength] = newSS
+        screenshotFrameNumbers[screenshotHistoryLength] = frameNumber
     end
 end
 
@@ -164,11 +413,23 @@ end
 
 if connected then
 	initialReset = emu.addEventCallback(resetEmu, emu.eventType.startFrame)
-	setHyperparameters()
-	listenForPython = emu.addEventCallback(receiveFromPython, emu.eventType.startFrame)
-	emu.log("Successfully connected to Python")
+	-- Mesen is frozen while waiting, so the hyperparameters get the same timeout as the other messages
+	emu.log("Waiting for Python to start the session...")
+	local started, err = setHyperparameters()
+	if started then
+		listenForPython = emu.addEventCallback(receiveFromPython, emu.eventType.startFrame)
+		emu.log("Successfully connected to Python")
+	else
+		emu.removeEventCallback(initialReset, emu.eventType.startFrame)
+		client:close()
+		emu.log("Python didn't start the session within " .. timeout .. "s (" .. err .. "). Stopping script.")
+		emu.log("A MesenServer running its maximum number of sessions only starts a new one once another ends: "
+			.. "restart the script then, or raise max_sessions.")
+	end
 else
-	emu.log("Couldn't connect to Python: " .. err .. ". Stopping Script.")
+	emu.log("Couldn't connect to Python with the " .. TRANSPORT .. " transport: " .. err .. ". Stopping Script.")
+	emu.log("Python must listen with the same transport, given to main.lua by the LLM4MESEN_TRANSPORT environment variable "
+		.. "(tcp by default, read when \"Allow access to I/O and OS functions\" is enabled).")
 end
 
 --- Testing and Utility ---
@@ -1,6 +1,27 @@
-from .games import SMB, TLOZ
+from .games import SMB, TLOZ, RecentWindows, ImageEncoder, IMAGE_FORMAT_PNG, IMAGE_FORMAT_NES_PNG, IMAGE_FORMAT_WEBP
+from .server import MesenServer
+from .mock_mesen import MockMesen
+from .prompt_image import PromptImage
+from .input_parser import InputParser, PlanParser
+from .transports import TCPTransport, UnixTransport, SharedMemoryTransport
+from .step_timings import StepTimings, LatencyHistogram
 
 __all__ = [
     "SMB",
-    "TLOZ"
-]
\ No newline at end of file
+    "TLOZ",
+    "RecentWindows",
+    "ImageEncoder",
+    "IMAGE_FORMAT_PNG",
+    "IMAGE_FORMAT_NES_PNG",
+    "IMAGE_FORMAT_WEBP",
+    "MesenServer",
+    "MockMesen",
+    "PromptImage",
+    "InputParser",
+    "PlanParser",
+    "TCPTransport",
+    "UnixTransport",
+    "SharedMemoryTransport",
+    "StepTimings",
+    "LatencyHistogram"
+]
@@ -1,45 +1,253 @@
 import io
+import os
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from collections import deque
+from typing import List, NamedTuple, Optional, Tuple
 
+import numpy as np
 from PIL import Image
 
-from .mesen import Mesen
+from .mesen import (
+    Mesen, FramePool, FrameEntry, PROTOCOL_TEXT, LATEST_PROTOCOL, FRAME_FORMAT_PNG, FRAME_FORMAT_RAW,
+    PLAN_PREFIX, PLANNED_WINDOW_PREFIX
+)
+from .prompt_image import PromptImage
+from .step_timings import StepTimings
 
 SCREENSHOT_PATH = "recent_frames.png"
 GAMES_DATA_PATH = "data"  
 
-
-def merge_pngs_horizontally(png_byte_list, separator_width=1):
+# Encodings of the image given to the LLM
+IMAGE_FORMAT_PNG = "png"  # RGB PNG
+IMAGE_FORMAT_NES_PNG = "nespng"  # Palette-indexed PNG using the NES master palette
+IMAGE_FORMAT_WEBP = "webp"  # Lossless WebP
+DEFAULT_PNG_COMPRESS_LEVEL = 6  # zlib level, from 0 (fastest) to 9 (smallest)
+
+FRAME_HASH_SIZE = 16  # Frames are hashed on a FRAME_HASH_SIZE x FRAME_HASH_SIZE grid
+
+# Mesen's default NES master palette (64 colors, 0xRRGGBB)
+NES_PALETTE = (
+    0x666666, 0x002A88, 0x1412A7, 0x3B00A4, 0x5C007E, 0x6E0040, 0x6C0600, 0x561D00,
+    0x333500, 0x0B4800, 0x005200, 0x004F08, 0x00404D, 0x000000, 0x000000, 0x000000,
+    0xADADAD, 0x155FD9, 0x4240FF, 0x7527FE, 0xA01ACC, 0xB71E7B, 0xB53120, 0x994E00,
+    0x6B6D00, 0x388700, 0x0C9300, 0x008F32, 0x007C8D, 0x000000, 0x000000, 0x000000,
+    0xFFFEFF, 0x64B0FF, 0x9290FF, 0xC676FF, 0xF36AFF, 0xFE6ECC, 0xFE8170, 0xEA9E22,
+    0xBCBE00, 0x88D800, 0x5CE430, 0x45E082, 0x48CDDE, 0x4F4F4F, 0x000000, 0x000000,
+    0xFFFEFF, 0xC0DFFF, 0xD3D2FF, 0xE8C8FF, 0xFBC2FF, 0xFEC4EA, 0xFECCC5, 0xF7D8A5,
+    0xE4E594, 0xCFEF96, 0xBDF4AB, 0xB3F3CC, 0xB5EBF2, 0xB8B8B8, 0x000000, 0x000000,
+)
+
+
+def decode_png(png) -> np.ndarray:
+    """Decodes a PNG in byte form (bytes, bytearray or memoryview) into an (H, W, 3) uint8 array"""
+    image = Image.open(io.BytesIO(png))
+    if image.mode == "RGBA":
+        # Dropping the alpha channel is cheaper than a conversion
+        return np.asarray(image)[:, :, :3]
+    return np.asarray(image.convert("RGB"))
+
+
+def merge_frames_horizontally(frames: np.ndarray, separator_width: int=1, out: np.ndarray=None,
+                              tile: np.ndarray=None) -> np.ndarray:
     """
-    png_byte_list: list of PNGs in byte form
+    frames: (N, H, W, 3) array of frames, the leftmost being the first one
     separator_width: width of the vertical black line (default = 1 pixel)
+    out: array reused for the result if it has the right shape. Its separators must be black.
+    tile: (h, w, 3) image added to the right of the frames, aligned to the top
+    """
+    n_frames, height, width, channels = frames.shape
+    total_width = n_frames * width + separator_width * (n_frames - 1)
+    total_height = height
+    if tile is not None:
+        total_width += separator_width + tile.shape[1]
+        total_height = max(height, tile.shape[0])
+    if out is None or out.shape != (total_height, total_width, channels):
+        out = np.zeros((total_height, total_width, channels), dtype=np.uint8)
+
+    for i in range(n_frames):
+        x = i * (width + separator_width)
+        out[:height, x:x + width] = frames[i]
+    if tile is not None:
+        out[:tile.shape[0], total_width - tile.shape[1]:] = tile
+    return out
+
+
+class Region(NamedTuple):
+    """Rectangle of a frame, in pixels"""
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+    def crop(self, frames: np.ndarray, downscale: int=1) -> np.ndarray:
+        """View on the region of (..., H, W, 3) frames, keeping one pixel out of downscale in each direction"""
+        # Skipping pixels instead of averaging them keeps the palette colors and doesn't copy
+        return frames[..., self.y:self.y + self.height:downscale, self.x:self.x + self.width:downscale, :]
+
+
+def pack_rgb(pixels: np.ndarray) -> np.ndarray:
+    """(H, W, 3) uint8 array -> (H, W) array of 0xRRGGBB colors"""
+    pixels = pixels.astype(np.uint32)
+    return (pixels[:, :, 0] << 16) | (pixels[:, :, 1] << 8) | pixels[:, :, 2]
+
+
+class ImageEncoder:
+    """Encodes the merged frames into the image given to the LLM"""
+    def __init__(self, image_format: str=IMAGE_FORMAT_PNG, compress_level: int=DEFAULT_PNG_COMPRESS_LEVEL,
+                 palette: Tuple[int, ...]=NES_PALETTE):
+        """
+        image_format: IMAGE_FORMAT_PNG, IMAGE_FORMAT_NES_PNG or IMAGE_FORMAT_WEBP
+        compress_level: PNG compression level, ignored for WebP
+        palette: colors of the palette-indexed PNG, which must match the emulator's palette
+        """
+        if image_format not in (IMAGE_FORMAT_PNG, IMAGE_FORMAT_NES_PNG, IMAGE_FORMAT_WEBP):
+            raise ValueError(f"Unknown image format: {image_format}")
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.palette = palette
+        # Sorted colors of the palette and their index, to look the pixels up with a binary search
+        colors, indices = np.unique(np.array(palette, dtype=np.uint32), return_index=True)
+        self.palette_colors = colors
+        self.palette_indices = indices.astype(np.uint8)
+        self.palette_bytes = b"".join(color.to_bytes(3, "big") for color in palette)
+
+
+    def get_name(self) -> str:
+        """Short name used in the playthrough file names"""
+        if self.image_format == IMAGE_FORMAT_WEBP:
+            return self.image_format
+        return f"{self.image_format}{self.compress_level}"
+
+
+    def to_palette_image(self, pixels: np.ndarray) -> Image.Image:
+        """Palette-indexed image of the pixels, or None if they use colors outside the palette"""
+        colors = pack_rgb(pixels)
+        positions = np.searchsorted(self.palette_colors, colors)
+        np.minimum(positions, len(self.palette_colors) - 1, out=positions)
+        if not np.array_equal(self.palette_colors[positions], colors):
+            return None
+        image = Image.fromarray(self.palette_indices[positions])
+        image.putpalette(self.palette_bytes)
+        return image
+
+
+    def get_mime_type(self) -> str:
+        return "image/webp" if self.image_format == IMAGE_FORMAT_WEBP else "image/png"
+
+
+    def encode_bytes(self, pixels: np.ndarray) -> bytes:
+        """Encodes an (H, W, 3) uint8 array without losing any pixel"""
+        output = io.BytesIO()
+        if self.image_format == IMAGE_FORMAT_WEBP:
+            Image.fromarray(pixels).save(output, format="WEBP", lossless=True)
+            return output.getvalue()
+
+        image = None
+        if self.image_format == IMAGE_FORMAT_NES_PNG:
+            # Falls back to RGB if the emulator uses another palette
+            image = self.to_palette_image(pixels)
+        if image is None:
+            image = Image.fromarray(pixels)
+        image.save(output, format="PNG", compress_level=self.compress_level)
+        return output.getvalue()
+
+
+    def encode(self, pixels: np.ndarray) -> PromptImage:
+        return PromptImage(self.encode_bytes(pixels), self.get_mime_type(), pixels)
+
+
+def hash_frames(frames: np.ndarray, hash_size: int=FRAME_HASH_SIZE) -> np.ndarray:
     """
+    Perceptual (average) hash of (N, H, W, 3) frames. Each frame is reduced to a hash_size x hash_size
+    grayscale grid and each cell gives a bit, set if the cell is brighter than the frame.
+    Returns the N * hash_size * hash_size bits packed in a uint8 array.
+    Frames smaller than the grid are hashed on a grid of their smaller side, with one pixel per cell.
+    """
+    n_frames, height, width, _ = frames.shape
+    hash_size = min(hash_size, height, width)
+    # The last rows and columns are dropped so the frames split into equal cells
+    cell_height, cell_width = height // hash_size, width // hash_size
+    frames = frames[:, :cell_height * hash_size, :cell_width * hash_size]
+    # The brightness of a cell is the sum of its channels. The rows of each cell are summed first, then the
+    # columns and channels of each row together, since reducing the 3 channels of every pixel on their own is much slower.
+    rows = frames.reshape(n_frames, hash_size, cell_height, -1).sum(axis=2, dtype=np.uint32)
+    cells = rows.reshape(n_frames, hash_size, hash_size, cell_width * 3).sum(axis=3)
+    return np.packbits(cells > cells.mean(axis=(1, 2), keepdims=True))
+
+
+def get_hash_distance(hash_1: np.ndarray, hash_2: np.ndarray) -> int:
+    """Number of different bits between two frame hashes"""
+    if hash_1.shape != hash_2.shape:
+        return 8 * max(hash_1.size, hash_2.size)
+    return int(np.unpackbits(hash_1 ^ hash_2).sum())
+
+
+class RecentWindow(NamedTuple):
+    progress: str
+    frame_hash: np.ndarray
+    inputs: str  # Inputs chosen by the LLM for this window
+
+
+class RecentWindows:
+    """Last windows the LLM was called for, to find the ones a new window is almost identical to"""
+    def __init__(self, capacity: int=8):
+        self.windows = deque(maxlen=capacity)
+
+
+    def add(self, progress: str, frame_hash: np.ndarray, inputs: str):
+        self.windows.append(RecentWindow(progress, frame_hash, inputs))
+
+
+    def find(self, progress: str, frame_hash: np.ndarray, max_distance: int) -> Optional[RecentWindow]:
+        """Most similar window with the same progress, if its hash is at most max_distance bits away"""
+        best_window = None
+        best_distance = max_distance + 1
+        for window in self.windows:
+            if window.progress != progress:
+                continue
+            distance = get_hash_distance(window.frame_hash, frame_hash)
+            if distance < best_distance:
+                best_window, best_distance = window, distance
+        return best_window
+
 
-    # Decode PNG bytes into Pillow images
-    images = [Image.open(io.BytesIO(png)) for png in png_byte_list]
+    def clear(self):
+        self.windows.clear()
 
-    # Compute new canvas size
-    total_width = sum(img.width for img in images) + separator_width * (len(images) - 1)
-    max_height = max(img.height for img in images)
 
-    # Create background (RGBA black)
-    result = Image.new("RGBA", (total_width, max_height), (0, 0, 0, 255))
+class FrameHistory:
+    """Ring buffer of the last decoded frames, keyed by their frame number"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.frames = None
+        self.slots = {}  # Frame number -> index of its slot in self.frames
+        self.slot_frame_numbers = [None] * capacity
+        self.next_slot = 0
 
-    # Paste frames and separators
-    x = 0
-    for i, img in enumerate(images):
-        result.paste(img, (x, 0))
-        x += img.width
-        if i < len(images) - 1:  # add separator if not last
-            for y in range(max_height):
-                result.putpixel((x, y), (0, 0, 0, 255))
-            x += separator_width
 
-    # Convert back to PNG bytes
-    output = io.BytesIO()
-    result.save(output, format="PNG")
-    return output.getvalue()
+    def get(self, frame_number: int) -> np.ndarray:
+        if frame_number not in self.slots:
+            raise ValueError(f"Frame {frame_number} is not in the frame history.")
+        return self.frames[self.slots[frame_number]]
+
+
+    def allocate(self, frame_number: int, shape: Tuple[int, int, int]) -> np.ndarray:
+        """Returns the slot where the frame must be written, replacing the oldest frame"""
+        if self.frames is None or self.frames.shape[1:] != shape:
+            self.frames = np.zeros((self.capacity, *shape), dtype=np.uint8)
+            self.slots.clear()
+            self.slot_frame_numbers = [None] * self.capacity
+
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.capacity
+        oldest_frame_number = self.slot_frame_numbers[slot]
+        if oldest_frame_number is not None:
+            del self.slots[oldest_frame_number]
+        self.slots[frame_number] = slot
+        self.slot_frame_numbers[slot] = frame_number
+        return self.frames[slot]
 
 
 class Game(ABC):
@@ -51,14 +259,68 @@ class Game(ABC):
                  mesen_timeout: int=180,
                  saved_screenshot_file_path: str=SCREENSHOT_PATH,
                  saved_playthrough_path: str=GAMES_DATA_PATH,
+                 protocol: int=LATEST_PROTOCOL,
+                 mesen: Mesen=None,
+                 session_id: str=None,
+                 frame_format: int=FRAME_FORMAT_PNG,
+                 incremental_frames: bool=True,
+                 transport=None,
+                 save_screenshots: bool=False,
+                 image_encoder: ImageEncoder=None,
+                 crop_screenshots: bool=False,
+                 downscale: int=1,
+                 timings: StepTimings=None,
+                 structured_inputs: bool=False,
+                 max_plan_windows: int=1,
                  ):
-        self.mesen = Mesen()
+        """
+        transport: TCPTransport (default), UnixTransport or SharedMemoryTransport. Ignored if mesen is given.
+        save_screenshots: also writes the image given to the LLM to the screenshot file, for debugging
+        image_encoder: encoding of the image given to the LLM, RGB PNG by default
+        crop_screenshots: only shows the game's crop region of each frame and its tile region
+                          of the most recent one (see get_crop_region and get_tile_region)
+        downscale: integer factor the width and height of the frames are divided by
+        timings: timings of the stages of each step, a new StepTimings by default
+        structured_inputs: the API backends answer with a JSON object following get_input_schema()
+                           (get_plan_schema() with plans)
+        max_plan_windows: the LLM can answer with a plan of up to this many windows (see PlanParser),
+                          which main.lua plays without waiting for Python. 1 disables the plans.
+        """
+        self.mesen = mesen if mesen is not None else Mesen(transport=transport)
+        # Distinguishes the files of games played at the same time by one MesenServer
+        self.session_id = session_id
+        if session_id is not None:
+            name, extension = saved_screenshot_file_path.rsplit(".", 1)
+            saved_screenshot_file_path = f"{name}_{session_id}.{extension}"
+        # Requested protocol, replaced by the one main.lua accepts in send_hyperparameters
+        self.protocol = protocol
+        # Requested frame format, replaced by the one main.lua accepts in send_hyperparameters
+        self.frame_format = frame_format
+        # Requested incremental mode, where main.lua only sends the frames Python doesn't have.
+        # Replaced by the mode main.lua accepts in send_hyperparameters.
+        self.incremental_frames = incremental_frames
+        self.frame_history = None
+        self.frame_pool = FramePool()
+        # (N, H, W, 3) frames of the last window and their merged image, reused between windows
+        self.frames = None
+        self.merged_frames = None
+        # Perceptual hash of the frames shown to the LLM in the last window
+        self.frame_hash = None
+        # Frames announced by the last binary protocol header
+        self.pending_frames = []
         self.playthrough_path = saved_playthrough_path
         self.screenshot_path = f"{saved_playthrough_path}/{self.get_acronym()}/{saved_screenshot_file_path}"
+        self.save_screenshots = save_screenshots
+        self.image_encoder = image_encoder if image_encoder is not None else ImageEncoder()
+        self.crop_screenshots = crop_screenshots
+        self.downscale = downscale
         self.input_length = input_length
         self.n_screenshots = n_screenshots
         self.freq_screenshots = freq_screenshots
         self.mesen_timeout = mesen_timeout
+        self.timings = timings if timings is not None else StepTimings()
+        self.structured_inputs = structured_inputs
+        self.max_plan_windows = max_plan_windows
 
 
     def get_playthrough_filename(self, model_name: str) -> str:
@@ -68,6 +330,20 @@ class Game(ABC):
             "freq" : self.freq_screenshots,
             "model" : model_name
         }
+        if self.session_id is not None:
+            params["session"] = self.session_id
+        image_encoding = self.image_encoder.get_name()
+        if image_encoding != ImageEncoder().get_name():
+            # Playthroughs with the default encoding keep their previous file names
+            params["enc"] = image_encoding
+        if self.crop_screenshots:
+            params["crop"] = 1
+        if self.downscale != 1:
+            params["ds"] = self.downscale
+        if self.structured_inputs:
+            params["json"] = 1
+        if self.max_plan_windows > 1:
+            params["plan"] = self.max_plan_windows
         return "__".join(f"{k}={params[k]}" for k in sorted(params)) + ".csv"  
     
 
@@ -83,20 +359,172 @@ class Game(ABC):
         return f"{self.playthrough_path}/{self.get_acronym()}/playthroughs/"
 
 
-    def get_recent_frames(self) -> str:
-        screenshots = []
-        for _ in range(self.n_screenshots):
-            image_length = self.mesen.receive_int()
-            image_data = self.mesen.receive_bytes(image_length)
-            screenshots.append(image_data)
-        with open(self.screenshot_path, "wb") as f:
-            f.write(merge_pngs_horizontally(screenshots))
+    def save_timings(self, model: str) -> str:
+        """
+        Writes the step timings to JSON and CSV files named like the playthrough file, in a timings
+        folder next to the playthroughs one (which only contains playthroughs), and resets them
+        """
+        folder = f"{self.playthrough_path}/{self.get_acronym()}/timings"
+        os.makedirs(folder, exist_ok=True)
+        name = self.get_playthrough_filename(model)[:-len(".csv")]
+        path = f"{folder}/{name}__time={time.strftime('%Y%m%d-%H%M%S')}"
+        self.timings.end_step()
+        self.timings.save(path)
+        self.timings.reset()
+        return path
+
+
+    def get_input_schema(self) -> dict:
+        """JSON schema of the structured answers: an object whose inputs array only contains valid inputs"""
+        return {
+            "type": "object",
+            "properties": {
+                "inputs": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": list(self.get_valid_inputs())},
+                },
+            },
+            "required": ["inputs"],
+            "additionalProperties": False,
+        }
+
+
+    def get_plan_schema(self, max_windows: int) -> dict:
+        """JSON schema of the structured plans: the inputs of each step and the number of windows they are applied for"""
+        step_schema = self.get_input_schema()
+        step_schema["properties"]["windows"] = {"type": "integer", "minimum": 1, "maximum": max_windows}
+        step_schema["required"].append("windows")
+        return {
+            "type": "object",
+            "properties": {
+                "plan": {"type": "array", "items": step_schema},
+            },
+            "required": ["plan"],
+            "additionalProperties": False,
+        }
 
-        return self.screenshot_path
+
+    def get_recent_frames(self) -> PromptImage:
+        """Returns the frames of the window merged into one in-memory image for the LLM"""
+        with self.timings.stage("receive_frames"):
+            frames = self.receive_frames()
+        with self.timings.stage("image_merge"):
+            tile = None
+            if self.crop_screenshots:
+                tile_region = self.get_tile_region()
+                if tile_region is not None:
+                    tile = tile_region.crop(frames[-1], self.downscale)
+                frames = self.get_crop_region().crop(frames, self.downscale)
+            elif self.downscale != 1:
+                frames = frames[:, ::self.downscale, ::self.downscale]
+            self.frame_hash = hash_frames(frames)
+            self.merged_frames = merge_frames_horizontally(frames, out=self.merged_frames, tile=tile)
+        # The frames are only encoded once, into the image given to the LLM, and only if one is
+        # given (see PromptImage.encode). The pixels are copied since merged_frames is overwritten by the next window.
+        image = PromptImage(mime_type=self.image_encoder.get_mime_type(), pixels=self.merged_frames.copy(),
+                            encoder=self._encode_frames)
+        if self.save_screenshots:
+            with self.timings.stage("disk_write"):
+                name = self.screenshot_path.rsplit(".", 1)[0]
+                image.save(f"{name}.{image.get_file_extension()}")
+
+        return image
+
+
+    def _encode_frames(self, pixels: np.ndarray) -> bytes:
+        with self.timings.stage("image_encode"):
+            return self.image_encoder.encode_bytes(pixels)
+
+
+    def _get_frame_array(self, n_frames: int, height: int, width: int) -> np.ndarray:
+        shape = (n_frames, height, width, 3)
+        if self.frames is None or self.frames.shape != shape:
+            self.frames = np.zeros(shape, dtype=np.uint8)
+        return self.frames
+
+
+    def _set_frames(self, window_frames: List[np.ndarray]) -> np.ndarray:
+        height, width, _ = window_frames[0].shape
+        frames = self._get_frame_array(len(window_frames), height, width)
+        for i, frame in enumerate(window_frames):
+            frames[i] = frame
+        return frames
+
+
+    def receive_frames(self) -> np.ndarray:
+        """Receives the frames of the window into the reused (N, H, W, 3) uint8 frame array"""
+        if self.protocol == PROTOCOL_TEXT:
+            pngs = []
+            for _ in range(self.n_screenshots):
+                image_length = self.mesen.receive_int()
+                image_data = self.mesen.receive_bytes(image_length)
+                pngs.append(image_data)
+            return self._set_frames([self._decode_png(png) for png in pngs])
+
+        frame_entries = self.pending_frames
+        self.pending_frames = []
+        width, height = self.get_screen_size()
+
+        if self.frame_format == FRAME_FORMAT_RAW and not self.incremental_frames:
+            frames = self._get_frame_array(len(frame_entries), height, width)
+            for i, frame_entry in enumerate(frame_entries):
+                self._receive_raw_frame_into(frames[i], frame_entry)
+            return frames
+
+        window_frames = []
+        for i, frame_entry in enumerate(frame_entries):
+            if not self.incremental_frames:
+                window_frames.append(self._decode_png(self._receive_png(i, frame_entry)))
+            elif frame_entry.length == 0:
+                # Frame already received in a previous window
+                window_frames.append(self.frame_history.get(frame_entry.number))
+            elif self.frame_format == FRAME_FORMAT_RAW:
+                frame = self.frame_history.allocate(frame_entry.number, (height, width, 3))
+                self._receive_raw_frame_into(frame, frame_entry)
+                window_frames.append(frame)
+            else:
+                decoded_frame = self._decode_png(self._receive_png(i, frame_entry))
+                frame = self.frame_history.allocate(frame_entry.number, decoded_frame.shape)
+                frame[:] = decoded_frame
+                window_frames.append(frame)
+        return self._set_frames(window_frames)
+
+
+    def _decode_png(self, png) -> np.ndarray:
+        with self.timings.stage("png_decode"):
+            return decode_png(png)
+
+
+    def _receive_raw_frame_into(self, frame: np.ndarray, frame_entry: FrameEntry):
+        if frame_entry.offset is not None:
+            shared_frame = self.mesen.get_shared_frame(frame_entry)
+            frame[:] = np.frombuffer(shared_frame, dtype=np.uint8).reshape(frame.shape)
+        else:
+            # The pixels are received directly into the frame array
+            self.mesen.receive_into(memoryview(frame).cast("B"))
+
+
+    def _receive_png(self, index: int, frame_entry: FrameEntry) -> memoryview:
+        """Returns a PNG announced by the last header, read from the shared memory or received into its reusable frame buffer"""
+        if frame_entry.offset is not None:
+            return self.mesen.get_shared_frame(frame_entry)
+        png = self.frame_pool.get(index, frame_entry.length)
+        self.mesen.receive_into(png)
+        return png
 
 
     def get_progress(self) -> str:
-        return self.mesen.receive_line()
+        # Includes the time Mesen takes to play the window
+        with self.timings.stage("receive_progress"):
+            if self.protocol == PROTOCOL_TEXT:
+                return self.mesen.receive_line()
+
+            _, progress, self.pending_frames = self.mesen.receive_header(self.incremental_frames)
+            return progress
+
+
+    def get_frame_hash(self) -> np.ndarray:
+        return self.frame_hash
 
 
     def get_input_timeout(self) -> int:
@@ -136,6 +564,25 @@ class Game(ABC):
         self.mesen.send_number(self.input_length)
         self.mesen.send_number(self.n_screenshots)
         self.mesen.send_number(self.freq_screenshots)
+        self.mesen.send_number(self.protocol)
+        self.mesen.send_number(self.frame_format)
+        self.mesen.send_number(int(self.incremental_frames))
+        # Room for two windows of the largest frames (RGBA), so main.lua never overwrites
+        # a frame of the window Python is reading
+        width, height = self.get_screen_size()
+        shared_frames_size = 2 * self.n_screenshots * width * height * 4
+        self.mesen.send_string(self.mesen.open_shared_frames(shared_frames_size))
+        self.mesen.send_number(shared_frames_size)
+        # main.lua answers with the protocol, the frame format, the incremental mode
+        # and whether it writes the frames in the shared memory
+        self.protocol = self.mesen.receive_int()
+        self.frame_format = self.mesen.receive_int()
+        self.incremental_frames = self.mesen.receive_int() == 1
+        if self.mesen.receive_int() == 0:
+            self.mesen.close_shared_frames()
+        if self.incremental_frames:
+            # Room for the frames of the previous window and the new frames of the current one
+            self.frame_history = FrameHistory(2 * self.n_screenshots)
 
 
     def play(self):
@@ -148,7 +595,22 @@ class Game(ABC):
         if message == None:
             message = ""
 
-        self.mesen.send_string(message)
+        with self.timings.stage("send_inputs"):
+            self.mesen.send_string(message)
+
+
+    def apply_plan(self, windows: List[str]):
+        """Sends the inputs of several windows, which main.lua plays without waiting for Python"""
+        message = PLAN_PREFIX + ";".join("" if inputs is None else inputs for inputs in windows)
+        with self.timings.stage("send_inputs"):
+            self.mesen.send_string(message)
+
+
+    def get_planned_window_progress(self, progress: str) -> Optional[str]:
+        """Progress of a window played by main.lua from the plan, or None if progress isn't from a planned window"""
+        if progress.startswith(PLANNED_WINDOW_PREFIX):
+            return progress[len(PLANNED_WINDOW_PREFIX):]
+        return None
 
 
     def get_full_name(self) -> str:
@@ -161,6 +623,29 @@ class Game(ABC):
     
     def get_input_hold_time(self) -> float:
         return self.input_length / self.get_fps()
+
+
+    def get_crop_region(self) -> Region:
+        """Part of every frame shown to the LLM when cropping screenshots, the whole screen by default"""
+        width, height = self.get_screen_size()
+        return Region(0, 0, width, height)
+
+
+    def get_tile_region(self) -> Optional[Region]:
+        """Part of the most recent frame shown as a separate tile when cropping screenshots, if any"""
+        return None
+
+
+    def get_tile_description(self) -> str:
+        """Description of the tile region given to the LLM"""
+        return ""
+
+
+    def get_screenshots_description(self) -> str:
+        """Explains the tile added to the screenshots to the LLM, if there is one"""
+        if not self.crop_screenshots or self.get_tile_region() is None:
+            return ""
+        return f"The small image to the right of the most recent frame is {self.get_tile_description()}\n"
     
 
     @abstractmethod
@@ -198,6 +683,11 @@ class Game(ABC):
     def get_fps(self) -> int:
         pass
 
+    @abstractmethod
+    def get_screen_size(self) -> Tuple[int, int]:
+        """Width and height of the frames rendered by the console"""
+        pass
+
 
 
 class SMB(Game):
@@ -242,6 +732,15 @@ class SMB(Game):
         return 60
     
 
+    def get_screen_size(self):
+        return 256, 240
+
+
+    def get_crop_region(self):
+        # Strips the score, coins, world and time HUD
+        return Region(0, 32, 256, 208)
+    
+
 class TLOZ(Game):
 
     def get_acronym(self):
@@ -282,4 +781,21 @@ class TLOZ(Game):
     
 
     def get_fps(self):
-        return 60
\ No newline at end of file
+        return 60
+    
+
+    def get_screen_size(self):
+        return 256, 240
+
+
+    def get_crop_region(self):
+        # Strips the HUD, whose minimap is kept as a tile
+        return Region(0, 64, 256, 176)
+
+
+    def get_tile_region(self):
+        return Region(16, 24, 64, 32)
+
+
+    def get_tile_description(self):
+        return "the dungeon or overworld minimap, where a dot shows Link's position."
\ No newline at end of file
@@ -0,0 +1,215 @@
+import json
+from typing import Iterable, List, Optional, Tuple
+
+
+class InputParser:
+    """
+    Incremental parser of the inputs answered by the LLMs (valid inputs separated by commas),
+    fed with the chunks of a streamed answer so it can be used as soon as its action line is complete
+    """
+    answer_mode = "inputs"  # Distinguishes the answers cut at the action line in the LLM cache
+
+    def __init__(self, valid_inputs: Iterable[str], response_schema: dict=None):
+        """
+        response_schema: JSON schema the API backends constrain the answers to (see Game.get_input_schema).
+                         The inputs are then read from the "inputs" array of the JSON answer.
+        """
+        self.valid_inputs = set(valid_inputs)
+        self.response_schema = response_schema
+        self.reset()
+
+
+    def reset(self):
+        """Starts parsing a new answer"""
+        self.text = ""
+        self.line_start = 0
+
+
+    def parse_line(self, line: str) -> Optional[str]:
+        """Returns the inputs of a line, or None if it isn't an action line"""
+        if self.response_schema is not None and "[" in line:
+            return self.parse_json_inputs(line)
+        # Spaces after the commas are allowed, like in main.get_llm_input
+        inputs = line.replace(" ", "").strip()
+        if inputs == "":
+            return None
+        if not set(inputs.split(",")).issubset(self.valid_inputs):
+            return None
+        return inputs
+
+
+    def parse_json_inputs(self, text: str) -> Optional[str]:
+        """Returns the inputs of the array of a structured answer, or None if it isn't complete or valid"""
+        # The valid inputs never contain brackets, so the array is the text between the first ones
+        array_start = text.find("[")
+        array_end = text.find("]", array_start)
+        if array_start == -1 or array_end == -1:
+            return None
+        try:
+            inputs = json.loads(text[array_start:array_end + 1])
+        except ValueError:
+            return None
+        if not all(isinstance(input, str) for input in inputs) or not set(inputs).issubset(self.valid_inputs):
+            return None
+        # The APIs don't support uniqueItems, so the duplicates are removed here
+        return ",".join(dict.fromkeys(inputs))
+
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Adds a chunk of the answer and returns the first action line once it is complete"""
+        self.text += chunk
+        if self.response_schema is not None:
+            # A structured answer is complete for the game once its array is closed
+            return self.parse_json_inputs(self.text)
+        while True:
+            line_end = self.text.find("\n", self.line_start)
+            if line_end == -1:
+                return None
+            inputs = self.parse_line(self.text[self.line_start:line_end])
+            self.line_start = line_end + 1
+            if inputs is not None:
+                return inputs
+
+
+    def close(self) -> Optional[str]:
+        """Parses the last line once the whole answer was fed"""
+        if self.response_schema is not None:
+            return self.parse_json_inputs(self.text)
+        return self.parse_line(self.text[self.line_start:])
+
+
+class PlanParser(InputParser):
+    """
+    Incremental parser of action plans: lines of valid inputs followed by "*" and the number of windows
+    they are applied for ("right,b*4"), a line without number being one window and one without inputs
+    ("*2") windows without inputs. A plan is complete at the first line that isn't a step, and returned
+    as the text of its steps (see parse_plan).
+    """
+    def __init__(self, valid_inputs: Iterable[str], max_windows: int, response_schema: dict=None):
+        """
+        max_windows: the steps after this number of windows are dropped
+        response_schema: JSON schema of the structured plans (see Game.get_plan_schema)
+        """
+        self.max_windows = max_windows
+        super().__init__(valid_inputs, response_schema)
+
+
+    @property
+    def answer_mode(self) -> str:
+        # Plans are cut after max_windows windows
+        return f"plan*{self.max_windows}"
+
+
+    def reset(self):
+        super().reset()
+        self.steps = []
+
+
+    def parse_step(self, line: str) -> Optional[Tuple[str, int]]:
+        """Returns the inputs and number of windows of a line, or None if it isn't a step"""
+        inputs, _, n_windows = line.partition("*")
+        n_windows = n_windows.strip() or "1"
+        if not n_windows.isdigit() or int(n_windows) == 0:
+            return None
+        if inputs.strip() == "" and "*" in line:
+            return "", int(n_windows)
+        inputs = super().parse_line(inputs)
+        if inputs is None:
+            return None
+        return inputs, int(n_windows)
+
+
+    def parse_line(self, line: str) -> Optional[str]:
+        """Returns the text of a step, so HedgedLLM can tell whether an answer contains a plan"""
+        if self.response_schema is not None and "[" in line:
+            steps = self._parse_json_steps(line)
+            return None if steps is None else self._get_steps_text(steps)
+        step = self.parse_step(line)
+        return None if step is None else self._get_steps_text([step])
+
+
+    def _parse_json_steps(self, text: str) -> Optional[List[Tuple[str, int]]]:
+        if "{" not in text:
+            return None
+        try:
+            plan = json.loads(text[text.find("{"):])
+        except ValueError:
+            return None
+        steps = []
+        for step in plan.get("plan", []) if isinstance(plan, dict) else []:
+            if not isinstance(step, dict):
+                return None
+            inputs = self.parse_json_inputs(json.dumps(step.get("inputs", [])))
+            n_windows = step.get("windows", 1)
+            if inputs is None or not isinstance(n_windows, int) or n_windows < 1:
+                return None
+            steps.append((inputs, n_windows))
+        return steps or None
+
+
+    def _add_step(self, step: Tuple[str, int]):
+        n_windows = sum(n for _, n in self.steps)
+        if n_windows < self.max_windows:
+            self.steps.append((step[0], min(step[1], self.max_windows - n_windows)))
+
+
+    def _get_steps_text(self, steps: List[Tuple[str, int]]) -> str:
+        return "\n".join(f"{inputs}*{n_windows}" for inputs, n_windows in steps)
+
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Adds a chunk of the answer and returns the plan once it is complete"""
+        self.text += chunk
+        if self.response_schema is not None:
+            # A structured plan is complete once the whole JSON object can be read
+            if not self.text.rstrip().endswith("}"):
+                return None
+            steps = self._parse_json_steps(self.text)
+            if steps is None:
+                return None
+            self.steps = []
+            for step in steps:
+                self._add_step(step)
+            return self._get_steps_text(self.steps)
+        return self._feed_lines()
+
+
+    def _feed_lines(self) -> Optional[str]:
+        while True:
+            line_end = self.text.find("\n", self.line_start)
+            if line_end == -1:
+                return None
+            step = self.parse_step(self.text[self.line_start:line_end])
+            self.line_start = line_end + 1
+            if step is not None:
+                self._add_step(step)
+            elif self.steps:
+                return self._get_steps_text(self.steps)
+
+
+    def close(self) -> Optional[str]:
+        """Parses the last line once the whole answer was fed"""
+        if self.response_schema is None:
+            step = self.parse_step(self.text[self.line_start:])
+            self.line_start = len(self.text)
+            if step is not None:
+                self._add_step(step)
+        return self._get_steps_text(self.steps) if self.steps else None
+
+
+    def parse_plan(self, answer: str) -> Optional[List[str]]:
+        """Inputs of each window of the plan of a whole answer, or None if it doesn't contain one"""
+        self.reset()
+        if self.response_schema is not None and "{" in answer:
+            for step in self._parse_json_steps(answer) or []:
+                self._add_step(step)
+        else:
+            # Streamed plans were already turned into text
+            self.text = answer
+            if self._feed_lines() is None:
+                step = self.parse_step(self.text[self.line_start:])
+                if step is not None:
+                    self._add_step(step)
+        if not self.steps:
+            return None
+        return [inputs for inputs, n_windows in self.steps for _ in range(n_windows)]
\ No newline at end of file
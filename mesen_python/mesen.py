@@ -1,17 +1,66 @@
 import socket
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+from .transports import TCPTransport, TRANSPORT_ENV_VARIABLE
+
+RECV_BUFFER_SIZE = 65536  # Maximum number of bytes read from the socket per recv call
+
+# Protocol versions negotiated with main.lua
+PROTOCOL_TEXT = 1  # Progress line, then a size line and a PNG for each screenshot
+PROTOCOL_BINARY = 2  # One length-prefixed binary header per window, then the payloads
+LATEST_PROTOCOL = PROTOCOL_BINARY
+
+# Formats of the frames sent by main.lua
+FRAME_FORMAT_PNG = 0  # PNG from emu.takeScreenshot()
+FRAME_FORMAT_RAW = 1  # Uncompressed RGB pixels from emu.getScreenBuffer(), binary protocol only
+
+# Binary protocol message types
+MESSAGE_WINDOW = 1  # Progress and the screenshots of the window, Python must answer with inputs
+MESSAGE_EVENT = 2  # Progress only ("GAME OVER", "DEAD"), Python must not answer
+
+# Plans of several windows: Python answers with PLAN_PREFIX followed by the inputs of each window,
+# separated by semicolons. main.lua plays the next windows without waiting for Python and only sends
+# an event with PLANNED_WINDOW_PREFIX followed by their progress, unless the plan is interrupted.
+PLAN_PREFIX = "plan:"
+PLANNED_WINDOW_PREFIX = "PLANNED "
+
+# Message type, progress length and frame count, followed by the progress and an entry for
+# each frame: its frame number in incremental mode, its offset in the shared memory when it
+# is used, then its length
+HEADER_FORMAT = struct.Struct(">BHH")
+
+
+class FrameEntry(NamedTuple):
+    """A frame announced by a binary protocol header"""
+    length: int  # 0 in incremental mode if the frame was already sent
+    number: Optional[int] = None  # Frame number, incremental mode only
+    offset: Optional[int] = None  # Offset in the shared memory, if frames are sent through it
 
 
 class Mesen:
     """Allows Python to communicate with Mesen through sockets"""
-    def __init__(self, host: str="localhost", port: int=9999):
-        self.server = socket.socket()
-        self.server.bind((host, port))
+    def __init__(self, host: str="localhost", port: int=9999, client: socket.socket=None, transport=None):
+        self.transport = transport if transport is not None else TCPTransport(host, port)
+        # A client already accepted elsewhere (see MesenServer) doesn't need a server socket
+        self.server = None
+        if client is None:
+            self.server = self.transport.create_server()
+        self.client = client
+        # Memory-mapped file main.lua writes the frames into, when the transport uses one
+        self.shared_frames = None
+        # Bytes received from Mesen that haven't been consumed yet
+        self.buffer = bytearray()
 
 
     def connect(self):
+        if self.server is None:
+            return
         self.server.listen(1)
-        print("Waiting for Mesen connection...")
+        # main.lua can't reach Python with another transport, which would only show in Mesen's log
+        print(f"Waiting for Mesen connection ({TRANSPORT_ENV_VARIABLE}={self.transport.lua_transport} for main.lua)...")
         self.client, addr = self.server.accept()
+        self.buffer.clear()
         print("Mesen connected: ", addr)
 
 
@@ -27,26 +76,107 @@ class Mesen:
         self.send_string(str(number))
 
 
+    def _fill_buffer(self) -> bool:
+        """Reads as many bytes as available (up to RECV_BUFFER_SIZE) into the buffer"""
+        chunk = self.client.recv(RECV_BUFFER_SIZE)
+        if not chunk:
+            return False
+        self.buffer += chunk
+        return True
+
+
     def receive_line(self) -> str:
-        message = b""
-        while not message.endswith(b"\n"):
-            chunk = self.client.recv(1)
-            if not chunk:
+        start = 0
+        end = self.buffer.find(b"\n")
+        while end == -1:
+            start = len(self.buffer)
+            if not self._fill_buffer():
+                end = len(self.buffer) - 1
                 break
-            message += chunk
+            end = self.buffer.find(b"\n", start)
+        message = bytes(self.buffer[:end + 1])
+        del self.buffer[:end + 1]
         return message.decode().strip()
-    
-    
+
+
     def receive_int(self) -> int:
         return int(self.receive_line())
-    
-    
-    def receive_bytes(self, num_bytes: int) -> str:
-        message = b""
-        while len(message) < num_bytes:
-            chunk = self.client.recv(num_bytes - len(message))
-            if not chunk:
+
+
+    def receive_into(self, view: memoryview) -> int:
+        """Fills view with the next bytes sent by Mesen and returns the number of bytes written"""
+        # Bytes already in the buffer are used first, the rest is read directly
+        # from the socket into the view without going through the buffer
+        received = min(len(self.buffer), len(view))
+        view[:received] = self.buffer[:received]
+        del self.buffer[:received]
+        while received < len(view):
+            n_bytes = self.client.recv_into(view[received:])
+            if n_bytes == 0:
                 break
-            message += chunk
+            received += n_bytes
+        return received
+
+
+    def receive_bytes(self, num_bytes: int) -> bytearray:
+        message = bytearray(num_bytes)
+        with memoryview(message) as view:
+            received = self.receive_into(view)
+        del message[received:]
         return message
-        
\ No newline at end of file
+
+
+    def receive_header(self, incremental: bool=False) -> Tuple[int, str, List[FrameEntry]]:
+        """Receives a binary protocol header: the message type, the progress and the frame entries"""
+        header = self.receive_bytes(HEADER_FORMAT.size)
+        message_type, progress_length, n_frames = HEADER_FORMAT.unpack(header)
+        progress = self.receive_bytes(progress_length).decode()
+
+        n_fields = 1 + incremental + (self.shared_frames is not None)
+        values = struct.unpack(f">{n_fields * n_frames}I", self.receive_bytes(4 * n_fields * n_frames))
+        frame_entries = []
+        for i in range(0, len(values), n_fields):
+            fields = iter(values[i:i + n_fields])
+            number = next(fields) if incremental else None
+            offset = next(fields) if self.shared_frames is not None else None
+            frame_entries.append(FrameEntry(next(fields), number, offset))
+        return message_type, progress, frame_entries
+
+
+    def open_shared_frames(self, size: int) -> str:
+        """
+        Creates the shared memory main.lua can write the frames into, if the transport uses one.
+        Returns its path, or an empty string.
+        """
+        self.close_shared_frames()
+        self.shared_frames = self.transport.create_shared_frames(size)
+        return self.shared_frames.path if self.shared_frames is not None else ""
+
+
+    def close_shared_frames(self):
+        if self.shared_frames is not None:
+            self.shared_frames.close()
+            self.shared_frames = None
+
+
+    def get_shared_frame(self, frame_entry: FrameEntry) -> memoryview:
+        """View on a frame written in the shared memory, without any copy"""
+        return self.shared_frames.get(frame_entry.offset, frame_entry.length)
+
+
+class FramePool:
+    """Reusable receive buffers for the frames of a window"""
+    def __init__(self):
+        self.buffers = []
+
+
+    def get(self, index: int, size: int) -> memoryview:
+        """Returns a view of exactly size bytes on the buffer of the index-th frame"""
+        while len(self.buffers) <= index:
+            self.buffers.append(bytearray())
+        if len(self.buffers[index]) < size:
+            # A new buffer is allocated instead of resizing the old one since views
+            # on it might still be in use. Extra room avoids reallocating on every
+            # slightly larger frame.
+            self.buffers[index] = bytearray(size + size // 4)
+        return memoryview(self.buffers[index])[:size]
@@ -0,0 +1,311 @@
+import io
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, List
+
+from PIL import Image, ImageDraw
+
+from .mesen import (
+    PROTOCOL_TEXT, LATEST_PROTOCOL, MESSAGE_WINDOW, MESSAGE_EVENT, HEADER_FORMAT, FRAME_FORMAT_PNG, FRAME_FORMAT_RAW,
+    PLAN_PREFIX, PLANNED_WINDOW_PREFIX
+)
+
+NES_SCREEN_SIZE = (256, 240)
+N_SYNTHETIC_FRAMES = 60  # Number of distinct synthetic frames, cycled through
+SEPARATOR_WIDTH = 1  # Width of the separator between frames in recorded screenshot histories
+
+
+def pad_png(png: bytes, payload_size: int) -> bytes:
+    """Pads a PNG to payload_size bytes with a private ancillary chunk, which decoders ignore"""
+    chunk_overhead = 12  # Length, type and CRC
+    padding_length = payload_size - len(png) - chunk_overhead
+    if padding_length < 0:
+        return png
+    chunk_type = b"llmP"
+    data = bytes(padding_length)
+    chunk = struct.pack(">I", padding_length) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+    # The chunk must come before IEND, which is always the last 12 bytes
+    return png[:-12] + chunk + png[-12:]
+
+
+def encode_png(image: Image.Image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def load_recorded_frames(frames_path: str, frame_width: int=NES_SCREEN_SIZE[0]) -> List[bytes]:
+    """Loads PNG frames from a directory of PNGs or from a saved screenshot history (recent_frames.png)"""
+    if os.path.isdir(frames_path):
+        frames = []
+        for file_name in sorted(os.listdir(frames_path)):
+            if file_name.endswith(".png"):
+                with open(os.path.join(frames_path, file_name), "rb") as f:
+                    frames.append(f.read())
+        return frames
+
+    history = Image.open(frames_path)
+    frames = []
+    for x in range(0, history.width, frame_width + SEPARATOR_WIDTH):
+        frames.append(encode_png(history.crop((x, 0, x + frame_width, history.height))))
+    return frames
+
+
+def generate_synthetic_frames(n_frames: int=N_SYNTHETIC_FRAMES, size: tuple=NES_SCREEN_SIZE) -> List[bytes]:
+    """Generates frames with a sky, a ground and a block moving to the right"""
+    frames = []
+    width, height = size
+    for i in range(n_frames):
+        image = Image.new("RGB", size, (92, 148, 252))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, height - 32, width, height), fill=(200, 76, 12))
+        x = (i * width // n_frames) % (width - 16)
+        draw.rectangle((x, height - 48, x + 15, height - 33), fill=(248, 56, 0))
+        frames.append(encode_png(image))
+    return frames
+
+
+def png_to_raw(png: bytes) -> bytes:
+    """Converts a PNG to the uncompressed RGB pixels main.lua sends in raw mode"""
+    return Image.open(io.BytesIO(png)).convert("RGB").tobytes()
+
+
+def smb_progress(window: int, inputs: str) -> str:
+    """Default progress: SMB-like progress that advances by 0.1 % per window"""
+    return f"1-1 ({min(window / 10, 100.0):.1f} %)"
+
+
+class MockMesen:
+    """Pure Python stand-in for Mesen running mesen_lua/main.lua.
+
+    Speaks the same wire protocol as main.lua, so a Game can be played, tested and
+    load-tested without an emulator.
+    """
+    def __init__(self,
+                 host: str="localhost",
+                 port: int=9999,
+                 frames_path: str=None,
+                 payload_size: int=None,
+                 fps: float=None,
+                 n_windows: int=1000,
+                 death_every: int=None,
+                 progress_function: Callable[[int, str], str]=smb_progress,
+                 protocol: int=LATEST_PROTOCOL,
+                 connect_timeout: float=10,
+                 unix_socket_path: str=None,
+                 ):
+        """
+        frames_path: directory of PNGs or screenshot history to replay. Synthetic frames are generated when None.
+        payload_size: size in bytes each PNG is padded to (ignored for raw frames)
+        fps: emulated frames per second. Windows are sent as fast as possible when None.
+        n_windows: number of windows before sending "GAME OVER"
+        death_every: a "DEAD" event is sent every death_every windows
+        progress_function: returns the progress of a window from its index and the last inputs received
+        unix_socket_path: connects to this Unix-domain socket instead of host and port (see UnixTransport)
+        """
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.n_windows = n_windows
+        self.death_every = death_every
+        self.progress_function = progress_function
+        self.max_protocol = protocol
+        self.connect_timeout = connect_timeout
+        self.unix_socket_path = unix_socket_path
+
+        frames = load_recorded_frames(frames_path) if frames_path else generate_synthetic_frames()
+        if payload_size:
+            frames = [pad_png(frame, payload_size) for frame in frames]
+        self.frames = frames
+        self.raw_frames = None
+
+        self.client = None
+        self.reader = None
+        self.thread = None
+        # Hyperparameters sent by Python
+        self.mesen_timeout = None
+        self.input_length = None
+        self.n_screenshots = None
+        self.freq_screenshots = None
+        self.protocol = PROTOCOL_TEXT
+        self.frame_format = FRAME_FORMAT_PNG
+        self.incremental_frames = False
+        self.last_sent_frame_numbers = set()
+        self.shared_frames = None
+        self.shared_frames_size = 0
+        self.shared_frames_offset = 0
+
+        self.received_inputs = []
+
+
+    def connect(self):
+        # Unlike main.lua, retries until Python listens so both can be started in any order
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                if self.unix_socket_path:
+                    self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self.client.connect(self.unix_socket_path)
+                else:
+                    self.client = socket.create_connection((self.host, self.port))
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+        if not self.unix_socket_path:
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.client.makefile("rb")
+
+
+    def receive_line(self) -> str:
+        return self.reader.readline().decode().strip()
+
+
+    def send_line(self, line: str):
+        self.client.sendall(line.encode() + b"\n")
+
+
+    def receive_hyperparameters(self):
+        self.mesen_timeout = int(self.receive_line())
+        self.input_length = int(self.receive_line())
+        self.n_screenshots = int(self.receive_line())
+        self.freq_screenshots = int(self.receive_line())
+        self.protocol = min(int(self.receive_line()), self.max_protocol)
+        self.frame_format = int(self.receive_line())
+        if self.protocol == PROTOCOL_TEXT:
+            self.frame_format = FRAME_FORMAT_PNG
+        if self.frame_format == FRAME_FORMAT_RAW and self.raw_frames is None:
+            self.raw_frames = [png_to_raw(frame) for frame in self.frames]
+        self.incremental_frames = int(self.receive_line()) == 1 and self.protocol != PROTOCOL_TEXT
+        shared_frames_path = self.receive_line()
+        self.shared_frames_size = int(self.receive_line())
+        if shared_frames_path and self.protocol != PROTOCOL_TEXT:
+            self.shared_frames = open(shared_frames_path, "r+b")
+        self.send_line(str(self.protocol))
+        self.send_line(str(self.frame_format))
+        self.send_line(str(int(self.incremental_frames)))
+        self.send_line(str(int(self.shared_frames is not None)))
+
+
+    def write_shared_frame(self, frame: bytes) -> int:
+        """Writes a frame in the shared memory like main.lua and returns its offset"""
+        if self.shared_frames_offset + len(frame) > self.shared_frames_size:
+            self.shared_frames_offset = 0
+        offset = self.shared_frames_offset
+        self.shared_frames.seek(offset)
+        self.shared_frames.write(frame)
+        self.shared_frames_offset = offset + len(frame)
+        return offset
+
+
+    def _send_binary_message(self, message_type: int, progress: str, frames: List[bytes], frame_numbers: List[int]=()):
+        progress_bytes = progress.encode()
+        header = HEADER_FORMAT.pack(message_type, len(progress_bytes), len(frames)) + progress_bytes
+        if self.incremental_frames:
+            # Frames sent in the previous window are only referenced by their frame number
+            frames = [b"" if number in self.last_sent_frame_numbers else frame
+                      for frame, number in zip(frames, frame_numbers)]
+            if frames:
+                self.last_sent_frame_numbers = set(frame_numbers)
+        entries = []
+        for i, frame in enumerate(frames):
+            if self.incremental_frames:
+                entries.append(frame_numbers[i])
+            if self.shared_frames:
+                entries.append(self.write_shared_frame(frame) if frame else 0)
+            entries.append(len(frame))
+        header += struct.pack(f">{len(entries)}I", *entries)
+        if self.shared_frames:
+            # The frames don't go through the socket
+            self.shared_frames.flush()
+            frames = []
+        self.client.sendall(header)
+        for frame in frames:
+            if frame:
+                self.client.sendall(frame)
+
+
+    def send_event(self, progress: str):
+        if self.protocol == PROTOCOL_TEXT:
+            self.send_line(progress)
+        else:
+            self._send_binary_message(MESSAGE_EVENT, progress, [])
+
+
+    def send_window(self, progress: str, frames: List[bytes], frame_numbers: List[int]):
+        if self.protocol == PROTOCOL_TEXT:
+            self.send_line(progress)
+            for frame in frames:
+                self.send_line(str(len(frame)))
+                self.client.sendall(frame)
+        else:
+            self._send_binary_message(MESSAGE_WINDOW, progress, frames, frame_numbers)
+
+
+    def get_window_frame_numbers(self, window: int) -> List[int]:
+        """Frame numbers of the screenshots of a window, taken every freq_screenshots frames like main.lua"""
+        # Like main.lua, the first window is only sent once the screenshot history is full
+        last_frame = (window + 1) * self.input_length + (self.n_screenshots - 1) * self.freq_screenshots
+        return [last_frame - k * self.freq_screenshots for k in range(self.n_screenshots - 1, -1, -1)]
+
+
+    def get_window_frames(self, frame_numbers: List[int]) -> List[bytes]:
+        frames = self.raw_frames if self.frame_format == FRAME_FORMAT_RAW else self.frames
+        return [frames[number % len(frames)] for number in frame_numbers]
+
+
+    def run(self):
+        """Connects to Python and plays n_windows windows before sending "GAME OVER" """
+        self.connect()
+        self.receive_hyperparameters()
+        window_duration = self.input_length / self.fps if self.fps else 0
+
+        inputs = ""
+        # Inputs of the windows left in the last plan received, played without waiting for Python
+        planned_windows = []
+        next_window_time = time.monotonic()
+        for window in range(self.n_windows):
+            if self.death_every and window > 0 and window % self.death_every == 0:
+                # Like main.lua, dying interrupts the plan
+                planned_windows = []
+                self.send_event("DEAD")
+
+            progress = self.progress_function(window, inputs)
+            if planned_windows:
+                inputs = planned_windows.pop(0)
+                self.send_event(PLANNED_WINDOW_PREFIX + progress)
+            else:
+                frame_numbers = self.get_window_frame_numbers(window)
+                self.send_window(progress, self.get_window_frames(frame_numbers), frame_numbers)
+                inputs = self.receive_line()
+                self.received_inputs.append(inputs)
+                if inputs.startswith(PLAN_PREFIX):
+                    planned_windows = inputs[len(PLAN_PREFIX):].split(";")
+                    inputs = planned_windows.pop(0)
+
+            if window_duration:
+                next_window_time += window_duration
+                time.sleep(max(0, next_window_time - time.monotonic()))
+
+        self.send_event("GAME OVER")
+        self.close()
+
+
+    def start(self) -> threading.Thread:
+        """Runs the mock emulator in a background thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+
+    def close(self):
+        if self.shared_frames:
+            self.shared_frames.close()
+            self.shared_frames = None
+        self.reader.close()
+        self.client.close()
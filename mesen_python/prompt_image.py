@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import io
+import threading
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+
+class PromptImage:
+    """
+    Image given to the LLMs, kept in memory: its encoded bytes, their mime type and,
+    when available, the decoded pixels it was encoded from
+    """
+    def __init__(self, data: bytes=None, mime_type: str="image/png", pixels: np.ndarray=None,
+                 encoder: Callable[[np.ndarray], bytes]=None):
+        """
+        encoder: encodes the pixels into the bytes when data is None. The pixels are only
+                 encoded on the first use of the bytes, so a window whose image isn't given
+                 to an LLM (reused inputs, late window) isn't encoded.
+        """
+        self._data = data
+        self.mime_type = mime_type
+        self.pixels = pixels
+        self.encoder = encoder
+        # The backends of a HedgedLLM use the same image from their threads
+        self.lock = threading.Lock()
+        self._base64 = None
+        self._hash = None
+
+
+    @property
+    def data(self) -> bytes:
+        self.encode()
+        return self._data
+
+
+    def encode(self):
+        """Encodes the pixels now if they weren't yet"""
+        if self._data is not None:
+            return
+        with self.lock:
+            if self._data is None:
+                self._data = self.encoder(self.pixels)
+
+
+    @classmethod
+    def from_file(cls, path: str) -> "PromptImage":
+        """Reads an image file as is, without decoding it"""
+        with open(path, "rb") as f:
+            data = f.read()
+        image_format = Image.open(io.BytesIO(data)).format
+        return cls(data, Image.MIME.get(image_format, "application/octet-stream"))
+
+
+    def to_base64(self) -> str:
+        # Cached since a backend might need it more than once (retries)
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("utf-8")
+        return self._base64
+
+
+    def get_hash(self) -> str:
+        """Hash of the encoded bytes, which identifies the image in the LLM cache"""
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.data).hexdigest()
+        return self._hash
+
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+
+    def get_file_extension(self) -> str:
+        return self.mime_type.split("/")[-1]
+
+
+    def save(self, path: str):
+        """Writes the encoded bytes, for debugging"""
+        with open(path, "wb") as f:
+            f.write(self.data)
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from .mesen import Mesen
+from .transports import TCPTransport, TRANSPORT_ENV_VARIABLE
+
+
+class MesenServer:
+    """Accepts any number of Mesen connections and runs a session for each of them.
+
+    Connections are accepted by an asyncio loop. Each session (a Game and its LLM)
+    runs in its own worker thread since the games and the LLM backends are blocking,
+    so a slow model only pauses its own emulator while the others keep playing.
+    At most max_sessions connections are accepted at once, the next emulators wait
+    in the listen backlog until a session ends. main.lua stops if its session doesn't
+    start within its timeout, so it must then be restarted.
+    """
+    def __init__(self,
+                 session_handler: Callable[[Mesen, str], None],
+                 host: str="localhost",
+                 port: int=9999,
+                 max_sessions: int=32,
+                 transport=None,
+                 ):
+        self.session_handler = session_handler
+        self.host = host
+        self.port = port
+        # Shared by every session, host and port are only used by the default TCPTransport
+        self.transport = transport if transport is not None else TCPTransport(host, port)
+        self.max_sessions = max_sessions
+        self.n_sessions = 0
+        self.active_sessions = 0
+        self.max_active_sessions = 0
+
+
+    def _run_session(self, client: socket.socket, session_id: str):
+        mesen = Mesen(client=client, transport=self.transport)
+        try:
+            self.session_handler(mesen, session_id)
+        except Exception:
+            # A crashing session must not stop the others
+            print(f"Session {session_id} crashed:")
+            traceback.print_exc()
+        finally:
+            mesen.close_shared_frames()
+            client.close()
+
+
+    def _end_session(self, session_id: str, free_slots: asyncio.Semaphore):
+        # Called from the asyncio loop, so the counter is never updated concurrently
+        self.active_sessions -= 1
+        free_slots.release()
+        print(f"Session {session_id} ended. Active sessions: {self.active_sessions}")
+
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        server = self.transport.create_server()
+        server.listen()
+        server.setblocking(False)
+
+        sessions = set()
+        executor = ThreadPoolExecutor(max_workers=self.max_sessions)
+        # A connection is only accepted when a worker can start its session right away, otherwise
+        # it would wait in the executor's queue without hyperparameters until main.lua gives up
+        free_slots = asyncio.Semaphore(self.max_sessions)
+        print(f"Waiting for Mesen connections on {server.getsockname()} ({TRANSPORT_ENV_VARIABLE}={self.transport.lua_transport} for main.lua)...")
+        try:
+            while True:
+                if free_slots.locked():
+                    print(f"{self.max_sessions} sessions running. The next Mesen connections wait for one to end.")
+                await free_slots.acquire()
+                client, addr = await loop.sock_accept(server)
+                client.setblocking(True)
+                session_id = str(self.n_sessions)
+                self.n_sessions += 1
+                self.active_sessions += 1
+                self.max_active_sessions = max(self.max_active_sessions, self.active_sessions)
+                print(f"Mesen connected: {addr} (session {session_id})")
+
+                session = loop.run_in_executor(executor, self._run_session, client, session_id)
+                sessions.add(session)
+                session.add_done_callback(sessions.discard)
+                session.add_done_callback(lambda _, session_id=session_id: self._end_session(session_id, free_slots))
+        finally:
+            server.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def run(self):
+        asyncio.run(self.serve())
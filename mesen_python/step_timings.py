@@ -0,0 +1,171 @@
+import csv
+import json
+import time
+from typing import Dict, List
+
+HISTOGRAM_SUB_BUCKET_BITS = 5  # 32 buckets per power of two, so the recorded values are within about 3%
+SUMMARY_PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds: log-linear buckets, so recording is O(1)
+    and the memory doesn't grow with the number of values, with a bounded relative error
+    """
+    def __init__(self):
+        # Lower bound of each bucket -> number of values
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+
+    def record(self, value: int):
+        value = max(0, int(value))
+        # Values are truncated to their HISTOGRAM_SUB_BUCKET_BITS + 1 most significant bits
+        shift = max(0, value.bit_length() - HISTOGRAM_SUB_BUCKET_BITS - 1)
+        bucket = (value >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+
+    def get_percentile(self, percentile: float) -> int:
+        """Upper bound of the bucket of the value at this percentile"""
+        if self.count == 0:
+            return 0
+        rank = max(1, round(percentile / 100 * self.count))
+        n_values = 0
+        for bucket in sorted(self.counts):
+            n_values += self.counts[bucket]
+            if n_values >= rank:
+                shift = max(0, bucket.bit_length() - HISTOGRAM_SUB_BUCKET_BITS - 1)
+                return min(self.max, bucket + (1 << shift) - 1)
+        return self.max
+
+
+    def get_mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+
+    def to_dict(self) -> dict:
+        summary = {"count": self.count, "mean": self.get_mean(), "min": self.min or 0, "max": self.max}
+        for percentile in SUMMARY_PERCENTILES:
+            summary[f"p{percentile}"] = self.get_percentile(percentile)
+        summary["buckets"] = sorted(self.counts.items())
+        return summary
+
+
+class _Stage:
+    """Times a stage, the time of its nested stages excluded"""
+    def __init__(self, timings: "StepTimings", name: str):
+        self.timings = timings
+        self.name = name
+
+
+    def __enter__(self):
+        self.child_time = 0
+        self.start = time.perf_counter_ns()
+        self.timings.stack.append(self)
+        return self
+
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        self.timings.stack.pop()
+        if self.timings.stack:
+            self.timings.stack[-1].child_time += elapsed
+        self.timings.add(self.name, (elapsed - self.child_time) // 1000)
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        pass
+
+
+class StepTimings:
+    """
+    Monotonic timings of the stages of each step of the main loop (receive, image processing,
+    LLM...), in microseconds, kept per step and in a LatencyHistogram per stage.
+    A stage's time excludes its nested stages, so the stages of a step add up to its total.
+    """
+    def __init__(self, enabled: bool=True):
+        self.enabled = enabled
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        # Microseconds of each stage of each finished step
+        self.steps: List[Dict[str, int]] = []
+        self.current_step = None
+        self.step_start = None
+        self.stack = []
+
+
+    def stage(self, name: str):
+        """Context manager timing a stage of the current step"""
+        if not self.enabled:
+            return _NoStage()
+        return _Stage(self, name)
+
+
+    def add(self, name: str, microseconds: int):
+        """Adds the time of a stage to the current step, for timings measured elsewhere"""
+        if not self.enabled:
+            return
+        if self.current_step is None:
+            self.start_step()
+        self.current_step[name] = self.current_step.get(name, 0) + microseconds
+
+
+    def start_step(self):
+        """Ends the current step, if any, and starts a new one"""
+        if not self.enabled:
+            return
+        if self.current_step is not None:
+            self.end_step()
+        self.current_step = {}
+        self.step_start = time.perf_counter_ns()
+
+
+    def end_step(self):
+        if not self.enabled or self.current_step is None:
+            return
+        self.current_step["step"] = (time.perf_counter_ns() - self.step_start) // 1000
+        for name, microseconds in self.current_step.items():
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].record(microseconds)
+        self.steps.append(self.current_step)
+        self.current_step = None
+
+
+    def reset(self):
+        self.histograms = {}
+        self.steps = []
+        self.current_step = None
+
+
+    def get_summary(self) -> str:
+        """p50/p95/p99 of each stage, in milliseconds"""
+        lines = []
+        for name, histogram in self.histograms.items():
+            percentiles = " / ".join(f"{histogram.get_percentile(percentile) / 1000:.1f}" for percentile in SUMMARY_PERCENTILES)
+            lines.append(f"{name:>20}: {percentiles} ms (n={histogram.count})")
+        return f"{'stage':>20}: p" + "/p".join(map(str, SUMMARY_PERCENTILES)) + "\n" + "\n".join(lines)
+
+
+    def save(self, path: str):
+        """Writes the histograms to path.json and the timings of each step to path.csv"""
+        with open(f"{path}.json", "w") as f:
+            json.dump({name: histogram.to_dict() for name, histogram in self.histograms.items()}, f)
+
+        stage_names = sorted({name for step in self.steps for name in step})
+        with open(f"{path}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=stage_names, restval=0)
+            writer.writeheader()
+            writer.writerows(self.steps)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import mmap
+import os
+import socket
+import tempfile
+import uuid
+
+SHARED_MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+UNIX_SOCKET_PATH = "/tmp/llm4mesen.sock"  # Must match UNIX_SOCKET_PATH in mesen_lua/main.lua
+# Environment variable giving main.lua the kind of transport it connects with (lua_transport of the transports)
+TRANSPORT_ENV_VARIABLE = "LLM4MESEN_TRANSPORT"
+
+
+class SharedFrames:
+    """Memory-mapped file where main.lua writes the frames, read by Python without copies"""
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+        self.view = memoryview(self.mmap)
+
+
+    def get(self, offset: int, length: int) -> memoryview:
+        return self.view[offset:offset + length]
+
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+        os.remove(self.path)
+
+
+class TCPTransport:
+    """Control socket and frames over TCP, the default transport"""
+    lua_transport = "tcp"
+
+    def __init__(self, host: str="localhost", port: int=9999):
+        self.host = host
+        self.port = port
+
+
+    def create_server(self) -> socket.socket:
+        server = socket.socket()
+        if os.name != "nt":
+            # The port can be listened on again while the connections of a previous game are in TIME_WAIT
+            # (on Windows, SO_REUSEADDR would allow two servers on the same port instead)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        return server
+
+
+    def create_shared_frames(self, size: int) -> SharedFrames:
+        """Frames go through the socket"""
+        return None
+
+
+class UnixTransport:
+    """Control socket and frames over a Unix-domain socket, which skips the network stack"""
+    lua_transport = "unix"
+
+    def __init__(self, path: str=UNIX_SOCKET_PATH):
+        self.path = path
+
+
+    def create_server(self) -> socket.socket:
+        if os.path.exists(self.path):
+            # Left behind by a previous run
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        return server
+
+
+    def create_shared_frames(self, size: int) -> SharedFrames:
+        """Frames go through the socket"""
+        return None
+
+
+class SharedMemoryTransport:
+    """
+    Frames are written by main.lua in a memory-mapped file and only their offsets go through
+    the control socket, which uses control_transport (TCP by default)
+    """
+    def __init__(self, control_transport=None, shared_memory_dir: str=SHARED_MEMORY_DIR):
+        self.control_transport = control_transport if control_transport is not None else TCPTransport()
+        self.shared_memory_dir = shared_memory_dir
+
+
+    @property
+    def lua_transport(self) -> str:
+        return self.control_transport.lua_transport
+
+
+    def create_server(self) -> socket.socket:
+        return self.control_transport.create_server()
+
+
+    def create_shared_frames(self, size: int) -> SharedFrames:
+        # Every connection gets its own file since a MesenServer shares its transport between sessions
+        path = os.path.join(self.shared_memory_dir, f"llm4mesen_{uuid.uuid4().hex}.frames")
+        return SharedFrames(path, size)
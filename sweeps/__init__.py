@@ -0,0 +1,8 @@
+from .sweep_runner import Sweep, SweepJob, run_job
+
+
+__all__ = [
+    "Sweep",
+    "SweepJob",
+    "run_job",
+]
\ No newline at end of file
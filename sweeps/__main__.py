@@ -0,0 +1,5 @@
+from .sweep_runner import main_sweep
+
+
+if __name__ == "__main__":
+    main_sweep()
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""
+Plays every combination of the hyperparameters and models of a sweep configuration file, with a
+process pool whose workers each have their own Mesen instance, TCP port and LLM backend.
+
+The playthroughs are saved by main.play with Game.save_playthrough, one line per playthrough in the
+file named after its hyperparameters and model. A sweep that was stopped resumes where it left off:
+the combinations whose file already has n_playthroughs lines aren't played again.
+
+Run from the repository root: python -m sweeps sweeps/example_sweep.json
+"""
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, NamedTuple
+
+import main
+from llm_backends import create_backend, get_backend_model
+from mesen_python import SMB, TLOZ, ImageEncoder
+from mesen_python.mesen import Mesen
+from mesen_python.mock_mesen import MockMesen
+from mesen_python.transports import TCPTransport
+
+GAMES = {
+    "smb": SMB,
+    "tloz": TLOZ,
+}
+DEFAULT_BASE_PORT = 10000  # Port of the first worker, the others use the next ones
+DEFAULT_MAX_WORKERS = 4
+MESEN_STARTUP_TIMEOUT = 120  # Seconds to wait for a launched Mesen to connect
+# Backends that share the API quotas of main.RATE_LIMITER and the responses of main.LLM_CACHE
+API_BACKENDS = ("gemini_api", "chatgpt_api")
+# Backends that can't be used by several workers at once, like the Chrome profile of GeminiBrowser
+SINGLE_INSTANCE_BACKENDS = ("gemini_browser",)
+LOGS_FOLDER = "sweep_logs"
+
+# TCP port of the worker process, given by _init_worker
+_worker_port = None
+
+
+class SweepJob(NamedTuple):
+    """One playthrough of a combination of the sweep"""
+    game: str
+    game_args: dict  # Arguments of the Game, with the hyperparameters of the combination
+    model: dict  # Entry of the models list of the configuration
+    run: int  # Index of the playthrough among the ones of the combination
+    config: dict
+
+
+def create_game(job: SweepJob, mesen: Mesen):
+    game_args = dict(job.game_args)
+    if "image_format" in game_args:
+        game_args["image_encoder"] = ImageEncoder(game_args.pop("image_format"))
+    return GAMES[job.game](mesen=mesen, **game_args)
+
+
+def create_llm(job: SweepJob):
+    backend = job.model["backend"]
+    args = dict(job.model.get("args", {}))
+    if backend in API_BACKENDS:
+        args.setdefault("cache", main.LLM_CACHE)
+        args.setdefault("rate_limiter", main.setup_rate_limiter())
+    return create_backend(backend, get_backend_model(backend, job.model["model"]), **args)
+
+
+def get_model_key(model: dict) -> str:
+    return f"{model['backend']}:{model['model']}"
+
+
+def count_playthroughs(playthrough_file: str) -> int:
+    """Number of playthroughs saved in a playthrough file, one per line"""
+    if not os.path.exists(playthrough_file):
+        return 0
+    with open(playthrough_file, "r") as f:
+        return sum(1 for line in f if line.strip())
+
+
+class _LaunchingMesen(Mesen):
+    """Mesen connection that launches the emulator (or a MockMesen) once Python listens"""
+    def __init__(self, port: int, command: List[str]=None, game: str=None, mock_args: dict=None, log_file=None):
+        super().__init__(transport=TCPTransport(port=port))
+        self.port = port
+        self.command = command
+        self.game = game
+        self.mock_args = mock_args
+        self.log_file = log_file
+        self.process = None
+        self.mock = None
+
+
+    def connect(self):
+        # Listening first, so the emulator's single connection attempt succeeds
+        self.server.listen(1)
+        if self.mock_args is not None:
+            self.mock = MockMesen(port=self.port, **self.mock_args)
+            self.mock.start()
+        else:
+            env = dict(os.environ, LLM4MESEN_PORT=str(self.port), LLM4MESEN_GAME=self.game,
+                       LLM4MESEN_TRANSPORT=self.transport.lua_transport)
+            command = [arg.format(port=self.port, game=self.game) for arg in self.command]
+            self.process = subprocess.Popen(command, env=env, stdout=self.log_file, stderr=subprocess.STDOUT)
+        self.server.settimeout(MESEN_STARTUP_TIMEOUT)
+        super().connect()
+
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.server.close()
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.mock is not None:
+            self.mock.thread.join(timeout=10)
+
+
+def _init_worker(ports):
+    global _worker_port
+    _worker_port = ports.get()
+
+
+def run_job(job: SweepJob) -> str:
+    """Plays one playthrough in a worker and returns the file it was saved to"""
+    mesen_args = {
+        "command": job.config.get("mesen_command"),
+        "game": job.game,
+        "mock_args": job.config.get("mock_mesen"),
+    }
+    mesen = _LaunchingMesen(_worker_port, **mesen_args)
+    game = create_game(job, mesen)
+    model_file_name = get_backend_model(job.model["backend"], job.model["model"]).get_file_name()
+    name = game.get_playthrough_filename(model_file_name)[:-len(".csv")]
+    logs_folder = f"{game.playthrough_path}/{game.get_acronym()}/{LOGS_FOLDER}"
+    os.makedirs(logs_folder, exist_ok=True)
+    os.makedirs(game.get_playthrough_folder_path(), exist_ok=True)
+
+    llm = None
+    with open(f"{logs_folder}/{name}__run={job.run}.log", "w") as log_file:
+        mesen.log_file = log_file
+        try:
+            with contextlib.redirect_stdout(log_file):
+                llm = create_llm(job)
+                main.play(game, llm)
+        finally:
+            mesen.close()
+            # Chrome of a GeminiBrowser, since the worker plays other playthroughs afterwards
+            if hasattr(llm, "close"):
+                llm.close()
+    return f"{game.get_playthrough_folder_path()}{game.get_playthrough_filename(model_file_name)}"
+
+
+class Sweep:
+    def __init__(self, config: dict):
+        """
+        config: content of a sweep configuration file (see sweeps/example_sweep.json):
+            game: "smb" or "tloz"
+            matrix: list of values of each argument of the Game, like input_length, n_screenshots,
+                    freq_screenshots, image_format, crop_screenshots or downscale
+            models: backend and model name (from the backend's model list) of each LLM, with the
+                    optional arguments of the backend (args) and maximum number of workers
+                    playing with it at the same time (max_concurrency)
+            n_playthroughs: number of playthroughs of each combination
+            game_args: arguments of the Game shared by every combination
+            max_workers: number of processes, each with its own Mesen instance
+            base_port: TCP port of the first worker, the others use the next ones
+            mesen_command: command launching Mesen with mesen_lua/main.lua, whose arguments can contain
+                           {port} and {game}. The port, the game and the transport are also given to main.lua
+                           by the LLM4MESEN_PORT, LLM4MESEN_GAME and LLM4MESEN_TRANSPORT environment variables.
+            mock_mesen: arguments of a MockMesen played with instead of Mesen, for dry runs
+        """
+        if config["game"] not in GAMES:
+            raise ValueError(f"Unknown game {config['game']!r}. Available games: {', '.join(GAMES)}")
+        if config.get("mesen_command") is None and config.get("mock_mesen") is None:
+            raise ValueError("The sweep needs a mesen_command, or mock_mesen for a dry run")
+        self.config = config
+        self.max_workers = config.get("max_workers", DEFAULT_MAX_WORKERS)
+        self.base_port = config.get("base_port", DEFAULT_BASE_PORT)
+        self.max_concurrency = {}
+        for model in config["models"]:
+            max_concurrency = model.get("max_concurrency", self.max_workers)
+            if model["backend"] in SINGLE_INSTANCE_BACKENDS:
+                max_concurrency = 1
+            self.max_concurrency[get_model_key(model)] = max(1, max_concurrency)
+
+
+    @classmethod
+    def from_file(cls, path: str) -> "Sweep":
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+
+    def get_combinations(self) -> List[dict]:
+        """Game arguments of every combination of the matrix"""
+        matrix = self.config.get("matrix", {})
+        names = list(matrix)
+        combinations = []
+        for values in itertools.product(*(matrix[name] for name in names)):
+            game_args = dict(self.config.get("game_args", {}))
+            game_args.update(zip(names, values))
+            combinations.append(game_args)
+        return combinations
+
+
+    def get_jobs(self) -> List[SweepJob]:
+        """Playthroughs left to play, the first playthrough of every combination coming first"""
+        # Never connected, only used to name the playthrough files
+        placeholder = Mesen(transport=TCPTransport(port=0))
+        remaining = []
+        for game_args, model in itertools.product(self.get_combinations(), self.config["models"]):
+            job = SweepJob(self.config["game"], game_args, model, 0, self.config)
+            game = create_game(job, placeholder)
+            model_file_name = get_backend_model(model["backend"], model["model"]).get_file_name()
+            playthrough_file = f"{game.get_playthrough_folder_path()}{game.get_playthrough_filename(model_file_name)}"
+            n_saved = count_playthroughs(playthrough_file)
+            remaining.append([job._replace(run=run) for run in range(n_saved, self.config.get("n_playthroughs", 1))])
+        placeholder.server.close()
+        jobs = []
+        for run_jobs in itertools.zip_longest(*remaining):
+            jobs += [job for job in run_jobs if job is not None]
+        return jobs
+
+
+    def _can_start(self, job: SweepJob, running_jobs) -> bool:
+        key = get_model_key(job.model)
+        n_running = sum(1 for running_job in running_jobs if get_model_key(running_job.model) == key)
+        if job.model["backend"] in SINGLE_INSTANCE_BACKENDS:
+            # The single instance is shared by the models of the backend
+            n_running = sum(1 for running_job in running_jobs if running_job.model["backend"] == job.model["backend"])
+        return n_running < self.max_concurrency[key]
+
+
+    def run(self) -> dict:
+        """Plays the remaining playthroughs and returns the number of completed and failed ones"""
+        pending = self.get_jobs()
+        print(f"{len(pending)} playthroughs to play with {self.max_workers} workers")
+        stats = {"completed": 0, "failed": 0}
+        if not pending:
+            return stats
+
+        context = multiprocessing.get_context("spawn")
+        ports = context.Queue()
+        for port in range(self.base_port, self.base_port + self.max_workers):
+            ports.put(port)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(self.max_workers, mp_context=context, initializer=_init_worker, initargs=(ports,)) as executor:
+            running = {}
+            while pending or running:
+                for job in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if self._can_start(job, running.values()):
+                        running[executor.submit(run_job, job)] = job
+                        pending.remove(job)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    description = f"{get_model_key(job.model)} {job.game_args} run {job.run}"
+                    if future.exception() is not None:
+                        # Not saved, so the playthrough is played again when the sweep is resumed
+                        stats["failed"] += 1
+                        print(f"Failed {description}: {future.exception()!r}")
+                    else:
+                        stats["completed"] += 1
+                        print(f"Completed {description} -> {future.result()}")
+                print(f"{stats['completed'] + stats['failed']} done, {len(running)} running, {len(pending)} pending "
+                      f"({time.perf_counter() - start:.0f}s)")
+        return stats
+
+
+def main_sweep():
+    if len(sys.argv) < 2:
+        print("Usage: python -m sweeps <sweep configuration file>")
+        return
+    print("Sweep results:", Sweep.from_file(sys.argv[1]).run())
\ No newline at end of file
@@ -0,0 +1,49 @@
+import contextlib
+import io
+import time
+
+from chatgpt import ChatGPTAPI, ChatGPTModels
+from fake_llm_servers import FakeOpenAIServer, constant_latency
+from mesen_python import InputParser
+
+VALID_INPUTS = ["left", "right", "a", "b"]
+N_STEPS = 12
+LATENCY = 1.0
+
+
+def play_steps(llm: ChatGPTAPI, parser: InputParser, n_steps: int) -> list:
+    """Returns the size of the input sent at each step"""
+    llm.start_new_chat()
+    sizes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(n_steps):
+            llm.add_text_to_prompt(f"Progress: 1-1 ({step} %)")
+            assert set(llm.send_prompt(parser).split(",")).issubset(VALID_INPUTS)
+            sizes.append(llm.last_request_size)
+    return sizes
+
+
+def test_complete_streamed_responses_are_chained():
+    """Answers without text after the inputs finish on their own, so the requests stay bounded"""
+    server = FakeOpenAIServer(VALID_INPUTS, seed=0).start()
+    try:
+        llm = ChatGPTAPI(ChatGPTModels.NANO_5, api_key="unused", base_url=server.get_base_url())
+        sizes = play_steps(llm, InputParser(VALID_INPUTS), N_STEPS)
+        assert llm.chain_responses
+        assert max(sizes[1:]) <= 2 * min(sizes[1:])
+    finally:
+        server.stop()
+
+
+def test_cut_stream_does_not_block_the_next_prompt():
+    """The rest of a stream cut at the action line isn't waited for"""
+    answer_format = "{inputs}\n" + "Running right to jump over the next pipe. " * 20
+    server = FakeOpenAIServer(VALID_INPUTS, latency=constant_latency(LATENCY), answer_format=answer_format, seed=0).start()
+    try:
+        llm = ChatGPTAPI(ChatGPTModels.NANO_5, api_key="unused", base_url=server.get_base_url())
+        start = time.perf_counter()
+        play_steps(llm, InputParser(VALID_INPUTS), 2)
+        # Each answer's action line arrives after 2 of the 7 events of its stream
+        assert time.perf_counter() - start < LATENCY
+    finally:
+        server.stop()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import numpy as np
+
+from mesen_python.games import FRAME_HASH_SIZE, hash_frames, get_hash_distance
+
+
+def test_frames_are_hashed_on_the_grid():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (2, 240, 256, 3), dtype=np.uint8)
+    frame_hash = hash_frames(frames)
+    assert frame_hash.size == 2 * FRAME_HASH_SIZE * FRAME_HASH_SIZE // 8
+    assert get_hash_distance(frame_hash, hash_frames(frames.copy())) == 0
+    assert get_hash_distance(frame_hash, hash_frames(255 - frames)) > 0
+
+
+def test_frames_smaller_than_the_grid_are_hashed_per_pixel():
+    """A frame under FRAME_HASH_SIZE pixels high or wide has no empty cells"""
+    frames = np.zeros((1, 4, 20, 3), dtype=np.uint8)
+    frames[:, :2] = 255
+    assert np.array_equal(np.unpackbits(hash_frames(frames)), np.repeat([1, 0], 8))
+
+    frame_hash = hash_frames(np.zeros((3, 1, 1, 3), dtype=np.uint8))
+    assert get_hash_distance(frame_hash, hash_frames(np.zeros((3, 1, 1, 3), dtype=np.uint8))) == 0
\ No newline at end of file
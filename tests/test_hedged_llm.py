@@ -0,0 +1,90 @@
+import threading
+import time
+
+import numpy as np
+
+from llm_hedging import HedgedLLM
+from llm_hedging.hedged_llm import HEDGE_PERCENTILE, INITIAL_HEDGE_DELAY, MIN_LATENCY_SAMPLES
+from mesen_python import InputParser
+
+VALID_INPUTS = ["left", "right", "a", "b"]
+
+
+class FakeClock:
+    """Time only moving when the backends advance it, so that the latencies are exact"""
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+    def advance(self, seconds: float):
+        with self.lock:
+            self.now += seconds
+
+
+class FakeBackend:
+    """
+    Answers the given text after advancing the clock by the next latency,
+    or keeps streaming until cancelled when the latency is None
+    """
+    def __init__(self, clock: FakeClock, latencies: list, answer: str):
+        self.clock = clock
+        self.latencies = iter(latencies)
+        self.answer = answer
+        self.n_prompts = 0
+
+
+    def add_text_to_prompt(self, text: str):
+        pass
+
+
+    def send_image_prompt(self, image, input_parser: InputParser=None) -> str:
+        self.n_prompts += 1
+        input_parser.reset()
+        latency = next(self.latencies)
+        if latency is None:
+            while True:
+                input_parser.feed("")
+                time.sleep(0.001)
+        self.clock.advance(latency)
+        return input_parser.feed(self.answer + "\n")
+
+
+def test_hedge_delay_is_percentile_of_primary_latencies():
+    """A primary answering within the hedge delay is never hedged, and its latencies set the next delay"""
+    clock = FakeClock()
+    latencies = [float(i) for i in range(1, 2 * MIN_LATENCY_SAMPLES + 1)]
+    secondary = FakeBackend(clock, [], "left")
+    llm = HedgedLLM(FakeBackend(clock, latencies, "right"), secondary, clock=clock)
+    parser = InputParser(VALID_INPUTS)
+
+    for i, latency in enumerate(latencies):
+        expected_delay = INITIAL_HEDGE_DELAY if i < MIN_LATENCY_SAMPLES else np.percentile(latencies[:i], HEDGE_PERCENTILE)
+        assert llm.get_hedge_delay() == expected_delay
+        assert llm.send_image_prompt("frame.png", parser) == "right"
+
+    assert list(llm.primary_latencies) == latencies
+    assert list(llm.latencies) == latencies
+    assert llm.get_hedge_delay() == np.percentile(latencies, HEDGE_PERCENTILE)
+    assert llm.n_hedged == 0 and secondary.n_prompts == 0
+
+
+def test_slow_primary_is_hedged_and_its_elapsed_time_recorded():
+    """A fast secondary winning a hedged request mustn't shrink the hedge delay"""
+    clock = FakeClock()
+    primary = FakeBackend(clock, [None, None], "right")
+    llm = HedgedLLM(primary, FakeBackend(clock, [3.0, 4.0], "left"), initial_hedge_delay=0, clock=clock)
+    parser = InputParser(VALID_INPUTS)
+
+    assert llm.send_image_prompt("frame.png", parser) == "left"
+    assert llm.send_image_prompt("frame.png", parser) == "left"
+
+    # The cancelled primary had run as long as the secondary took to answer
+    assert list(llm.primary_latencies) == [3.0, 4.0]
+    assert list(llm.latencies) == [3.0, 4.0]
+    assert llm.n_hedged == 2 and llm.n_secondary_wins == 2
+    assert primary.n_prompts == 2
\ No newline at end of file
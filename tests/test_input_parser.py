@@ -0,0 +1,73 @@
+import json
+
+from mesen_python import InputParser, PlanParser
+from mesen_python.mesen import PLAN_PREFIX
+
+VALID_INPUTS = ["left", "right", "up", "down", "a", "b"]
+INPUT_SCHEMA = {"type": "object", "properties": {"inputs": {"type": "array"}}}
+PLAN_SCHEMA = {"type": "object", "properties": {"plan": {"type": "array"}}}
+
+
+def feed_chunks(parser: InputParser, chunks: list) -> tuple:
+    """Returns the first result of the parser and the number of chunks fed to get it"""
+    parser.reset()
+    for i, chunk in enumerate(chunks):
+        result = parser.feed(chunk)
+        if result is not None:
+            return result, i + 1
+    return None, len(chunks)
+
+
+def test_action_line_split_across_chunks():
+    chunks = ["ri", "ght, ", "b", "\nI jump over", " the pipe.\n"]
+    assert feed_chunks(InputParser(VALID_INPUTS), chunks) == ("right,b", 4)
+
+
+def test_lines_before_the_action_line_are_skipped():
+    chunks = ["Mario is on the ground.\n", "Jumping now:\n", "right,a\n", "left\n"]
+    assert feed_chunks(InputParser(VALID_INPUTS), chunks) == ("right,a", 3)
+
+
+def test_invalid_line_is_not_an_action_line():
+    parser = InputParser(VALID_INPUTS)
+    assert feed_chunks(parser, ["right,jump\n", "start\n"]) == (None, 2)
+    assert parser.close() is None
+
+
+def test_last_line_without_newline_is_parsed_on_close():
+    parser = InputParser(VALID_INPUTS)
+    assert feed_chunks(parser, ["righ", "t"]) == (None, 2)
+    assert parser.close() == "right"
+
+
+def test_json_answer_is_complete_once_its_array_is_closed():
+    chunks = ['{"inp', 'uts": ["right", ', '"b", "b"', ']', '}']
+    assert feed_chunks(InputParser(VALID_INPUTS, INPUT_SCHEMA), chunks) == ("right,b", 4)
+
+
+def test_json_answer_with_invalid_inputs():
+    chunks = ['{"inputs": ["right", "jump"]}']
+    assert feed_chunks(InputParser(VALID_INPUTS, INPUT_SCHEMA), chunks) == (None, 1)
+
+
+def test_plan_is_complete_at_the_first_line_after_its_steps():
+    chunks = ["right,b*", "3\n", "*2\nrig", "ht\n", "Then I'll", " wait.\n", "left*4\n"]
+    parser = PlanParser(VALID_INPUTS, max_windows=8)
+    assert feed_chunks(parser, chunks) == ("right,b*3\n*2\nright*1", 6)
+    windows = parser.parse_plan("right,b*3\n*2\nright*1")
+    assert windows == ["right,b"] * 3 + [""] * 2 + ["right"]
+    # Message Game.apply_plan sends to main.lua
+    assert PLAN_PREFIX + ";".join(windows) == "plan:right,b;right,b;right,b;;;right"
+
+
+def test_plan_is_cut_after_max_windows():
+    parser = PlanParser(VALID_INPUTS, max_windows=4)
+    assert feed_chunks(parser, ["right*3\n", "a*3\n", "\n"]) == ("right*3\na*1", 3)
+
+
+def test_json_plan():
+    plan = {"plan": [{"inputs": ["right", "b"], "windows": 2}, {"inputs": [], "windows": 1}]}
+    text = json.dumps(plan)
+    parser = PlanParser(VALID_INPUTS, max_windows=8, response_schema=PLAN_SCHEMA)
+    assert feed_chunks(parser, [text[:20], text[20:-1], text[-1:]]) == ("right,b*2\n*1", 3)
+    assert parser.parse_plan(text) == ["right,b", "right,b", ""]
\ No newline at end of file
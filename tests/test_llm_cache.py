@@ -0,0 +1,28 @@
+from llm_cache import LLMCache, CacheModes
+from mesen_python import InputParser, PlanParser
+
+
+def test_entries_written_by_another_process_are_replayed(tmp_path):
+    """Each process loads the index once, so later entries of the other processes are looked up on disk"""
+    replaying = LLMCache(CacheModes.REPLAY_ONLY, cache_dir=str(tmp_path))
+    recording = LLMCache(CacheModes.RECORD_ONLY, cache_dir=str(tmp_path))
+    key = recording.make_key("model", "", "Progress: 1-1 (10.0 %)", "image")
+    recording.get_or_call(key, lambda: "right,b", "model")
+
+    assert replaying.get_or_call(key, lambda: "left", "model") == "right,b"
+    assert replaying.get_stats()["entries"] == 1
+
+def test_answer_mode_and_schema_are_part_of_the_key(tmp_path):
+    """A full answer, one cut at its action line, a plan and a structured answer to the same prompt differ"""
+    cache = LLMCache(cache_dir=str(tmp_path))
+    valid_inputs = ["left", "right"]
+    schema = {"type": "object", "properties": {"inputs": {"type": "array"}}}
+    parsers = [None, InputParser(valid_inputs), InputParser(valid_inputs, schema),
+               PlanParser(valid_inputs, max_windows=4), PlanParser(valid_inputs, max_windows=8)]
+    keys = [cache.make_key("model", "", "Progress: 1-1 (10.0 %)", "image", parser) for parser in parsers]
+    assert len(set(keys)) == len(parsers)
+    assert keys[2] == cache.make_key("model", "", "Progress: 1-1 (10.0 %)", "image", InputParser(valid_inputs, dict(schema)))
+
+    for key, answer in zip(keys, ["right\nI run.", "right", '{"inputs": ["right"]}', "right*4", "right*8"]):
+        cache.put(key, answer, "model")
+    assert [cache.get(key) for key in keys] == ["right\nI run.", "right", '{"inputs": ["right"]}', "right*4", "right*8"]
\ No newline at end of file
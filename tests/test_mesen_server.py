@@ -0,0 +1,38 @@
+import socket
+import threading
+
+from mesen_python import MesenServer, MockMesen, SMB
+
+MAX_SESSIONS = 2
+N_EMULATORS = 5
+N_WINDOWS = 20
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def play_session(mesen, session_id: str):
+    game = SMB(mesen=mesen, session_id=session_id)
+    game.play()
+    while game.get_progress() != "GAME OVER":
+        game.get_recent_frames()
+        game.apply_inputs("right")
+
+
+def test_queued_sessions_start_once_a_session_ends():
+    port = get_free_port()
+    server = MesenServer(play_session, port=port, max_sessions=MAX_SESSIONS)
+    threading.Thread(target=server.run, daemon=True).start()
+
+    emulators = [MockMesen(port=port, n_windows=N_WINDOWS) for _ in range(N_EMULATORS)]
+    threads = [emulator.start() for emulator in emulators]
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert all(emulator.received_inputs == ["right"] * N_WINDOWS for emulator in emulators)
+    assert server.n_sessions == N_EMULATORS
+    assert server.max_active_sessions <= MAX_SESSIONS
\ No newline at end of file
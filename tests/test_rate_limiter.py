@@ -0,0 +1,67 @@
+import json
+import multiprocessing
+import time
+
+from llm_rate_limiter import RateLimiter
+
+
+TOKENS_PER_MINUTE = 60000  # Refills 1000 tokens per second
+
+
+class FakeModel:
+    def get_model_code(self) -> str:
+        return "fake/model"
+
+    def get_requests_per_minute(self) -> int:
+        return 1000
+
+    def get_tokens_per_minute(self) -> int:
+        return TOKENS_PER_MINUTE
+
+
+def send_requests(rate_limit_dir: str, n_requests: int, tokens: int, used_tokens: int, waiting_times):
+    rate_limiter = RateLimiter(rate_limit_dir, quota_margin=1)
+    for _ in range(n_requests):
+        charged_tokens = rate_limiter.acquire(FakeModel(), tokens)
+        rate_limiter.record_usage(FakeModel(), charged_tokens, used_tokens)
+    waiting_times.put(rate_limiter.waiting_time)
+
+
+def run_processes(rate_limit_dir: str, requests: list) -> list:
+    """Runs the processes sending each list of requests at the same time and returns their waiting times"""
+    context = multiprocessing.get_context("fork")
+    waiting_times = context.Queue()
+    processes = [context.Process(target=send_requests, args=(rate_limit_dir, *request, waiting_times))
+                 for request in requests]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+    return [waiting_times.get() for _ in processes]
+
+
+def get_state(rate_limit_dir) -> dict:
+    with open(rate_limit_dir / "fake_model.json", "r") as f:
+        return json.load(f)
+
+
+def test_processes_share_the_buckets(tmp_path):
+    """No update of the other process is lost, so both requests and tokens end up counted once"""
+    start = time.time()
+    waiting_times = run_processes(str(tmp_path), [(20, 1000, 1200), (20, 1000, 1200)])
+    elapsed = time.time() - start
+
+    assert waiting_times == [0, 0]
+    state = get_state(tmp_path)
+    assert TOKENS_PER_MINUTE - 40 * 1200 <= state["tokens"] <= TOKENS_PER_MINUTE - 40 * 1200 + elapsed * 1000
+
+
+def test_usage_is_corrected_with_the_charged_tokens(tmp_path):
+    """A request larger than the bucket is charged the whole bucket, so the correction starts from it"""
+    assert run_processes(str(tmp_path), [(1, 10 * TOKENS_PER_MINUTE, TOKENS_PER_MINUTE + 300)]) == [0]
+    assert get_state(tmp_path)["tokens"] <= -300 + 100
+
+    # The other process waits for the bucket to refill the tokens used over it
+    waiting_time, = run_processes(str(tmp_path), [(1, 100, 100)])
+    assert waiting_time > 0.2
\ No newline at end of file
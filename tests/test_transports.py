@@ -0,0 +1,70 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from mesen_python import SMB, MockMesen, TCPTransport, UnixTransport, SharedMemoryTransport
+from mesen_python.mesen import Mesen, FRAME_FORMAT_PNG, FRAME_FORMAT_RAW
+
+N_WINDOWS = 5
+INPUT_LENGTH = 30
+N_SCREENSHOTS = 3
+FREQ_SCREENSHOTS = 30  # Consecutive windows share 2 of their 3 frames
+
+
+def create_transport(name: str, tmp_path):
+    if name == "unix":
+        return UnixTransport(os.path.join(tmp_path, "llm4mesen.sock"))
+    if name == "shm":
+        return SharedMemoryTransport(TCPTransport(port=0))
+    return TCPTransport(port=0)
+
+
+def decode(png: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(png)).convert("RGB"))
+
+
+@pytest.mark.parametrize("frame_format", [FRAME_FORMAT_PNG, FRAME_FORMAT_RAW])
+@pytest.mark.parametrize("transport_name", ["tcp", "unix", "shm"])
+def test_incremental_windows_round_trip(transport_name, frame_format, tmp_path):
+    transport = create_transport(transport_name, tmp_path)
+    # One value of LLM4MESEN_TRANSPORT for main.lua per transport
+    assert transport.lua_transport == ("unix" if transport_name == "unix" else "tcp")
+    mesen = Mesen(transport=transport)
+    game = SMB(input_length=INPUT_LENGTH, n_screenshots=N_SCREENSHOTS, freq_screenshots=FREQ_SCREENSHOTS,
+               saved_playthrough_path=str(tmp_path), mesen=mesen, frame_format=frame_format, incremental_frames=True)
+    if transport_name == "unix":
+        mock = MockMesen(unix_socket_path=transport.path, n_windows=N_WINDOWS)
+    else:
+        mock = MockMesen(port=mesen.server.getsockname()[1], n_windows=N_WINDOWS)
+    mock.start()
+
+    try:
+        game.play()
+        assert (game.frame_format, game.incremental_frames) == (frame_format, True)
+        assert (mesen.shared_frames is not None) == (transport_name == "shm")
+
+        previous_numbers = set()
+        for window in range(N_WINDOWS):
+            assert game.get_progress() == mock.progress_function(window, "")
+            numbers = mock.get_window_frame_numbers(window)
+            assert [entry.number for entry in game.pending_frames] == numbers
+            # Frames of the previous window are only referenced by their number
+            reused = [entry.length == 0 for entry in game.pending_frames]
+            assert reused == [number in previous_numbers for number in numbers]
+            assert window == 0 or any(reused)
+            assert all((entry.offset is not None) == (transport_name == "shm") for entry in game.pending_frames)
+
+            game.get_recent_frames()
+            expected = [decode(mock.frames[number % len(mock.frames)]) for number in numbers]
+            assert np.array_equal(game.frames, np.stack(expected))
+            game.apply_inputs("right")
+            previous_numbers = set(numbers)
+
+        assert game.get_progress() == "GAME OVER"
+        mock.thread.join(timeout=10)
+        assert mock.received_inputs == ["right"] * N_WINDOWS
+    finally:
+        mesen.close_shared_frames()
\ No newline at end of file